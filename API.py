@@ -3,14 +3,24 @@ import os
 import base64
 import requests
 import json
+import logging
+import time
+import instrumentation
+
+logger = logging.getLogger(__name__)
 
 class SpotifyAPI:
-    def __init__(self):
+    def __init__(self, cache = None):
+        '''cache : responseCache.ResponseCache -> optional persistent cache used by enrich to skip known IDs
+        '''
         load_dotenv()  # Load environment variables from .env file
         self.tokenURL = "https://accounts.spotify.com/api/token"
         self.clientID = os.getenv("clientID")
         self.clientSecret = os.getenv("clientSecret")
         self.base_URL = "https://api.spotify.com/v1/"
+        # Reuse one keep-alive connection pool for all data requests
+        self.session = requests.Session()
+        self.cache = cache
         
     def get_token(self) -> str:
         '''POST request to auth server to obtain client token for data requests
@@ -26,8 +36,8 @@ class SpotifyAPI:
         
         response = requests.post(url=self.tokenURL, headers=headers, data=data)
         json_result = response.json()
-        print(f"Status Code: {response.status_code}")
-        print(f"Expires in: {json_result['expires_in']} secs")
+        instrumentation.count("spotify_requests_total", endpoint="token", status=response.status_code)
+        logger.info("Token request status %s, expires in %s secs", response.status_code, json_result.get('expires_in'))
         
         return json_result["access_token"]
     
@@ -48,9 +58,14 @@ class SpotifyAPI:
             query_URL = self.base_URL + search_type + '/' + search_param
         headers = self.generate_auth_header(token)
         
-        response = requests.get(url=query_URL, headers=headers)
+        start = time.perf_counter()
+        response = self.session.get(url=query_URL, headers=headers)
+        instrumentation.observe("spotify_request_duration_seconds", time.perf_counter() - start, endpoint=search_type)
+        instrumentation.count("spotify_requests_total", endpoint=search_type, status=response.status_code)
+        instrumentation.count("spotify_response_bytes_total", len(response.content), endpoint=search_type)
+        if(response.status_code == 429) :
+            instrumentation.count("spotify_rate_limited_total", endpoint=search_type)
         json_result = response.json()
-        # print(f"Status Code: {response.status_code}")
         
         return json_result
 
@@ -1,5 +1,7 @@
 # %%
 import pickle
+import bisect
+import logging
 import matplotlib.pyplot as plt
 import networkx as nx
 import community
@@ -7,29 +9,212 @@ import pandas as pd
 import numpy as np
 from networkx.algorithms.community import girvan_newman
 from cdlib import algorithms
+from graphBuilder import build_graph, PLAYLIST_MEMBERSHIP
+from graphStore import CSRGraph, is_graph_store
+from centrality import bfs_centralities, eigenvector_centrality, PageRankEngine
+from playlistContinuation import PlaylistScorer
+from embeddings import train_embeddings, EmbeddingIndex, has_embeddings
+from audioIndex import AudioIndex, get_audio_index, AUDIO_FEATURES
+import featureStore
+import instrumentation
+from communities import louvain_sweep, divisive_girvan_newman, labels_from_communities, communities_from_labels
+from graphStats import core_numbers, k_core_sizes, clustering_coefficients, average_clustering, path_length_stats
+from attributeTable import columnar_graph
+from graphExport import export_graph
+from parquetStore import write_parquet, read_parquet, is_parquet_graph
+
+logger = logging.getLogger(__name__)
 
 
 class NetworkAnalysis : 
     
-    def __init__(self, pickle_file, song_data) -> None:
-        # Load graph
-        with open(pickle_file, 'rb') as f :
-            self.G = pickle.load(f)
-            
+    @instrumentation.timed("stage_duration_seconds")
+    def __init__(self, pickle_file, song_data = None) -> None:
+        # Load graph. An interactions_X.csv file is turned into the co-occurrence graph directly and a
+        # graph store directory (see graphStore) is memory-mapped, its networkX graph is only built on first use.
+        # Node attributes are kept column-wise (see attributeTable). A Parquet directory (see parquetStore) is
+        # read back with its enrichment
+        self._G = None
+        self._csr = None
+        self._song_data = None
+        self._bfs_stats = None
+        self._path_stats = None
+        self._pagerank_engine = None
+        self._playlist_scorer = None
+        self._store_path = None
+        self._embeddings = None
+        self._embeddings_checked = False
+        self._playlist_tracks = None
+        self.dirty_nodes = set()
+        self.dirty_communities = {}
+        self.girvan_newman_dendrogram = None
+        if(is_graph_store(pickle_file)) :
+            self._csr = CSRGraph.load(pickle_file)
+            self._song_data = song_data
+            self._store_path = pickle_file
+            return
+        if(is_parquet_graph(pickle_file)) :
+            self._G = read_parquet(pickle_file)
+        elif(str(pickle_file).endswith(".csv")) :
+            self._G = columnar_graph(build_graph(pickle_file))
+        else :
+            with open(pickle_file, 'rb') as f :
+                self._G = columnar_graph(pickle.load(f))
+        if(song_data is not None) :
+            self._add_song_data(song_data)
+
+
+    @property
+    def G(self) -> nx.Graph :
+        if(self._G is None) :
+            with instrumentation.timer("stage_duration_seconds", stage="NetworkAnalysis.G") :
+                self._G = columnar_graph(self._csr.to_networkx())
+                if(self._song_data is not None) :
+                    self._add_song_data(self._song_data)
+        return self._G
+
+
+    @G.setter
+    def G(self, G : nx.Graph) -> None :
+        self._G = columnar_graph(G)
+        self._csr = None
+        self._playlist_tracks = None
+        # A different graph: embeddings and the store belong to the old one
+        self._embeddings = None
+        self._store_path = None
+
+
+    @property
+    def csr(self) -> CSRGraph :
+        '''CSR view of the graph, the memory-mapped store when the graph was opened from one'''
+        if(self._csr is None) :
+            self._csr = CSRGraph.from_networkx(self.G, node_attributes=[], with_playlists=False)
+        return self._csr
+
+
+    def _add_song_data(self, song_data) -> None :
         # Reading the song G file to enrich network nodes with song name.
         # Node names are the song URI which is not easily readable
-        song_data = pd.read_csv(song_data)
-        song_name_dict = dict(zip(song_data["song_id"], song_data["song_name"]))
-        artist_name_dict = dict(zip(song_data["song_id"], song_data["artist_name"]))
-        album_name_dict = dict(zip(song_data["song_id"], song_data["album_name"]))
-        artist_URI_dict = dict(zip(song_data["song_id"], song_data["artist_uri"]))
-        album_URI_dict = dict(zip(song_data["song_id"], song_data["album_uri"]))
+        if(not isinstance(song_data, pd.DataFrame)) :
+            song_data = pd.read_csv(song_data)
+        # Songs that are not in the graph are skipped and the last row of a repeated song wins
+        song_data = song_data[song_data["song_id"].isin(list(self.G))].drop_duplicates("song_id", keep="last")
+        nodes = song_data["song_id"].tolist()
+        for column, attr in [("song_name", "Track Name"), ("artist_name", "Artist Name"), ("album_name", "Album Name"),
+                             ("artist_uri", "Artist URI"), ("album_uri", "Album URI")] :
+            self.G.table.set_column(attr, nodes, song_data[column].tolist())
+
+
+    def _set_node_column(self, attr : str, values : np.ndarray) -> None :
+        # Write an attribute given in csr row order as one column
+        self.G.table.set_column(attr, self.csr.nodes.tolist(), values)
+
+
+    @instrumentation.timed("stage_duration_seconds")
+    def save_store(self, path : str) -> None :
+        '''Write the graph with all node attributes to a memory-mappable graph store directory'''
+        CSRGraph.from_networkx(self.G).save(path)
+
+
+    @instrumentation.timed("stage_duration_seconds")
+    def save_parquet(self, path : str) -> None :
+        '''Write the enriched graph as typed nodes.parquet / edges.parquet files, readable by pandas and by NetworkAnalysis(path)'''
+        write_parquet(self.G, path)
+
+
+    @instrumentation.timed("stage_duration_seconds")
+    def add_interactions(self, interactions, song_data = None) -> set :
+        '''Ingest new playlist_id,song_id rows into the graph in place. Co-occurrence weights and
+        common_playlists are updated only for the pairs the new rows create, and every touched track is marked
+        dirty together with its communities, so downstream metrics and enrichment can be refreshed
+        incrementally (e.g. pageRank() warm-starts, enrich.plan_batches(skip_attribute=...) skips enriched tracks).
+        Existing playlists are looked up in the graph's playlist membership (see graphBuilder.PLAYLIST_MEMBERSHIP),
+        which is extended with the new rows and saved with the graph
+        interactions : str/pd.DataFrame -> interactions_X.csv style rows, playlists may be new or existing
+        song_data : str/pd.DataFrame -> song_data_X.csv style rows for the new tracks
+
+        returns : set of nodes touched by this update'''
+        if(not isinstance(interactions, pd.DataFrame)) :
+            interactions = pd.read_csv(interactions)
+        playlist_tracks = self._playlist_index()
+        G = self.G
+
+        touched = set()
+        new_nodes = []
+        new_playlists = []
+        new_songs = []
+        for playlist, songs in interactions.groupby("playlist_id", sort=False)["song_id"] :
+            playlist = int(playlist)
+            existing = playlist_tracks.setdefault(playlist, set())
+            added = [song for song in dict.fromkeys(songs.tolist()) if song not in existing]
+            for song in added :
+                if(song not in G) :
+                    G.add_node(song)
+                    new_nodes.append(song)
+            # New pairs: every added song with the songs already in the playlist and with the other added songs
+            for i, song in enumerate(added) :
+                for other in list(existing) + added[i + 1 :] :
+                    if(G.has_edge(song, other)) :
+                        edge = G[song][other]
+                        edge["weight"] += 1
+                        if("common_playlists" in edge) :
+                            bisect.insort(edge["common_playlists"], playlist)
+                    else :
+                        G.add_edge(song, other, weight=1, common_playlists=[playlist])
+                    touched.update((song, other))
+            existing.update(added)
+            touched.update(added)
+            new_playlists.extend([playlist] * len(added))
+            new_songs.extend(added)
+
+        playlists, songs = G.graph[PLAYLIST_MEMBERSHIP]
+        G.graph[PLAYLIST_MEMBERSHIP] = (np.concatenate([playlists, np.asarray(new_playlists, dtype=np.int64)]),
+                                        np.concatenate([songs, np.asarray(new_songs, dtype=object)]))
+
+        if(song_data is not None and new_nodes) :
+            if(not isinstance(song_data, pd.DataFrame)) :
+                song_data = pd.read_csv(song_data)
+            self._add_song_data(song_data[song_data["song_id"].isin(new_nodes)])
 
-        nx.set_node_attributes(self.G, song_name_dict, "Track Name")
-        nx.set_node_attributes(self.G, artist_name_dict, "Artist Name")
-        nx.set_node_attributes(self.G, album_name_dict, "Album Name")
-        nx.set_node_attributes(self.G, artist_URI_dict, "Artist URI")
-        nx.set_node_attributes(self.G, album_URI_dict, "Album URI")
+        # Derived views of the old graph are stale now. The store still holds the old graph, so embeddings are
+        # neither loaded from nor saved into it any more
+        self._csr = None
+        self._embeddings = None
+        self._store_path = None
+        featureStore.invalidate(G, new_nodes)
+        self.dirty_nodes.update(touched)
+        for node in touched :
+            for attr, value in G.nodes[node].items() :
+                if(attr.endswith("Community")) :
+                    self.dirty_communities.setdefault(attr, set()).add(value)
+        return touched
+
+
+    def _playlist_index(self) -> dict :
+        # playlist ID -> set of its tracks, built once from the playlist membership the graph was built with
+        if(self._playlist_tracks is None) :
+            self._playlist_tracks = {}
+            membership = self.G.graph.get(PLAYLIST_MEMBERSHIP)
+            if(membership is not None) :
+                for playlist, song in zip(np.asarray(membership[0]).tolist(), np.asarray(membership[1], dtype=object).tolist()) :
+                    self._playlist_tracks.setdefault(playlist, set()).add(song)
+            else :
+                # Graphs from older pickles only have common_playlists: single-track playlists are not recoverable
+                logger.warning("Graph has no playlist membership, recovering it from common_playlists; "
+                               "playlists with a single track are missing from it")
+                for u, v, playlists in self.G.edges(data="common_playlists") :
+                    for playlist in playlists or [] :
+                        self._playlist_tracks.setdefault(playlist, set()).update((u, v))
+                pairs = [(playlist, song) for playlist, songs in self._playlist_tracks.items() for song in songs]
+                self.G.graph[PLAYLIST_MEMBERSHIP] = (np.array([p for p, _ in pairs], dtype=np.int64),
+                                                     np.array([song for _, song in pairs], dtype=object))
+        return self._playlist_tracks
+
+
+    def clear_dirty(self) -> None :
+        '''Forget the dirty marks once downstream metrics have been refreshed'''
+        self.dirty_nodes = set()
+        self.dirty_communities = {}
 
 
     def display_nodes(self) :
@@ -37,8 +222,15 @@ class NetworkAnalysis :
             print(f"Node : {node}\nattrs : {attrs}")
     
     
-    def diameter(self) -> int :
-        return nx.diameter(self.G)
+    @instrumentation.timed("stage_duration_seconds")
+    def diameter(self, exact : bool = False, num_sources : int = 256, seed : int = None) -> int :
+        # Largest diameter over the connected components. Exact when bfs_centralities() already ran on the whole
+        # graph or exact=True, otherwise the double-sweep lower bound of path_statistics(), whose
+        # "diameter_upper_bound" tells how tight it is
+        stats = self._cached_bfs_stats()
+        if(stats is not None) :
+            return stats["diameter"]
+        return self.path_statistics(exact=exact, num_sources=num_sources, seed=seed)["diameter"]
     
     
     def avgDegree(self) -> int :
@@ -46,12 +238,42 @@ class NetworkAnalysis :
         return sum(dict(self.G.degree()).values()) / self.G.number_of_nodes()
     
     
-    def avg_path_length(self) -> float :
-        return nx.average_shortest_path_length(self.G) 
+    @instrumentation.timed("stage_duration_seconds")
+    def avg_path_length(self, exact : bool = False, num_sources : int = 256, seed : int = None) -> float :
+        # Mean shortest path length over all connected node pairs, the same value as nx.average_shortest_path_length
+        # on a connected graph. Estimated from num_sources BFS sources per component unless exact=True
+        return self.path_statistics(exact=exact, num_sources=num_sources, seed=seed)["avg_path_length"]
+
+
+    @instrumentation.timed("stage_duration_seconds")
+    def path_statistics(self, exact : bool = False, num_sources : int = 256, confidence : float = 0.95, seed : int = None) -> dict :
+        '''Average path length and diameter per connected component with confidence intervals and diameter
+        bounds, see graphStats.path_length_stats. The last result is reused while the graph is unchanged, so
+        avg_path_length() and diameter() share one set of BFS passes'''
+        params = (exact, num_sources, confidence, seed)
+        cached = self._path_stats
+        # An exact result answers every request
+        if(cached is not None and cached[0] is self._csr and (cached[1] == params or cached[2]["exact"])) :
+            return cached[2]
+        stats = path_length_stats(self.csr, num_sources=num_sources, exact=exact, confidence=confidence, seed=seed)
+        self._path_stats = (self.csr, params, stats)
+        return stats
     
     
+    @instrumentation.timed("stage_duration_seconds")
     def avgClusteringCoefficient(self) -> float:
-        return nx.average_clustering(self.G)
+        # Triangles are counted with sparse matrix products, see graphStats.triangles
+        return average_clustering(self.csr)
+
+
+    @instrumentation.timed("stage_duration_seconds")
+    def clustering(self) -> dict :
+        '''
+        Local clustering coefficient of every node, also stored as the "Clustering Coefficient" node attribute
+        '''
+        coefficients = clustering_coefficients(self.csr)
+        self._set_node_column("Clustering Coefficient", coefficients)
+        return dict(zip(self.csr.nodes.tolist(), coefficients.tolist()))
     
     
     def draw_network(self) -> None : 
@@ -70,46 +292,37 @@ class NetworkAnalysis :
                     self.G[u][v][attr] = str(value)
 
 
-    def save_graph(self) -> None :
-        # Write networkX graph into a gephi readable file format - gexf/ graphML
-        # Convert all node attributes to strings
-        for node, attrs in self.G.nodes(data=True):
-            for attr, value in attrs.items():
-                # Convert each attribute value to string
-                if(isinstance(value, list)) :
-                    self.G.nodes[node][attr] = str(value)
-
-        # Convert all edge attributes to strings
-        for u, v, attrs in self.G.edges(data=True):
-            for attr, value in attrs.items():
-                # Convert each attribute value to string
-                if(isinstance(value, list)) :
-                    self.G[u][v][attr] = str(value)
-        nx.write_gexf(self.G, "bigGraph.gexf")
-        nx.write_graphml(self.G, "bigGraph.graphml")
+    @instrumentation.timed("stage_duration_seconds")
+    def save_graph(self, gexf_path : str = "bigGraph.gexf", graphml_path : str = "bigGraph.graphml", compress : bool = False) -> list :
+        # Write networkX graph into a gephi readable file format - gexf/ graphML. Both files are streamed at the
+        # same time and list attributes are stringified on the way out, G itself is not modified (see graphExport)
+        return export_graph(self.G, gexf_path=gexf_path, graphml_path=graphml_path, compress=compress)
         
         
-    def to_dataframe(self) -> pd.DataFrame :
-        df = pd.DataFrame.from_dict(dict(self.G.nodes(data=True)), orient='index')
-        df = df.reset_index()
-        df.rename(columns={'index': 'Track URI'}, inplace=True)
-        df.to_csv('./BigGraphData.csv')
+    @instrumentation.timed("stage_duration_seconds")
+    def to_dataframe(self, path : str = './BigGraphData.csv') -> pd.DataFrame :
+        # Built column by column from the attribute table, numeric columns are not copied.
+        # path -> CSV file to write as well, None to skip it
+        df = self.G.table.to_pandas().reset_index(names='Track URI')
+        if(path is not None) :
+            df.to_csv(path)
         return df
     
     
+    @instrumentation.timed("stage_duration_seconds")
     def get_connected_components(self) -> None :
         # Get connected components in the network
         CCs = list(nx.connected_components(self.G))
         print(f"Number of CCs : {len(CCs)}")
     
     
-    def k_core_analysis(self) -> None :
-        #Get k-core metrics
-        k_values = range(3, 100)
-        data = [] 
-        for k in k_values :
-            k_core = nx.k_core(self.G, k = k)
-            data.append(k_core.number_of_nodes())
+    @instrumentation.timed("stage_duration_seconds")
+    def k_core_analysis(self, k_values = range(3, 100)) -> None :
+        #Get k-core metrics. Core numbers come from one peeling pass and are stored as "Core Number", the
+        #k-core sizes for any k range are then read off their histogram
+        core = core_numbers(self.csr)
+        self._set_node_column("Core Number", core)
+        k_values, data = k_core_sizes(core, k_values)
 
         plt.plot(k_values, data)
         plt.xlabel("k")
@@ -118,25 +331,48 @@ class NetworkAnalysis :
         plt.show()
 
 
-    def plot_centrality_measures(self) -> None:
-            """Freeman's centrality measures and creating histograms for each centrality measure."""
+    @instrumentation.timed("stage_duration_seconds")
+    def bfs_centralities(self, approximate : bool = False, epsilon : float = 0.05, delta : float = 0.1, n_jobs : int = 1) -> dict :
+        '''Betweenness, closeness, eccentricity and diameter from one shared set of BFS passes, see
+        centrality.bfs_centralities. Exact results are kept and reused by eccentricity() and diameter()
+        approximate : bool -> sample BFS sources so that estimates are within epsilon with probability 1 - delta
+        n_jobs : int -> number of worker processes running the BFS batches
+        '''
+        stats = bfs_centralities(self.csr, approximate=approximate, epsilon=epsilon, delta=delta, n_jobs=n_jobs)
+        if(stats["num_sources"] == self.csr.num_nodes) :
+            self._bfs_stats = (self.csr, stats)
+        return stats
+
+
+    def _cached_bfs_stats(self) -> dict :
+        # Exact BFS statistics of the current graph, None if they were not computed yet
+        cached = self._bfs_stats
+        if(cached is None or cached[0] is not self._csr) :
+            return None
+        return cached[1]
+
+
+    @instrumentation.timed("stage_duration_seconds")
+    def plot_centrality_measures(self, approximate : bool = False, epsilon : float = 0.05, delta : float = 0.1, n_jobs : int = 1) -> None:
+            """Freeman's centrality measures and creating histograms for each centrality measure.
+            Betweenness and closeness (and eccentricity, stored on the side) come from bfs_centralities, pass
+            approximate=True to estimate them from a sample of BFS sources on large graphs."""
             degree_centrality = nx.degree_centrality(self.G)
             nx.set_node_attributes(self.G, degree_centrality, "Degree Centrality")
             
-            betweenness_centrality = nx.betweenness_centrality(self.G)
-            nx.set_node_attributes(self.G, betweenness_centrality, "Betweenness Centrality")
+            stats = self.bfs_centralities(approximate=approximate, epsilon=epsilon, delta=delta, n_jobs=n_jobs)
+            self._set_node_column("Betweenness Centrality", stats["betweenness"])
+            self._set_node_column("Closeness Centrality", stats["closeness"])
+            self._set_node_column("Eccentricity", stats["eccentricity"])
             
-            closeness_centrality = nx.closeness_centrality(self.G)
-            nx.set_node_attributes(self.G, closeness_centrality, "Closeness Centrality")
-            
-            eigenvector_centrality = nx.eigenvector_centrality(self.G)
-            nx.set_node_attributes(self.G, eigenvector_centrality, "Eigenvector Centrality")
+            eigenvector = eigenvector_centrality(self.csr, x0=self._warm_start("Eigenvector Centrality"))
+            self._set_node_column("Eigenvector Centrality", eigenvector)
 
             fig, axs = plt.subplots(2, 2, figsize=(14, 10))
             self._plot_histogram(axs[0, 0], list(degree_centrality.values()), 'Degree Centrality', 'skyblue')
-            self._plot_histogram(axs[0, 1], list(betweenness_centrality.values()), 'Betweenness Centrality', 'lightgreen')
-            self._plot_histogram(axs[1, 0], list(closeness_centrality.values()), 'Closeness Centrality', 'lightcoral')
-            self._plot_histogram(axs[1, 1], list(eigenvector_centrality.values()), 'Eigenvector Centrality', 'wheat')
+            self._plot_histogram(axs[0, 1], stats["betweenness"], 'Betweenness Centrality', 'lightgreen')
+            self._plot_histogram(axs[1, 0], stats["closeness"], 'Closeness Centrality', 'lightcoral')
+            self._plot_histogram(axs[1, 1], eigenvector, 'Eigenvector Centrality', 'wheat')
             plt.tight_layout()
             plt.show()
 
@@ -165,51 +401,164 @@ class NetworkAnalysis :
             # ax.text(mode_val, ax.get_ylim()[1]*0.75, 'Mode', ha='right', color='g') # If you decide to include mode
     
     
+    @instrumentation.timed("stage_duration_seconds")
     def eccentricity(self) :
         '''
         Calculate eccentricity and update it as a node attribute
         '''
-        eccentricity = nx.eccentricity(self.G)
-        nx.set_node_attributes(self.G, eccentricity, "Eccentricity")
-        return eccentricity
+        stats = self._cached_bfs_stats()
+        if(stats is None) :
+            stats = self.bfs_centralities()
+        # Computed per connected component, so unlike nx.eccentricity this also works on disconnected graphs
+        self._set_node_column("Eccentricity", stats["eccentricity"])
+        return dict(zip(self.csr.nodes.tolist(), stats["eccentricity"].tolist()))
     
     
-    def pageRank(self, alpha : float = 0.85, tol : float = 1e-3, max_iter : int = 100) :
+    @instrumentation.timed("stage_duration_seconds")
+    def pageRank(self, alpha : float = 0.85, tol : float = 1e-3, max_iter : int = 100, warm_start : bool = True) :
         '''Calculate pagerank for all nodes in the network
         alpha : float -> damping paramter, default = 0.85
         tol : float -> Error tolerance used to check convergence in power method solver.
         max_iter : int -> Maximum number of iterations in power method eigenvalue solver.
+        warm_start : bool -> start from the stored PageRank attribute, so reruns after small graph updates converge in a few iterations
         '''
-        pageRank = nx.pagerank(self.G, alpha=alpha, tol=tol, max_iter=max_iter)
-        nx.set_node_attributes(self.G, pageRank, "PageRank")
+        x0 = self._warm_start("PageRank") if warm_start else None
+        pageRank = self.pagerank_engine.run(alpha=alpha, x0=x0, tol=tol, max_iter=max_iter)
+        self._set_node_column("PageRank", pageRank)
+
+
+    @property
+    def pagerank_engine(self) -> PageRankEngine :
+        '''Sparse PageRank engine of the current graph, built once per CSR view'''
+        if(self._pagerank_engine is None or self._pagerank_engine[0] is not self.csr) :
+            self._pagerank_engine = (self.csr, PageRankEngine(self.csr))
+        return self._pagerank_engine[1]
+
+
+    def _warm_start(self, attr : str) -> np.ndarray :
+        # Previous values of a centrality attribute in csr row order, nodes without one start from the mean
+        if(self._G is None) :
+            return None
+        values = np.asarray(self.G.table.column(attr, self.csr.nodes.tolist()), dtype=np.float64)
+        known = np.isfinite(values)
+        if not known.any() :
+            return None
+        values[~known] = values[known].mean()
+        return values if values.sum() > 0 else None
+
+
+    @instrumentation.timed("stage_duration_seconds")
+    def personalized_pageRank(self, seed_tracks : list, k : int = 10, alpha : float = 0.85, tol : float = 1e-6) -> list :
+        '''Recommend tracks for a user by PageRank personalized on the tracks they played, an alternative
+        recommendation source to graphWalk
+        seed_tracks : list -> track nodes to personalize on
+        k : int -> number of recommendations, seed tracks excluded
+
+        returns : list of (track node, score) sorted by descending score'''
+        rows, scores = self.pagerank_engine.personalized(self.csr.indices_of(seed_tracks), k=k, alpha=alpha, tol=tol)
+        return list(zip(self.csr.nodes[rows].tolist(), scores.tolist()))
+
+
+    @property
+    def playlist_scorer(self) -> PlaylistScorer :
+        # Scorer over the current graph, rebuilt after the graph changes
+        if(self._playlist_scorer is None or self._playlist_scorer.csr is not self.csr) :
+            # The networkX graph is only attached when a feature blend needs its attributes
+            self._playlist_scorer = PlaylistScorer(self.csr, self._G)
+        return self._playlist_scorer
+
+
+    def continue_playlist(self, seed_tracks : list, k : int = 10, feature_weight : float = 0.0, attributes : list = ['popularity']) -> list :
+        '''Continue a playlist with the tracks co-occurring most with all of its tracks, see playlistContinuation
+        seed_tracks : list -> tracks already in the playlist, excluded from the results
+        feature_weight : float -> share of audio-feature similarity to the playlist in the score
+
+        returns : list of (track node, score) sorted by descending score'''
+        scorer = self.playlist_scorer
+        if(feature_weight and scorer.G is None) :
+            scorer.G = self.G
+        return scorer.continue_playlist(seed_tracks, k=k, feature_weight=feature_weight, attributes=attributes)
+
+
+    def train_embeddings(self, dimensions : int = 64, num_walks : int = 10, walk_length : int = 40, window : int = 5,
+                         teleport : float = 0.0, n_jobs : int = 1, seed : int = None, path : str = None) -> EmbeddingIndex :
+        '''Learn track embeddings from weighted random walks, see embeddings.train_embeddings
+        path : str -> directory to save the index in, default the graph store this analysis was opened from (if any,
+        and only while the graph is unchanged, see add_interactions)
+
+        returns : EmbeddingIndex, also kept for similar_tracks()'''
+        # Workers memory-map the store when there is one instead of receiving the arrays
+        source = self._store_path if self._store_path is not None and self._G is None else self.csr
+        self._embeddings = train_embeddings(source, dimensions=dimensions, num_walks=num_walks, walk_length=walk_length,
+                                            window=window, teleport=teleport, n_jobs=n_jobs, seed=seed)
+        path = path or self._store_path
+        if(path is not None) :
+            self._embeddings.save(path)
+        return self._embeddings
+
+
+    @property
+    def embeddings(self) -> EmbeddingIndex :
+        '''Track embedding index: the last trained one, else the one saved beside the graph store if it was trained
+        on this version of the graph, else None'''
+        if(self._embeddings is None and not self._embeddings_checked and self._store_path is not None and has_embeddings(self._store_path)) :
+            # The store is only checked once, a mismatch stays one until train_embeddings() replaces the index
+            self._embeddings_checked = True
+            embeddings = EmbeddingIndex.load(self._store_path)
+            if(embeddings.trained_on(self.csr)) :
+                self._embeddings = embeddings
+            else :
+                logger.warning("Embeddings in %s were trained on another version of the graph, ignoring them; "
+                               "call train_embeddings() to retrain", self._store_path)
+        return self._embeddings
+
+
+    @instrumentation.timed("stage_duration_seconds")
+    def similar_tracks(self, tracks : list, k : int = 10) -> list :
+        '''Nearest tracks in embedding space of every given track, the track itself excluded
+
+        returns : one list of (track node, cosine similarity) per track, best first'''
+        if(self.embeddings is None) :
+            raise ValueError("No track embeddings, call train_embeddings() first")
+        return self.embeddings.similar(tracks, k=k)
+
+
+    def audio_index(self, attributes : list = AUDIO_FEATURES) -> AudioIndex :
+        '''Approximate nearest-neighbour index over the standardised audio features, shared per attribute subset
+        and updated as tracks are enriched, see audioIndex'''
+        return get_audio_index(self.G, attributes)
+
+
+    def sound_alikes(self, track, k : int = 10, attributes : list = AUDIO_FEATURES) -> list :
+        '''Tracks of the whole catalogue closest to track in audio-feature space
+
+        returns : list of (track node, distance), nearest first'''
+        return self.audio_index(attributes).similar(track, k=k)
         
         
-    def girvan_newman(self, num_communities = 10) -> list :
+    @instrumentation.timed("stage_duration_seconds")
+    def girvan_newman(self, num_communities = 10, sample_size = None, full_dendrogram = False, seed = None) -> list :
         """
-        Implement the Girvan-Newman algorithm for community detection.
+        Implement the Girvan-Newman algorithm for community detection. Edge betweenness is only recomputed
+        inside the component an edge was removed from (see communities.divisive_girvan_newman), and the splits
+        are kept in self.girvan_newman_dendrogram so other community counts can be read off without rerunning.
         
         Parameters:
         - G: A NetworkX graph.
         - num_communities: Desired number of communities. The algorithm stops when this number is reached.
+        - sample_size: Estimate edge betweenness from this many sampled sources per component, None for exact.
+        - full_dendrogram: Keep splitting until no edges are left instead of stopping at num_communities.
+        - seed: Seed of the sampled sources, so a sampled run can be reproduced.
         
         Returns:
-        - A list of sets, where each set contains the nodes in one community.
+        - A list of lists, where each list contains the nodes in one community.
         """
-        G_copy = self.G.copy()
-        communities = []
-        while(len(communities) < num_communities) :
-            edge_betweeness = nx.edge_betweenness_centrality(G_copy)
-            max_edge = max(edge_betweeness, key=edge_betweeness.get)
-            G_copy.remove_edge(*max_edge)
-            
-            communities = [list(c) for c in nx.connected_components(G_copy)]
-            
-            if(G_copy.number_of_edges() == 0 ) :
-                break
-        
-        return communities
+        max_communities = None if full_dendrogram else num_communities
+        self.girvan_newman_dendrogram = divisive_girvan_newman(self.G, max_communities=max_communities, sample_size=sample_size, seed=seed)
+        return self.girvan_newman_dendrogram.communities_at(num_communities)
     
     
+    @instrumentation.timed("stage_duration_seconds")
     def get_louvain(self, resolution = 1) -> list :
         """
         Implement the louvain algorithm for community detection.
@@ -221,18 +570,45 @@ class NetworkAnalysis :
         Returns:
         - A list of sets, where each set contains the nodes in one community.
         """
-        communities_dict = {}
-        louvain_communities = nx.community.louvain_communities(self.G, resolution=resolution)
-        for index, item in enumerate(louvain_communities) :
-            for track in item :
-                newDict = {track : index}
-                communities_dict.update(newDict)
-                
-        nx.set_node_attributes(self.G, communities_dict, "Louvain Community")
+        # One run over the integer CSR graph, its labels come back as an array in csr row order
+        labels = louvain_sweep(self.csr, resolutions=(resolution,))[0]["labels"]
+        self._set_node_column("Louvain Community", labels)
         
-        return louvain_communities
+        return communities_from_labels(labels, self.csr.nodes)
     
     
+    def _set_community_labels(self, communities : list, attr : str) -> None :
+        # Community indices as an integer label array in csr row order, written as one column
+        labels = labels_from_communities([self.csr.indices_of(list(community)) for community in communities], self.csr.num_nodes)
+        assigned = labels >= 0
+        if(assigned.all()) :
+            self._set_node_column(attr, labels)
+        else :
+            self.G.table.set_column(attr, self.csr.nodes[assigned].tolist(), labels[assigned])
+
+
+    @instrumentation.timed("stage_duration_seconds")
+    def louvain_sweep(self, resolutions : list = (0.5, 0.8, 1.0, 1.2, 1.5), seeds : list = (None,), n_jobs : int = 1, write_best : bool = True) -> list :
+        """
+        Run Louvain for several resolutions and seeds in parallel over one shared CSR graph (see communities.louvain_sweep).
+        
+        Parameters:
+        - resolutions: Resolutions to compare.
+        - seeds: Random seeds per resolution.
+        - n_jobs: Number of worker processes.
+        - write_best: Store the labels of the run with the highest modularity as "Louvain Community".
+        
+        Returns:
+        - A list of runs with resolution, seed, labels (int array in csr row order), num_communities, modularity and runtime.
+        """
+        runs = louvain_sweep(self.csr, resolutions=resolutions, seeds=seeds, n_jobs=n_jobs)
+        if(write_best and runs) :
+            best = max(runs, key=lambda run : run["modularity"])
+            self._set_node_column("Louvain Community", best["labels"])
+        return runs
+    
+    
+    @instrumentation.timed("stage_duration_seconds")
     def walktrap(self) -> list :
         """
         Implement the walktrap algorithm for community detection.
@@ -243,18 +619,13 @@ class NetworkAnalysis :
         Returns:
         - A list of sets, where each set contains the nodes in one community.
         """
-        communities_dict = {}
         walktrap_communities = algorithms.walktrap(self.G)
-        for index, item in enumerate(walktrap_communities.communities) :
-            for track in item :
-                newDict = {track : index}
-                communities_dict.update(newDict)
-                
-        nx.set_node_attributes(self.G, communities_dict, "Walktrap Community")
+        self._set_community_labels(walktrap_communities.communities, "Walktrap Community")
         
         return walktrap_communities.communities
     
     
+    @instrumentation.timed("stage_duration_seconds")
     def infomap(self) -> list :
         """
         Implement the Structural algorithm(infomap) for community detection.
@@ -265,14 +636,8 @@ class NetworkAnalysis :
         Returns:
         - A list of sets, where each set contains the nodes in one community.
         """
-        communities_dict = {}
         infomap_communities = algorithms.infomap(self.G)
-        for index, item in enumerate(infomap_communities.communities) :
-            for track in item :
-                newDict = {track : index}
-                communities_dict.update(newDict)
-                
-        nx.set_node_attributes(self.G, communities_dict, "Infomap Community")
+        self._set_community_labels(infomap_communities.communities, "Infomap Community")
         
         return infomap_communities.communities
 
@@ -0,0 +1,152 @@
+import asyncio
+import base64
+import email.utils
+import json
+import logging
+import time
+from datetime import datetime, timezone
+import aiohttp
+from API import SpotifyAPI
+import instrumentation
+
+'''Concurrent Spotify client for enrichment. All batch requests share one aiohttp session, so connections
+are kept alive between requests, and at most `max_concurrency` requests are in flight at once. 429 responses
+are retried after the server's Retry-After delay, 5xx responses, dropped connections and timeouts with
+exponential backoff, and the client token is refreshed before it expires. A batch that still fails is logged
+and returned as None, the other batches are kept. mockSpotify serves a local API to run the client against.'''
+
+logger = logging.getLogger(__name__)
+
+
+def _retry_after(value : str, default : float = 1.0) -> float :
+    '''Seconds to wait from a Retry-After header, which holds delta-seconds or an HTTP date'''
+    if(value is None) :
+        return default
+    try :
+        return max(float(value), 0.0)
+    except ValueError :
+        pass
+    try :
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError) :
+        return default
+    if(when.tzinfo is None) :
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class SpotifyRequestError(Exception) :
+    '''A batch request still failed after all retries'''
+
+
+class AsyncSpotifyAPI(SpotifyAPI) :
+    '''SpotifyAPI that sends batch queries concurrently
+    max_concurrency : int -> maximum number of requests in flight
+    max_retries : int -> attempts per request before SpotifyRequestError is raised
+    timeout : float -> seconds per request attempt
+    backoff : float -> delay before the first retry of a 5xx, dropped connection or timeout, doubled on each retry
+    base_URL / token_URL : str -> override the Spotify endpoints, e.g. to point at a local mock server
+    cache : responseCache.ResponseCache -> optional persistent response cache'''
+
+    def __init__(self, max_concurrency : int = 8, max_retries : int = 5, timeout : float = 30, backoff : float = 0.5,
+                 base_URL : str = None, token_URL : str = None, cache = None) -> None :
+        super().__init__(cache=cache)
+        if(base_URL is not None) :
+            self.base_URL = base_URL
+        if(token_URL is not None) :
+            self.tokenURL = token_URL
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self._token = None
+        self._token_expiry = 0
+        self._token_lock = None
+
+    async def get_token_async(self, session : aiohttp.ClientSession) -> str :
+        '''POST request to auth server to obtain a client token, remembers when it expires'''
+        authBase64 = str(base64.b64encode(f"{self.clientID}:{self.clientSecret}".encode("utf-8")), "utf-8")
+        headers = {
+            "Authorization": "Basic " + authBase64,
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        async with session.post(self.tokenURL, headers=headers, data={"grant_type": "client_credentials"}) as response :
+            instrumentation.count("spotify_requests_total", endpoint="token", status=response.status)
+            response.raise_for_status()
+            json_result = await response.json()
+        self._token = json_result["access_token"]
+        # Refresh a little early so that requests in flight never carry an expired token
+        self._token_expiry = time.monotonic() + json_result["expires_in"] - min(60, json_result["expires_in"] / 10)
+        return self._token
+
+    async def _valid_token(self, session : aiohttp.ClientSession, stale : str = None) -> str :
+        async with self._token_lock :
+            # Only the first request to notice an expired (or rejected) token fetches a new one
+            if(self._token is None or self._token == stale or time.monotonic() >= self._token_expiry) :
+                await self.get_token_async(session)
+            return self._token
+
+    async def get_data_async(self, session : aiohttp.ClientSession, semaphore : asyncio.Semaphore, search_type : str, search_param : str, batch : bool = True) -> dict :
+        '''Async get_data with retries. Same parameters as SpotifyAPI.get_data'''
+        if(batch) :
+            query_URL = self.base_URL + search_type + '?' + search_param
+        else :
+            query_URL = self.base_URL + search_type + '/' + search_param
+
+        stale = None
+        for attempt in range(self.max_retries) :
+            try :
+                token = await self._valid_token(session, stale=stale)
+                stale = None
+                async with semaphore :
+                    start = time.perf_counter()
+                    async with session.get(query_URL, headers=self.generate_auth_header(token)) as response :
+                        body = await response.read()
+                        status = response.status
+                        retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error :
+                # Dropped connections, timeouts and failed token requests are retried like 5xx responses
+                instrumentation.count("spotify_requests_total", endpoint=search_type, status="error")
+                logger.warning("Request to %s failed on attempt %d: %r", query_URL, attempt + 1, error)
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+                continue
+
+            instrumentation.observe("spotify_request_duration_seconds", time.perf_counter() - start, endpoint=search_type)
+            instrumentation.count("spotify_requests_total", endpoint=search_type, status=status)
+            instrumentation.count("spotify_response_bytes_total", len(body), endpoint=search_type)
+            if(status == 200) :
+                return json.loads(body)
+            if(status == 429) :
+                instrumentation.count("spotify_rate_limited_total", endpoint=search_type)
+                delay = _retry_after(retry_after)
+            elif(status == 401) :
+                # Token expired early or was revoked, the next attempt refreshes it
+                stale = token
+                delay = 0
+            elif(status >= 500) :
+                delay = self.backoff * 2 ** attempt
+            else :
+                raise SpotifyRequestError(f"{query_URL} returned {status}")
+            await asyncio.sleep(delay)
+        raise SpotifyRequestError(f"{query_URL} failed after {self.max_retries} attempts")
+
+    async def fetch_batches_async(self, search_type : str, batches : list) -> list :
+        '''Query `search_type` for every batch of comma-separated IDs, results are returned in batch order.
+        A batch that fails after all retries is logged and its result is None, the other batches are unaffected'''
+        self._token_lock = asyncio.Lock()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)) as session :
+            tasks = [self.get_data_async(session, semaphore, search_type, "ids=" + batch) for batch in batches]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        for i, result in enumerate(results) :
+            if(isinstance(result, BaseException)) :
+                if(not isinstance(result, Exception)) :
+                    raise result
+                logger.warning("Batch %d of %s failed: %s", i, search_type, result)
+                results[i] = None
+        return results
+
+    def fetch_batches(self, search_type : str, batches : list) -> list :
+        '''Blocking wrapper around fetch_batches_async'''
+        return asyncio.run(self.fetch_batches_async(search_type, list(batches)))
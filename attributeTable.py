@@ -0,0 +1,392 @@
+from collections.abc import MutableMapping
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+'''Columnar node attributes for networkX graphs. A ColumnarGraph keeps its node attributes in one typed NumPy
+column per attribute instead of one Python dict per node: ints, floats and bools are stored as int64/float64/bool
+arrays, strings are dictionary-encoded as int32 codes into a list of distinct values (track, artist and album
+names repeat a lot) and anything else (genre lists) goes into an object column. Each column carries a presence
+mask, so a node that lacks an attribute still behaves like a dict without that key. An attribute holding both
+ints and floats is stored (and read back) as float.
+
+The graph stays a regular nx.Graph: G.nodes[n] is a mutable row view over the columns, so nx.set_node_attributes,
+G.nodes[n][attr] = value and every networkX algorithm work unchanged, while whole columns can be read and written
+as arrays (AttributeTable.column / set_column) and exported to pandas or Arrow without copying the numeric data.'''
+
+BOOL = "bool"
+INT = "int"
+FLOAT = "float"
+STR = "str"
+OBJECT = "object"
+
+_DTYPES = {BOOL : np.bool_, INT : np.int64, FLOAT : np.float64}
+
+
+def _kind(value) -> str :
+    if(isinstance(value, (bool, np.bool_))) :
+        return BOOL
+    if(isinstance(value, (int, np.integer))) :
+        return INT
+    if(isinstance(value, (float, np.floating))) :
+        return FLOAT
+    if(isinstance(value, str)) :
+        return STR
+    return OBJECT
+
+
+def _merge(kind : str, other : str) -> str :
+    # Smallest kind that can hold values of both kinds
+    if(kind == other) :
+        return kind
+    if({kind, other} == {INT, FLOAT}) :
+        return FLOAT
+    return OBJECT
+
+
+def _values_kind(values) -> str :
+    if(isinstance(values, np.ndarray) and values.dtype.kind in "biuf") :
+        return {"b" : BOOL, "i" : INT, "u" : INT, "f" : FLOAT}[values.dtype.kind]
+    kind = None
+    for value in values :
+        current = _kind(value)
+        kind = current if kind is None else _merge(kind, current)
+        if(kind == OBJECT) :
+            break
+    return kind or FLOAT
+
+
+def _empty(kind : str, size : int) -> np.ndarray :
+    if(kind == STR) :
+        return np.full(size, -1, dtype=np.int32)
+    if(kind == OBJECT) :
+        return np.empty(size, dtype=object)
+    return np.zeros(size, dtype=_DTYPES[kind])
+
+
+class _Column :
+    '''One attribute: a typed value array and a presence mask, both indexed by table row'''
+
+    def __init__(self, kind : str, capacity : int) -> None :
+        self.kind = kind
+        self.values = _empty(kind, capacity)
+        self.present = np.zeros(capacity, dtype=bool)
+        # STR columns only: distinct values and their codes
+        self.categories = []
+        self.codes = {}
+
+    def grow(self, capacity : int) -> None :
+        extra = capacity - len(self.present)
+        self.values = np.concatenate([self.values, _empty(self.kind, extra)])
+        self.present = np.concatenate([self.present, np.zeros(extra, dtype=bool)])
+
+    def _code(self, value : str) -> int :
+        code = self.codes.get(value)
+        if(code is None) :
+            code = self.codes[value] = len(self.categories)
+            self.categories.append(value)
+        return code
+
+    def get(self, row : int) :
+        value = self.values[row]
+        if(self.kind == STR) :
+            return self.categories[value]
+        if(self.kind == OBJECT) :
+            return value
+        return value.item()
+
+    def set(self, row : int, value) -> None :
+        self.values[row] = self._code(value) if self.kind == STR else value
+        self.present[row] = True
+
+    def set_rows(self, rows : np.ndarray, values) -> None :
+        if(self.kind == STR) :
+            values = np.fromiter((self._code(value) for value in values), dtype=np.int32, count=len(rows))
+        elif(self.kind == OBJECT and not isinstance(values, np.ndarray)) :
+            # Element-wise, so list values (genres) stay single objects instead of being broadcast by numpy
+            array = np.empty(len(rows), dtype=object)
+            for i, value in enumerate(values) :
+                array[i] = value
+            values = array
+        self.values[rows] = values
+        self.present[rows] = True
+
+    def clear(self, row : int) -> None :
+        self.present[row] = False
+        if(self.kind == OBJECT) :
+            self.values[row] = None
+
+    def converted(self, kind : str) -> "_Column" :
+        '''Copy of the column widened to kind (INT -> FLOAT or anything -> OBJECT)'''
+        column = _Column(kind, len(self.present))
+        column.present = self.present.copy()
+        if(kind == FLOAT) :
+            column.values = self.values.astype(np.float64)
+        else :
+            rows = np.flatnonzero(self.present)
+            for row in rows.tolist() :
+                column.values[row] = self.get(row)
+        return column
+
+    def read(self, rows, default) -> np.ndarray :
+        present = self.present[rows]
+        if(self.kind == STR) :
+            return np.asarray(self.categories + [default], dtype=object)[np.where(present, self.values[rows], len(self.categories))]
+        values = self.values[rows]
+        if(present.all()) :
+            return values
+        if(self.kind in _DTYPES and isinstance(default, (int, float, np.number))) :
+            return np.where(present, values, default)
+        values = values.astype(object)
+        values[~present] = default
+        return values
+
+    def to_pandas(self, rows) :
+        present = self.present[rows]
+        values = self.values[rows]
+        complete = present.all()
+        if(self.kind == FLOAT) :
+            return values if complete else np.where(present, values, np.nan)
+        if(self.kind == INT) :
+            return values if complete else pd.arrays.IntegerArray(values, ~present)
+        if(self.kind == BOOL) :
+            return values if complete else pd.arrays.BooleanArray(values, ~present)
+        if(self.kind == STR) :
+            codes = values if complete else np.where(present, values, -1)
+            return pd.Categorical.from_codes(codes, categories=pd.Index(self.categories, dtype=object))
+        values = values.copy()
+        values[~present] = np.nan
+        return values
+
+    def to_arrow(self, rows) :
+        import pyarrow as pa
+        present = self.present[rows]
+        values = self.values[rows]
+        mask = None if present.all() else ~present
+        if(self.kind in _DTYPES) :
+            return pa.array(values, mask=mask)
+        if(self.kind == STR) :
+            return pa.DictionaryArray.from_arrays(pa.array(values, mask=mask, type=pa.int32()), pa.array(self.categories, type=pa.string()))
+        objects = [value if p else None for value, p in zip(values.tolist(), present.tolist())]
+        try :
+            return pa.array(objects)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) :
+            # Mixed value types, fall back to their string form like the GEXF export does
+            return pa.array([None if value is None else str(value) for value in objects], type=pa.string())
+
+
+class AttributeTable(MutableMapping) :
+    '''node -> attribute row mapping backed by typed columns, used as a ColumnarGraph's node dict.
+    Rows are assigned in insertion order, so as long as no node was removed the columns are in node order
+    and exports can hand out views instead of copies'''
+
+    def __init__(self, capacity : int = 1024) -> None :
+        self._rows = {}
+        self._free = []
+        self._size = 0
+        self._capacity = capacity
+        self._columns = {}
+        # True until a node is removed: row i is then the i-th node in graph order
+        self._ordered = True
+
+    def __len__(self) -> int :
+        return len(self._rows)
+
+    def __iter__(self) :
+        return iter(self._rows)
+
+    def __contains__(self, node) -> bool :
+        return node in self._rows
+
+    def __getitem__(self, node) -> "Row" :
+        return Row(self, self._rows[node])
+
+    def __setitem__(self, node, attrs) -> None :
+        if(isinstance(attrs, Row) and attrs._table is None) :
+            # A fresh row from node_attr_dict_factory: bind it so that later updates write to the columns
+            items = list(attrs._pending.items())
+        else :
+            items = list(attrs.items())
+        row = self._rows.get(node)
+        if(row is None) :
+            row = self._allocate(node)
+        else :
+            self._clear_row(row)
+        if(isinstance(attrs, Row) and attrs._table is None) :
+            attrs._table, attrs._row, attrs._pending = self, row, None
+        for key, value in items :
+            self._set(row, key, value)
+
+    def __delitem__(self, node) -> None :
+        row = self._rows.pop(node)
+        self._clear_row(row)
+        self._free.append(row)
+        self._ordered = False
+
+    def _allocate(self, node) -> int :
+        if(self._free) :
+            row = self._free.pop()
+        else :
+            if(self._size == self._capacity) :
+                self._capacity *= 2
+                for column in self._columns.values() :
+                    column.grow(self._capacity)
+            row = self._size
+            self._size += 1
+        self._rows[node] = row
+        return row
+
+    def _clear_row(self, row : int) -> None :
+        for column in self._columns.values() :
+            if(column.present[row]) :
+                column.clear(row)
+
+    def _column_for(self, key : str, kind : str) -> _Column :
+        column = self._columns.get(key)
+        if(column is None) :
+            column = self._columns[key] = _Column(kind, self._capacity)
+        elif(column.kind != kind and _merge(column.kind, kind) != column.kind) :
+            column = self._columns[key] = column.converted(_merge(column.kind, kind))
+        return column
+
+    def _get(self, row : int, key : str) :
+        column = self._columns.get(key)
+        if(column is None or not column.present[row]) :
+            raise KeyError(key)
+        return column.get(row)
+
+    def _set(self, row : int, key : str, value) -> None :
+        self._column_for(key, _kind(value)).set(row, value)
+
+    def _delete(self, row : int, key : str) -> None :
+        column = self._columns.get(key)
+        if(column is None or not column.present[row]) :
+            raise KeyError(key)
+        column.clear(row)
+
+    def _keys(self, row : int) -> list :
+        return [key for key, column in self._columns.items() if column.present[row]]
+
+    @property
+    def attributes(self) -> list :
+        '''Attribute names that at least one node has'''
+        return [key for key, column in self._columns.items() if column.present.any()]
+
+    def rows(self, nodes : list = None) :
+        '''Table rows of nodes, default every node in graph order (a slice while the rows are still contiguous)'''
+        if(nodes is None) :
+            if(self._ordered) :
+                return slice(0, self._size)
+            return np.fromiter(self._rows.values(), dtype=np.int64, count=len(self._rows))
+        rows = self._rows
+        return np.fromiter((rows[node] for node in nodes), dtype=np.int64, count=len(nodes))
+
+    def column(self, key : str, nodes : list = None, default = np.nan) -> np.ndarray :
+        '''Values of one attribute for nodes (default all nodes in graph order) as an array, default where missing'''
+        rows = self.rows(nodes)
+        column = self._columns.get(key)
+        if(column is None) :
+            count = len(self._rows) if nodes is None else len(nodes)
+            return np.full(count, default, dtype=object if isinstance(default, str) or default is None else None)
+        return column.read(rows, default)
+
+    def set_column(self, key : str, nodes : list, values) -> None :
+        '''Write one attribute for many nodes at once, values in the order of nodes'''
+        if(not isinstance(values, np.ndarray)) :
+            values = list(values)
+        if(len(values) != len(nodes)) :
+            raise ValueError(f"{len(nodes)} nodes but {len(values)} values for {key}")
+        if(len(nodes) == 0) :
+            return
+        self._column_for(key, _values_kind(values)).set_rows(self.rows(nodes), values)
+
+    def to_pandas(self, attributes : list = None) -> pd.DataFrame :
+        '''DataFrame with one row per node (index = node ID) and one column per attribute. Complete numeric
+        columns are views of the table, copy the frame before changing the graph if a snapshot is needed'''
+        rows = self.rows()
+        attributes = self.attributes if attributes is None else attributes
+        data = {key : self._columns[key].to_pandas(rows) for key in attributes}
+        return pd.DataFrame(data, index=pd.Index(list(self._rows)), columns=list(attributes), copy=False)
+
+    def to_arrow(self, attributes : list = None, index_name : str = "Track URI") :
+        '''pyarrow Table with the node IDs as first column. Strings are dictionary-encoded, lists become list columns'''
+        import pyarrow as pa
+        rows = self.rows()
+        attributes = self.attributes if attributes is None else attributes
+        arrays = [pa.array(list(self._rows))] + [self._columns[key].to_arrow(rows) for key in attributes]
+        return pa.Table.from_arrays(arrays, names=[index_name] + list(attributes))
+
+    def to_parquet(self, path : str, attributes : list = None, index_name : str = "Track URI") -> None :
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(attributes, index_name=index_name), path)
+
+
+class Row(MutableMapping) :
+    '''Attribute dict of one node, reads and writes go straight to the table columns. A Row created without a
+    table (as node_attr_dict_factory does) buffers its items until the table binds it to a row'''
+    __slots__ = ("_table", "_row", "_pending")
+
+    def __init__(self, table : AttributeTable = None, row : int = None) -> None :
+        self._table = table
+        self._row = row
+        self._pending = {} if table is None else None
+
+    def __getitem__(self, key) :
+        if(self._table is None) :
+            return self._pending[key]
+        return self._table._get(self._row, key)
+
+    def __setitem__(self, key, value) -> None :
+        if(self._table is None) :
+            self._pending[key] = value
+        else :
+            self._table._set(self._row, key, value)
+
+    def __delitem__(self, key) -> None :
+        if(self._table is None) :
+            del self._pending[key]
+        else :
+            self._table._delete(self._row, key)
+
+    def __iter__(self) :
+        # A snapshot, so callers may set attributes while iterating
+        return iter(list(self._pending) if self._table is None else self._table._keys(self._row))
+
+    def __len__(self) -> int :
+        return len(self._pending) if self._table is None else len(self._table._keys(self._row))
+
+    def __repr__(self) -> str :
+        return repr(dict(self))
+
+    def copy(self) -> dict :
+        return dict(self)
+
+
+class ColumnarGraph(nx.Graph) :
+    '''nx.Graph whose node attributes live in an AttributeTable (G.table)'''
+    node_dict_factory = AttributeTable
+    node_attr_dict_factory = Row
+
+    @property
+    def table(self) -> AttributeTable :
+        return self._node
+
+
+def columnar_graph(G : nx.Graph) -> ColumnarGraph :
+    '''Convert a graph to a ColumnarGraph, attribute by attribute instead of node by node. Edges and their
+    attributes are copied as they are, a ColumnarGraph is returned unchanged'''
+    if(isinstance(G, ColumnarGraph)) :
+        return G
+    H = ColumnarGraph()
+    H.graph.update(G.graph)
+    H.add_nodes_from(G)
+    H.add_edges_from(G.edges(data=True))
+    columns = {}
+    for node, attrs in G.nodes(data=True) :
+        for key, value in attrs.items() :
+            nodes, values = columns.setdefault(key, ([], []))
+            nodes.append(node)
+            values.append(value)
+    for key, (nodes, values) in columns.items() :
+        H.table.set_column(key, nodes, values)
+    return H
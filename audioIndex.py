@@ -0,0 +1,230 @@
+import random
+import weakref
+import numpy as np
+import networkx as nx
+import featureStore
+
+'''Approximate nearest-neighbour ("sound-alike") index over the audio features written by
+enrich.update_audio_attributes. Every feature is standardised to zero mean and unit variance, so tempo and
+loudness do not drown out the [0, 1] features, and tracks are compared by Euclidean distance in that space.
+The index is an IVF (inverted file): k-means splits the catalogue into about sqrt(n) lists, and a query only
+scans the num_probes lists whose centroids are closest. It registers a featureStore listener, so tracks
+enriched later are standardised with the fitted statistics and filed into their nearest list as they arrive;
+the clustering itself is refitted once the index has grown by rebuild_fraction. Tracks missing any of the
+chosen features are not indexed.'''
+
+AUDIO_FEATURES = ["acousticness", "danceability", "energy", "instrumentalness", "liveness", "loudness",
+                  "speechiness", "tempo", "valence"]
+
+# Graph -> {attributes tuple : AudioIndex}. An index only references its graph weakly, so this does not keep graphs alive
+_indexes = weakref.WeakKeyDictionary()
+
+
+def _squared_distances(X : np.ndarray, C : np.ndarray) -> np.ndarray :
+    # Squared Euclidean distances between the rows of X and C
+    return np.maximum((X ** 2).sum(axis=1)[:, None] - 2 * X @ C.T + (C ** 2).sum(axis=1)[None, :], 0)
+
+
+def _nearest_centroid(X : np.ndarray, C : np.ndarray, block_size : int = 65536) -> np.ndarray :
+    # ||x||^2 is the same for every centroid, so the argmin only needs ||c||^2 - 2 x.c
+    if(len(X) == 0) :
+        return np.empty(0, dtype=np.int64)
+    norms = (C ** 2).sum(axis=1)
+    return np.concatenate([(norms - 2 * X[i : i + block_size] @ C.T).argmin(axis=1) for i in range(0, len(X), block_size)])
+
+
+def kmeans(X : np.ndarray, k : int, iterations : int = 10, sample_size : int = 100_000, rng : np.random.Generator = None) -> np.ndarray :
+    '''Lloyd's k-means centroids of the rows of X, fitted on a random sample of at most sample_size rows'''
+    rng = rng or np.random.default_rng()
+    if(len(X) > sample_size) :
+        X = X[rng.choice(len(X), size=sample_size, replace=False)]
+    k = min(k, len(X))
+    C = X[rng.choice(len(X), size=k, replace=False)].copy()
+    for _ in range(iterations) :
+        labels = _nearest_centroid(X, C)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=X[:, j], minlength=k) for j in range(X.shape[1])], axis=1)
+        # Empty clusters keep their old centroid
+        filled = counts > 0
+        C[filled] = sums[filled] / counts[filled, None]
+    return C
+
+
+class AudioIndex :
+    '''IVF index of the standardised audio features of the tracks in G
+    G : nx.Graph -> graph holding the features (plain or attributeTable.ColumnarGraph)
+    attributes : list -> features to compare tracks on, e.g. a subset of AUDIO_FEATURES
+    num_lists : int -> number of k-means lists, default about sqrt(number of tracks)
+    num_probes : int -> lists scanned per query, more is slower and closer to exact
+    rebuild_fraction : float -> refit standardisation and clustering once this share of tracks was added since the last fit
+    seed : int -> seed of the clustering and of teleport picks
+    The index keeps a weak reference to G, the caller keeps the graph alive'''
+
+    def __init__(self, G : nx.Graph, attributes : list = AUDIO_FEATURES, num_lists : int = None, num_probes : int = 8,
+                 rebuild_fraction : float = 0.5, seed : int = None) -> None :
+        self._graph = weakref.ref(G)
+        self.attributes = list(attributes)
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self.rebuild_fraction = rebuild_fraction
+        self.rng = np.random.default_rng(seed)
+        self.random = random.Random(seed)
+        self._stale = True
+        featureStore.register_listener(G, self._on_invalidate)
+
+    @property
+    def G(self) -> nx.Graph :
+        G = self._graph()
+        if(G is None) :
+            raise ReferenceError("The graph of this audio index was garbage collected")
+        return G
+
+    def _features(self, nodes : list = None) -> tuple :
+        '''(raw feature matrix, mask of the nodes that have every feature), nodes default every node in graph order'''
+        raw = np.full((self.G.number_of_nodes() if nodes is None else len(nodes), len(self.attributes)), np.nan)
+        table = getattr(self.G, "table", None)
+        if(nodes is None and table is None) :
+            nodes = list(self.G.nodes)
+        for j, attr in enumerate(self.attributes) :
+            if(table is not None) :
+                values = table.column(attr, nodes)
+                if(values.dtype != object) :
+                    raw[:, j] = values
+                    continue
+            else :
+                values = [self.G.nodes[node].get(attr) for node in nodes]
+            raw[:, j] = [np.nan if v is None else v for v in values]
+        return raw, np.isfinite(raw).all(axis=1)
+
+    def build(self) -> None :
+        '''Fit the standardisation and the clustering over every track that has all features'''
+        nodes = list(self.G.nodes)
+        raw, complete = self._features()
+        raw = raw[complete]
+        self.mean = raw.mean(axis=0) if len(raw) else np.zeros(len(self.attributes))
+        std = raw.std(axis=0) if len(raw) else np.ones(len(self.attributes))
+        self.std = np.where(std > 0, std, 1)
+        vectors = ((raw - self.mean) / self.std).astype(np.float32)
+
+        num_lists = self.num_lists or max(1, int(np.sqrt(len(vectors))))
+        self.centroids = kmeans(vectors, num_lists, rng=self.rng).astype(np.float32) if len(vectors) else np.zeros((1, len(self.attributes)), dtype=np.float32)
+        labels = _nearest_centroid(vectors, self.centroids)
+
+        # Slots are append-only, an updated track gets a new slot. Each list keeps its slots and a contiguous
+        # copy of their vectors, so a query concatenates a few blocks instead of gathering scattered rows
+        self._vectors = vectors
+        self._nodes = [node for node, keep in zip(nodes, complete) if keep]
+        self._slot = {node : i for i, node in enumerate(self._nodes)}
+        self._list_of = labels
+        self._lists = [np.flatnonzero(labels == c) for c in range(len(self.centroids))]
+        self._list_vectors = [vectors[slots] for slots in self._lists]
+        self._fitted_size = len(vectors)
+        self._added = 0
+        self._stale = False
+
+    def _on_invalidate(self, G : nx.Graph, nodes : list) -> None :
+        if(nodes is None or self._stale) :
+            self._stale = True
+            return
+        self.update(nodes)
+
+    def update(self, nodes : list) -> None :
+        '''Re-read the features of nodes and (re-)index them, tracks that lost a feature are dropped'''
+        if(self._stale) :
+            return
+        nodes = [node for node in nodes if node in self.G]
+        raw, complete = self._features(nodes)
+        for node in nodes :
+            slot = self._slot.pop(node, None)
+            if(slot is not None) :
+                c = self._list_of[slot]
+                keep = self._lists[c] != slot
+                self._lists[c] = self._lists[c][keep]
+                self._list_vectors[c] = self._list_vectors[c][keep]
+        nodes = [node for node, keep in zip(nodes, complete) if keep]
+        if(not nodes) :
+            return
+        vectors = ((raw[complete] - self.mean) / self.std).astype(np.float32)
+        labels = _nearest_centroid(vectors, self.centroids)
+        first = len(self._nodes)
+        slots = np.arange(first, first + len(nodes))
+        self._vectors = np.concatenate([self._vectors, vectors])
+        self._list_of = np.concatenate([self._list_of, labels])
+        self._nodes.extend(nodes)
+        self._slot.update(zip(nodes, slots.tolist()))
+        for c in np.unique(labels) :
+            self._lists[c] = np.concatenate([self._lists[c], slots[labels == c]])
+            self._list_vectors[c] = np.concatenate([self._list_vectors[c], vectors[labels == c]])
+        self._added += len(nodes)
+        if(self._added > self.rebuild_fraction * max(self._fitted_size, 1)) :
+            # Refit here, in the enrichment that grew the index, rather than in the next query
+            self.build()
+
+    def __len__(self) -> int :
+        if(self._stale) :
+            self.build()
+        return len(self._slot)
+
+    def __contains__(self, node) -> bool :
+        if(self._stale) :
+            self.build()
+        return node in self._slot
+
+    def vector(self, node) -> np.ndarray :
+        '''Standardised feature vector of an indexed track'''
+        if(self._stale) :
+            self.build()
+        return self._vectors[self._slot[node]]
+
+    def search(self, query : np.ndarray, k : int = 10, exclude = ()) -> list :
+        '''Approximate k nearest tracks of a standardised feature vector
+        exclude : collection of tracks to leave out
+
+        returns : list of (track, distance), nearest first'''
+        if(self._stale) :
+            self.build()
+        query = np.asarray(query, dtype=np.float32)
+        probes = np.argpartition(_squared_distances(query[None, :], self.centroids)[0], min(self.num_probes, len(self.centroids)) - 1)[: self.num_probes]
+        slots = np.concatenate([self._lists[c] for c in probes])
+        if(len(slots) == 0) :
+            return []
+        diff = np.concatenate([self._list_vectors[c] for c in probes]) - query
+        distances = np.einsum('ij,ij->i', diff, diff)
+        # Excluded tracks are dropped after the partial sort, take enough extra candidates to make up for them
+        exclude = exclude if isinstance(exclude, (set, frozenset, dict)) else set(exclude)
+        need = k + len(exclude)
+        if(need < len(slots)) :
+            top = np.argpartition(distances, need - 1)[:need]
+        else :
+            top = np.arange(len(slots))
+        top = top[np.argsort(distances[top], kind="stable")]
+        result = []
+        for slot, d in zip(slots[top].tolist(), distances[top].tolist()) :
+            node = self._nodes[slot]
+            if(node not in exclude) :
+                result.append((node, float(np.sqrt(d))))
+                if(len(result) == k) :
+                    break
+        return result
+
+    def similar(self, track, k : int = 10, exclude = ()) -> list :
+        '''Sound-alikes of an indexed track over the whole catalogue, the track itself excluded
+
+        returns : list of (track, distance in standardised feature space), nearest first'''
+        return self.search(self.vector(track), k=k, exclude=set(exclude) | {track})
+
+    def teleport_target(self, track, exclude = (), k : int = 10) :
+        '''Random pick among the k sound-alikes of track that are not in exclude, None if track is not indexed'''
+        if(track not in self) :
+            return None
+        candidates = self.similar(track, k=k, exclude=exclude)
+        return self.random.choice(candidates)[0] if candidates else None
+
+
+def get_audio_index(G : nx.Graph, attributes : list = AUDIO_FEATURES) -> AudioIndex :
+    '''Shared AudioIndex of G for the given attributes, kept up to date through featureStore.invalidate'''
+    indexes = _indexes.setdefault(G, {})
+    key = tuple(attributes)
+    if(key not in indexes) :
+        indexes[key] = AudioIndex(G, attributes)
+    return indexes[key]
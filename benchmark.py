@@ -0,0 +1,248 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import pickle
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from API import SpotifyAPI
+from mockSpotify import mock_object
+from NetworkAnalysis import NetworkAnalysis
+import enrich
+from graphWalk import graphWalk
+from graphStats import path_length_stats
+
+'''Benchmark harness for the analysis and recommendation hot paths. Synthetic scale-free playlist data is
+generated at several sizes (song popularity follows a power law, so the co-occurrence graph has the heavy-tailed
+degrees of the real datasets) and enrichment runs against MockSpotifyAPI, so no credentials or network are needed.
+Every stage is timed and, in a separate run under tracemalloc, its peak Python memory is recorded. Results are
+written as JSON so runs can be compared across commits:
+
+    python benchmark.py --sizes 500 2000 5000 --out benchmark_results.json'''
+
+WALK_ATTRIBUTES = ["danceability", "energy", "speechiness", "loudness", "valence"]
+
+
+def synthetic_interactions(num_songs : int, num_playlists : int = None, mean_playlist_size : int = 15,
+                           exponent : float = 1.1, seed : int = 0) -> tuple :
+    '''Playlist interactions and song data in the layout of interactions_X.csv / song_data_X.csv
+    num_playlists : int -> default num_songs / 4
+    exponent : float -> power-law exponent of song popularity, larger gives a more skewed degree distribution
+
+    returns : (interactions, song_data) DataFrames'''
+    rng = np.random.default_rng(seed)
+    num_playlists = num_playlists or max(num_songs // 4, 1)
+    popularity = np.arange(1, num_songs + 1, dtype=np.float64) ** -exponent
+    popularity /= popularity.sum()
+    sizes = np.maximum(rng.poisson(mean_playlist_size, num_playlists), 2)
+    songs = rng.choice(num_songs, size=sizes.sum(), p=popularity)
+    # Shuffle popularity ranks over song IDs so node order carries no degree information
+    song_ids = np.array([f"spotify:track:{i:022d}" for i in rng.permutation(num_songs)])
+    interactions = pd.DataFrame({
+        "playlist_id" : np.repeat(np.arange(num_playlists), sizes),
+        "song_id" : song_ids[songs],
+    }).drop_duplicates()
+
+    num_artists = max(num_songs // 8, 1)
+    num_albums = max(num_songs // 4, 1)
+    artists = rng.integers(0, num_artists, num_songs)
+    albums = rng.integers(0, num_albums, num_songs)
+    song_data = pd.DataFrame({
+        "song_id" : song_ids,
+        "song_name" : [f"Song {i}" for i in range(num_songs)],
+        "artist_name" : [f"Artist {a}" for a in artists],
+        "artist_uri" : [f"spotify:artist:{a:022d}" for a in artists],
+        "album_name" : [f"Album {a}" for a in albums],
+        "album_uri" : [f"spotify:album:{a:022d}" for a in albums],
+    })
+    return interactions, song_data
+
+
+class MockSpotifyAPI(SpotifyAPI) :
+    '''SpotifyAPI answering batch queries with generated objects, deterministic per object ID
+    latency : float -> seconds to sleep per request, to model network round-trips'''
+
+    def __init__(self, latency : float = 0.0, cache = None) -> None :
+        super().__init__(cache=cache)
+        self.latency = latency
+        self.requests = 0
+
+    def get_token(self) -> str :
+        return "mock-token"
+
+    def get_data(self, token : str, search_type : str, search_param : str = None, batch = False) -> dict :
+        ids = search_param.split("=", 1)[1].split(",") if batch else [search_param]
+        self.requests += 1
+        if(self.latency) :
+            time.sleep(self.latency)
+        return {enrich.RESPONSE_KEYS[search_type] : [mock_object(search_type, object_id) for object_id in ids]}
+
+
+class Recorder :
+    '''Runs and records benchmark stages
+    repeat : int -> timed runs per stage, the minimum and median are reported
+    memory : bool -> run every stage once more under tracemalloc to record its peak memory'''
+
+    def __init__(self, repeat : int = 1, memory : bool = True, quiet : bool = True) -> None :
+        self.repeat = repeat
+        self.memory = memory
+        self.quiet = quiet
+        self.results = []
+
+    def _call(self, fn) :
+        # Silence the prints and plots of the measured code
+        with warnings.catch_warnings(), contextlib.ExitStack() as stack :
+            warnings.simplefilter("ignore")
+            if(self.quiet) :
+                stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            try :
+                return fn()
+            finally :
+                plt.close("all")
+
+    def run(self, size : int, stage : str, fn, **info) :
+        times = []
+        result = None
+        for _ in range(self.repeat) :
+            start = time.perf_counter()
+            result = self._call(fn)
+            times.append(time.perf_counter() - start)
+        record = {"size" : size, "stage" : stage, "seconds" : min(times), "median_seconds" : float(np.median(times)), **info}
+        if(self.memory) :
+            tracemalloc.start()
+            self._call(fn)
+            record["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+        self.results.append(record)
+        print(f"{size:>8} {stage:<32} {record['seconds']:9.4f}s" + (f" {record['peak_mb']:9.1f} MB" if self.memory else ""))
+        return result
+
+
+def benchmark_size(recorder : Recorder, num_songs : int, workdir : str, seed : int = 0, exact_limit : int = 2000,
+                   girvan_newman_limit : int = 300) -> None :
+    '''All stages for one synthetic dataset size. The exact path statistics only run for graphs with at most
+    exact_limit nodes, Girvan-Newman (sampled edge betweenness) for graphs with at most girvan_newman_limit nodes'''
+    interactions, song_data = synthetic_interactions(num_songs, seed=seed)
+    csv_path = os.path.join(workdir, f"interactions_{num_songs}.csv")
+    interactions.to_csv(csv_path, index=False)
+
+    network = recorder.run(num_songs, "load_csv", lambda : NetworkAnalysis(csv_path, song_data))
+    G = network.G
+    size = {"nodes" : G.number_of_nodes(), "edges" : G.number_of_edges()}
+    pickle_path = os.path.join(workdir, f"graph_{num_songs}.pickle")
+    with open(pickle_path, "wb") as f :
+        pickle.dump(G, f)
+    store_path = os.path.join(workdir, f"store_{num_songs}")
+    network.save_store(store_path)
+    recorder.run(num_songs, "load_pickle", lambda : NetworkAnalysis(pickle_path), **size)
+    recorder.run(num_songs, "load_store", lambda : NetworkAnalysis(store_path).csr, **size)
+
+    metrics = [
+        ("avg_degree", network.avgDegree),
+        ("avg_clustering", network.avgClusteringCoefficient),
+        # Called directly, NetworkAnalysis.path_statistics would answer repeated runs from its cache
+        ("path_statistics_sampled", lambda : path_length_stats(network.csr, seed=seed)),
+        ("bfs_centralities", network.bfs_centralities),
+        ("bfs_centralities_sampled", lambda : network.bfs_centralities(approximate=True)),
+        ("eccentricity", network.eccentricity),
+        ("pagerank", network.pageRank),
+        ("k_core", network.k_core_analysis),
+        ("louvain", network.get_louvain),
+        ("louvain_sweep", network.louvain_sweep),
+        ("walktrap", network.walktrap),
+    ]
+    if(G.number_of_nodes() <= exact_limit) :
+        metrics.append(("path_statistics_exact", lambda : path_length_stats(network.csr, exact=True)))
+    if(G.number_of_nodes() <= girvan_newman_limit) :
+        metrics.append(("girvan_newman_sampled", lambda : network.girvan_newman(sample_size=32, seed=0)))
+    for stage, fn in metrics :
+        recorder.run(num_songs, stage, fn, **size)
+
+    api = MockSpotifyAPI()
+    token = api.get_token()
+
+    def enrich_tracks() :
+        batches = enrich.node_batch(G, 50, type="tracks")
+        enrich.update_track_attributes(G, enrich.get_track_details(batches, api, token))
+        enrich.update_audio_attributes(G, enrich.get_audio_features(batches, api, token))
+
+    def enrich_artists() :
+        artist_details = enrich.get_artist_details(enrich.node_batch(G, 50, type="artists"), api, token)
+        all_genres = enrich.get_all_genres(artist_details)
+        top_genres = [genre for genre, _ in all_genres.most_common(20)]
+        enrich.update_artist_details(G, artist_details, top_genres)
+
+    recorder.run(num_songs, "enrich_tracks", enrich_tracks, **size)
+    recorder.run(num_songs, "enrich_artists_join", enrich_artists, **size)
+
+    audio_index = network.audio_index()
+    recorder.run(num_songs, "audio_index_build", audio_index.build, **size)
+    queries = list(G)[:100]
+    recorder.run(num_songs, "sound_alikes_100", lambda : [audio_index.similar(track, k=10) for track in queries], **size)
+
+    start = max(G.degree, key=lambda item : item[1])[0]
+    for context in (False, True) :
+        recorder.run(num_songs, f"graph_walk_context_{context}".lower(),
+                     lambda : graphWalk(G, start, walk_length=20, teleport=0.0001, context=context, attributes=WALK_ATTRIBUTES), **size)
+
+    playlist = interactions.loc[interactions["playlist_id"] == interactions["playlist_id"].iloc[0], "song_id"].tolist()
+    recorder.run(num_songs, "continue_playlist", lambda : network.continue_playlist(playlist, k=20), **size)
+    recorder.run(num_songs, "continue_playlist_features",
+                 lambda : network.continue_playlist(playlist, k=20, feature_weight=0.5, attributes=WALK_ATTRIBUTES), **size)
+    index = recorder.run(num_songs, "train_embeddings", lambda : network.train_embeddings(dimensions=32, num_walks=5, seed=seed), **size)
+    recorder.run(num_songs, "similar_tracks_batch", lambda : index.similar(list(G)[:1000], k=10), **size)
+
+
+def git_commit() -> str :
+    try :
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError) :
+        return None
+
+
+def main() -> None :
+    parser = argparse.ArgumentParser(description="Benchmark graph loading, metrics, communities, enrichment and walks on synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 5000], help="number of songs per synthetic dataset")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per stage")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak-memory runs")
+    parser.add_argument("--exact-limit", type=int, default=2000, help="largest graph for the exact path statistics")
+    parser.add_argument("--girvan-newman-limit", type=int, default=300, help="largest graph for Girvan-Newman")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    recorder = Recorder(repeat=args.repeat, memory=not args.no_memory)
+    with tempfile.TemporaryDirectory() as workdir :
+        for num_songs in args.sizes :
+            benchmark_size(recorder, num_songs, workdir, seed=args.seed, exact_limit=args.exact_limit,
+                           girvan_newman_limit=args.girvan_newman_limit)
+
+    report = {
+        "commit" : git_commit(),
+        "timestamp" : datetime.now(timezone.utc).isoformat(),
+        "python" : platform.python_version(),
+        "machine" : platform.machine(),
+        "cpu_count" : os.cpu_count(),
+        "repeat" : args.repeat,
+        "results" : recorder.results,
+    }
+    with open(args.out, "w") as f :
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(recorder.results)} results to {args.out}")
+
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,270 @@
+import math
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from concurrent.futures import ProcessPoolExecutor
+from graphStore import CSRGraph
+
+'''Centrality engines over CSR arrays. Betweenness, closeness, eccentricity and diameter all come from one
+set of breadth-first searches: sources are processed in batches, and each BFS level of a batch is a single
+sparse-matrix x dense-matrix product (Brandes' accumulation runs the same way backwards). Sources can be
+every node (exact) or a uniform sample sized from an error bound, and batches can be spread over processes.
+PageRank and eigenvector centrality are sparse power iterations that can be warm-started from earlier results.'''
+
+
+def num_samples(n : int, epsilon : float, delta : float) -> int :
+    '''Number of BFS sources needed so that, with probability 1 - delta, every normalised betweenness and
+    closeness estimate is within epsilon of its exact value (Hoeffding bound with a union bound over n nodes)'''
+    return min(n, int(math.ceil(math.log(2 * n / delta) / (2 * epsilon ** 2))))
+
+
+def _batch_size(n : int) -> int :
+    # Three dense n x batch matrices are live at once, keep them around 256 MB
+    return int(max(1, min(64, 2 ** 25 // max(n, 1))))
+
+
+def _brandes_batch(A : sp.csr_matrix, sources : np.ndarray) -> tuple :
+    '''Brandes BFS + dependency accumulation from a batch of sources
+    returns : (dist with -1 for unreachable, path counts sigma, dependency delta), each n x batch'''
+    n = A.shape[0]
+    b = len(sources)
+    cols = np.arange(b)
+    dist = np.full((n, b), -1, dtype=np.int32)
+    sigma = np.zeros((n, b))
+    dist[sources, cols] = 0
+    sigma[sources, cols] = 1
+    frontier = sigma.copy()
+    level = 0
+    while True :
+        reached = A @ frontier
+        new = (reached > 0) & (dist < 0)
+        if not new.any() :
+            break
+        level += 1
+        dist[new] = level
+        sigma[new] = reached[new]
+        frontier = np.where(new, sigma, 0)
+
+    delta = np.zeros((n, b))
+    for d in range(level, 0, -1) :
+        at_level = dist == d
+        coeff = np.where(at_level, (1 + delta) / np.where(at_level, sigma, 1), 0)
+        parents = dist == d - 1
+        delta += np.where(parents, sigma * (A @ coeff), 0)
+    return dist, sigma, delta
+
+
+def _bfs_batch(A : sp.csr_matrix, sources : np.ndarray) -> tuple :
+    '''returns : (dependency summed over the batch, dist matrix n x batch with -1 for unreachable)'''
+    dist, _, delta = _brandes_batch(A, sources)
+    delta[sources, np.arange(len(sources))] = 0
+    return delta.sum(axis=1), dist
+
+
+def edge_dependency(A : sp.csr_matrix, sources : np.ndarray, rows : np.ndarray, cols : np.ndarray) -> np.ndarray :
+    '''Dependency of every edge (rows[i], cols[i]) on the shortest paths from the sources, from the same batched
+    BFS passes as bfs_centralities. Over all sources of an undirected graph it is twice networkX's unnormalised
+    edge betweenness
+    A : sp.csr_matrix -> symmetric adjacency matrix
+    sources : np.ndarray -> BFS source rows
+    rows, cols : np.ndarray -> endpoints of each edge, listed once
+
+    returns : array of dependencies in edge order'''
+    total = np.zeros(len(rows))
+    size = _batch_size(A.shape[0])
+    for start in range(0, len(sources), size) :
+        dist, sigma, delta = _brandes_batch(A, sources[start : start + size])
+        coeff = (1 + delta) / np.where(dist >= 0, sigma, 1)
+        # Brandes' edge term sigma(v) / sigma(w) * (1 + delta(w)) for every edge v -> w one level down,
+        # gathered over edge chunks so the edges x batch temporaries stay bounded
+        chunk = max(1, 2 ** 22 // dist.shape[1])
+        for first in range(0, len(rows), chunk) :
+            r = rows[first : first + chunk]
+            c = cols[first : first + chunk]
+            # Both endpoints of an edge are reached from the same sources, so the level difference decides the direction
+            step = dist[c] - dist[r]
+            total[first : first + chunk] += (np.where(step == 1, sigma[r] * coeff[c], 0) + np.where(step == -1, sigma[c] * coeff[r], 0)).sum(axis=1)
+    return total
+
+
+_WORKER_A = None
+
+
+def _init_worker(A : sp.csr_matrix) -> None :
+    global _WORKER_A
+    _WORKER_A = A
+
+
+def _run_batch(sources : np.ndarray, A : sp.csr_matrix = None) -> dict :
+    '''Everything the centrality stage needs from one batch of BFS sources'''
+    A = _WORKER_A if A is None else A
+    dependency, dist = _bfs_batch(A, sources)
+    reached = dist >= 0
+    dist_or_zero = np.where(reached, dist, 0)
+    return {
+        "sources" : sources,
+        "dependency" : dependency,
+        "source_ecc" : dist.max(axis=0),
+        # Per node: distance sum, number of sources reaching it and largest distance to any source
+        "node_sum" : dist_or_zero.sum(axis=1),
+        "node_reach" : reached.sum(axis=1),
+        "node_max" : dist.max(axis=1),
+    }
+
+
+def bfs_centralities(csr : CSRGraph, approximate : bool = False, epsilon : float = 0.05, delta : float = 0.1,
+                     num_sources : int = None, n_jobs : int = 1, seed : int = None) -> dict :
+    '''Betweenness, closeness, eccentricity and diameter from one shared set of BFS passes (unweighted)
+    csr : CSRGraph -> graph, e.g. NetworkAnalysis.csr
+    approximate : bool -> sample BFS sources instead of running one BFS per node
+    epsilon, delta : float -> error bound used to size the sample, see num_samples
+    num_sources : int -> explicit sample size, overrides epsilon/delta
+    n_jobs : int -> number of worker processes
+
+    returns : dict of arrays in csr row order: "betweenness" and "closeness" (normalised like networkX),
+    "eccentricity" (within each connected component, a lower bound when approximate), plus "diameter",
+    "diameter_upper_bound" and "num_sources"'''
+    n = csr.num_nodes
+    A = sp.csr_matrix((np.ones(len(csr.indices)), np.asarray(csr.indices), np.asarray(csr.indptr)), shape=(n, n))
+    if(approximate) :
+        k = num_sources if num_sources is not None else num_samples(n, epsilon, delta)
+        k = min(max(k, 1), n)
+        sources = np.sort(np.random.default_rng(seed).choice(n, size=k, replace=False))
+    else :
+        k = n
+        sources = np.arange(n)
+    exact = k == n
+
+    size = _batch_size(n)
+    batches = [sources[i : i + size] for i in range(0, len(sources), size)]
+    if(n_jobs == 1 or len(batches) == 1) :
+        results = [_run_batch(batch, A) for batch in batches]
+    else :
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(A,)) as pool :
+            results = list(pool.map(_run_batch, batches))
+
+    dependency = np.zeros(n)
+    node_sum = np.zeros(n)
+    node_reach = np.zeros(n)
+    node_max = np.full(n, -1)
+    source_ecc = np.zeros(n, dtype=np.int64)
+    for result in results :
+        dependency += result["dependency"]
+        node_sum += result["node_sum"]
+        node_reach += result["node_reach"]
+        node_max = np.maximum(node_max, result["node_max"])
+        source_ecc[result["sources"]] = result["source_ecc"]
+
+    # Betweenness, scaled as networkx.betweenness_centrality(normalized=True, k=...)
+    betweenness = dependency.copy()
+    if(n > 2) :
+        if(exact) :
+            betweenness *= 1 / ((n - 1) * (n - 2))
+        else :
+            is_source = np.zeros(n, dtype=bool)
+            is_source[sources] = True
+            scale_source = 1 / ((k - 1) * (n - 2)) if k > 1 else math.nan
+            betweenness *= np.where(is_source, scale_source, 1 / (k * (n - 2)))
+
+    # Closeness with the Wasserman-Faust correction networkX uses for disconnected graphs. The distance sum and
+    # reachable count of a node are extrapolated from the sampled sources when approximate
+    if(exact) :
+        reach = node_reach - 1
+        total = node_sum
+    else :
+        reach = node_reach * (n / k) - 1
+        total = node_sum * (n / k)
+    with np.errstate(divide="ignore", invalid="ignore") :
+        closeness = np.where((total > 0) & (reach > 0), (reach / total) * (reach / max(n - 1, 1)), 0.0)
+
+    # Eccentricity: exact for sampled sources, max distance to any sampled source otherwise
+    eccentricity = node_max.copy()
+    eccentricity[sources] = source_ecc[sources]
+    diameter = int(eccentricity.max()) if n else 0
+    diameter_upper_bound = diameter
+    if(not exact) :
+        # A component's diameter is at most its size - 1, and at most 2 * ecc(s) for any sampled source s in it
+        num_components, labels = connected_components(A, directed=False)
+        bound = np.bincount(labels, minlength=num_components).astype(np.int64) - 1
+        np.minimum.at(bound, labels[sources], 2 * source_ecc[sources])
+        diameter_upper_bound = max(int(bound.max()), diameter)
+
+    return {
+        "betweenness" : betweenness,
+        "closeness" : closeness,
+        "eccentricity" : eccentricity,
+        "diameter" : diameter,
+        "diameter_upper_bound" : diameter_upper_bound,
+        "num_sources" : k,
+    }
+
+
+class PageRankEngine :
+    '''PageRank and personalized PageRank as sparse matrix-vector power iterations, with the same model as
+    nx.pagerank (weighted transitions, dangling nodes jump by the personalization vector). The transposed
+    transition matrix is built once and reused, and every run can be warm-started from a previous result
+    csr : CSRGraph -> graph
+    weighted : bool -> use edge weights for the transition probabilities, like nx.pagerank(weight="weight")'''
+
+    def __init__(self, csr : CSRGraph, weighted : bool = True) -> None :
+        n = csr.num_nodes
+        weights = np.asarray(csr.weights, dtype=np.float64) if weighted else np.ones(len(csr.indices))
+        W = sp.csr_matrix((weights, np.asarray(csr.indices), np.asarray(csr.indptr)), shape=(n, n))
+        out_weight = np.asarray(W.sum(axis=1)).ravel()
+        self.dangling = out_weight == 0
+        inverse = np.divide(1.0, out_weight, out=np.zeros(n), where=~self.dangling)
+        self.PT = (sp.diags(inverse) @ W).T.tocsr()
+        self.num_nodes = n
+
+    def run(self, alpha : float = 0.85, personalization : np.ndarray = None, x0 : np.ndarray = None,
+            tol : float = 1e-6, max_iter : int = 100) -> np.ndarray :
+        '''PageRank vector in csr row order
+        personalization : np.ndarray -> teleport distribution over rows, uniform if None
+        x0 : np.ndarray -> starting vector, e.g. the previous PageRank after a small graph update
+        tol : float -> stop when the L1 change is below num_nodes * tol, as networkX does'''
+        n = self.num_nodes
+        if(n == 0) :
+            return np.zeros(0)
+        p = np.full(n, 1.0 / n) if personalization is None else np.asarray(personalization, dtype=np.float64) / np.sum(personalization)
+        x = p.copy() if x0 is None else np.asarray(x0, dtype=np.float64) / np.sum(x0)
+        for _ in range(max_iter) :
+            last = x
+            x = alpha * (self.PT @ last + last[self.dangling].sum() * p) + (1 - alpha) * p
+            if(np.abs(x - last).sum() < n * tol) :
+                return x
+        raise nx.PowerIterationFailedConvergence(max_iter)
+
+    def personalized(self, seeds : np.ndarray, k : int = 10, alpha : float = 0.85, tol : float = 1e-6, max_iter : int = 100) -> tuple :
+        '''Top-k rows by PageRank personalized on the seed rows, seeds excluded
+        returns : (rows, scores) sorted by descending score'''
+        seeds = np.asarray(seeds, dtype=np.int64)
+        personalization = np.zeros(self.num_nodes)
+        personalization[seeds] = 1
+        # Personalized scores are concentrated around the seeds, start the iteration there
+        scores = self.run(alpha=alpha, personalization=personalization, x0=personalization, tol=tol, max_iter=max_iter)
+        scores[seeds] = -np.inf
+        k = min(k, self.num_nodes - len(np.unique(seeds)))
+        if(k <= 0) :
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+
+def eigenvector_centrality(csr : CSRGraph, x0 : np.ndarray = None, tol : float = 1e-6, max_iter : int = 100) -> np.ndarray :
+    '''Eigenvector centrality in csr row order with nx.eigenvector_centrality's iteration (unweighted,
+    power iteration on A + I, L2 normalised), as sparse matrix-vector products
+    x0 : np.ndarray -> starting vector, e.g. the previous result after a small graph update'''
+    n = csr.num_nodes
+    A = sp.csr_matrix((np.ones(len(csr.indices)), np.asarray(csr.indices), np.asarray(csr.indptr)), shape=(n, n))
+    x = np.ones(n) if x0 is None else np.asarray(x0, dtype=np.float64)
+    x = x / x.sum()
+    for _ in range(max_iter) :
+        last = x
+        x = A @ last + last
+        norm = np.linalg.norm(x)
+        x = x / (norm if norm > 0 else 1)
+        if(np.abs(x - last).sum() < n * tol) :
+            return x
+    raise nx.PowerIterationFailedConvergence(max_iter)
@@ -0,0 +1,179 @@
+import time
+import heapq
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from concurrent.futures import ProcessPoolExecutor
+from graphStore import CSRGraph
+from centrality import edge_dependency
+
+'''Community detection runners over a shared CSR graph. A Louvain sweep runs every (resolution, seed) pair,
+in parallel when asked: each worker process rebuilds the graph once from the CSR arrays with integer nodes
+and returns its labels as an integer array in csr row order, with the run's modularity and runtime. The
+divisive Girvan-Newman mode records a full dendrogram and only rescores the component an edge left, with edge
+betweenness from the batched BFS passes of centrality.'''
+
+_WORKER_G = None
+
+
+def _integer_graph(csr : CSRGraph) -> nx.Graph :
+    n = csr.num_nodes
+    A = sp.csr_matrix((np.asarray(csr.weights), np.asarray(csr.indices), np.asarray(csr.indptr)), shape=(n, n))
+    return nx.from_scipy_sparse_array(A, edge_attribute="weight")
+
+
+def _init_worker(csr : CSRGraph) -> None :
+    global _WORKER_G
+    _WORKER_G = _integer_graph(csr)
+
+
+def labels_from_communities(communities : list, num_nodes : int) -> np.ndarray :
+    '''Integer label array from a list of node sets over rows 0..num_nodes-1, -1 for unassigned rows'''
+    labels = np.full(num_nodes, -1, dtype=np.int32)
+    for index, community in enumerate(communities) :
+        labels[np.fromiter(community, dtype=np.int64, count=len(community))] = index
+    return labels
+
+
+def communities_from_labels(labels : np.ndarray, nodes : np.ndarray) -> list :
+    '''List of node ID sets from an integer label array over the rows of nodes, unassigned (-1) rows left out'''
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    order = order[sorted_labels >= 0]
+    sorted_labels = sorted_labels[sorted_labels >= 0]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]]) if len(order) else np.empty(0, dtype=np.int64)
+    return [set(nodes[rows].tolist()) for rows in np.split(order, starts[1:])] if len(order) else []
+
+
+def _louvain_run(resolution : float, seed : int, G : nx.Graph = None) -> dict :
+    G = _WORKER_G if G is None else G
+    start = time.perf_counter()
+    communities = nx.community.louvain_communities(G, weight="weight", resolution=resolution, seed=seed)
+    runtime = time.perf_counter() - start
+    return {
+        "resolution" : resolution,
+        "seed" : seed,
+        "labels" : labels_from_communities(communities, G.number_of_nodes()),
+        "num_communities" : len(communities),
+        "modularity" : nx.community.modularity(G, communities, weight="weight", resolution=resolution),
+        "runtime" : runtime,
+    }
+
+
+def louvain_sweep(csr : CSRGraph, resolutions : list = (0.5, 0.8, 1.0, 1.2, 1.5), seeds : list = (None,), n_jobs : int = 1) -> list :
+    '''Run Louvain for every resolution and seed
+    csr : CSRGraph -> graph, e.g. NetworkAnalysis.csr
+    resolutions : list -> resolution parameters to try
+    seeds : list -> random seeds per resolution, several seeds show how stable a resolution is
+    n_jobs : int -> number of worker processes
+
+    returns : list of dicts with resolution, seed, labels (int array in csr row order), num_communities,
+    modularity (at the run's resolution) and runtime in seconds, in (resolution, seed) order'''
+    runs = [(resolution, seed) for resolution in resolutions for seed in seeds]
+    if(n_jobs == 1 or len(runs) == 1) :
+        G = _integer_graph(csr)
+        return [_louvain_run(resolution, seed, G) for resolution, seed in runs]
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(csr,)) as pool :
+        futures = [pool.submit(_louvain_run, resolution, seed) for resolution, seed in runs]
+        return [future.result() for future in futures]
+
+
+class Dendrogram :
+    '''Record of a divisive run. Components get integer IDs: the connected components of the input graph
+    are the roots, and every split of a component into pieces is stored in the order it happened, so any
+    number of communities can be read off one run'''
+
+    def __init__(self) -> None :
+        self.members = {}
+        self.roots = []
+        self.splits = []
+
+    def add_component(self, nodes : set) -> int :
+        component = len(self.members)
+        self.members[component] = frozenset(nodes)
+        return component
+
+    def communities_at(self, num_communities : int) -> list :
+        '''Communities after the first splits that bring the count to num_communities (or all splits)'''
+        active = list(self.roots)
+        for split in self.splits :
+            if(len(active) >= num_communities) :
+                break
+            active.remove(split["parent"])
+            active.extend(split["children"])
+        return [list(self.members[component]) for component in active]
+
+    @property
+    def num_leaves(self) -> int :
+        return len(self.roots) + sum(len(split["children"]) - 1 for split in self.splits)
+
+
+def divisive_girvan_newman(G : nx.Graph, max_communities : int = None, sample_size : int = None, seed : int = None) -> Dendrogram :
+    '''Girvan-Newman that only recomputes edge betweenness inside the component an edge was removed from.
+    Betweenness comes from centrality's batched BFS engine on the component's rows of one shared adjacency
+    matrix, so no subgraph is copied. It is left unnormalised, so values from different components compare like
+    the global ones
+    G : nx.Graph -> graph to split, not modified
+    max_communities : int -> stop once there are this many components, None to record the full dendrogram
+    sample_size : int -> estimate edge betweenness from this many sampled sources per component
+    seed : int -> seed of the source samples, the same seed gives the same dendrogram
+
+    returns : Dendrogram of the run'''
+    nodes = list(G)
+    n = len(nodes)
+    position = {node : i for i, node in enumerate(nodes)}
+    edges = np.array([(position[u], position[v]) for u, v in G.edges() if u != v], dtype=np.int64).reshape(-1, 2)
+    A = sp.csr_matrix((np.ones(2 * len(edges)), (np.concatenate([edges[:, 0], edges[:, 1]]), np.concatenate([edges[:, 1], edges[:, 0]]))), shape=(n, n))
+    A.data[:] = 1
+    rng = np.random.default_rng(seed)
+    dendrogram = Dendrogram()
+    rows = {}
+    heap = []
+
+    def add_component(component_rows : np.ndarray) -> int :
+        component = dendrogram.add_component([nodes[i] for i in component_rows])
+        rows[component] = component_rows
+        return component
+
+    def score(component : int, sub : sp.csr_matrix) -> None :
+        upper = sp.triu(sub, k=1).tocoo()
+        if(upper.nnz == 0) :
+            return
+        size = sub.shape[0]
+        if(sample_size is not None and sample_size < size) :
+            sources = np.sort(rng.choice(size, size=sample_size, replace=False))
+        else :
+            sources = np.arange(size)
+        # Scaled like nx.edge_betweenness_centrality(normalized=False, k=...)
+        values = edge_dependency(sub, sources, upper.row, upper.col) * (size / (2 * len(sources)))
+        best = int(np.argmax(values))
+        edge = (nodes[rows[component][upper.row[best]]], nodes[rows[component][upper.col[best]]])
+        heapq.heappush(heap, (-values[best], component, edge))
+
+    num_components, labels = connected_components(A, directed=False)
+    for label in range(num_components) :
+        component = add_component(np.flatnonzero(labels == label))
+        dendrogram.roots.append(component)
+        score(component, A[rows[component]][:, rows[component]])
+
+    step = 0
+    while heap and (max_communities is None or dendrogram.num_leaves < max_communities) :
+        _, component, edge = heapq.heappop(heap)
+        u, v = position[edge[0]], position[edge[1]]
+        A[u, v] = 0
+        A[v, u] = 0
+        step += 1
+        sub = A[rows[component]][:, rows[component]]
+        sub.eliminate_zeros()
+        # Removing one edge splits a component into at most two pieces
+        num_pieces, labels = connected_components(sub, directed=False)
+        if(num_pieces == 1) :
+            # Still one component: only its own betweenness changed
+            score(component, sub)
+            continue
+        children = [add_component(rows[component][labels == label]) for label in range(num_pieces)]
+        dendrogram.splits.append({"step" : step, "edge" : edge, "parent" : component, "children" : children})
+        for child, label in zip(children, range(num_pieces)) :
+            score(child, sub[labels == label][:, labels == label])
+    return dendrogram
@@ -0,0 +1,277 @@
+import os
+import json
+import itertools
+from collections import deque
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import svds
+from concurrent.futures import ProcessPoolExecutor
+from graphStore import CSRGraph, node_rows
+import instrumentation
+
+'''Track embeddings learned from random walks over the co-occurrence graph. walk_corpus generates
+DeepWalk-style walks in lockstep (each step picks a neighbour with probability proportional to the edge
+weight, teleports and dead ends jump to a uniformly random track as in graphWalk), sharded over processes.
+train_embeddings counts skip-gram co-occurrences within a window of the walks and factorises their shifted
+positive PMI matrix with a truncated SVD, the matrix skip-gram with negative sampling implicitly factorises, so
+no neural-network dependency is needed. EmbeddingIndex keeps the L2-normalised float32 vectors and answers
+batched top-k cosine queries; it is saved as .npy files, by default inside the graph store directory, and
+memory-mapped on load. Its meta records the fingerprint of the graph it was trained on, so vectors saved for an
+older version of a graph are not served for a newer one.'''
+
+EMBEDDINGS_FILE = "embeddings.npy"
+EMBEDDING_NODES_FILE = "embedding_nodes.npy"
+EMBEDDING_META_FILE = "embeddings.json"
+
+
+def _transition_cumsum(csr : CSRGraph) -> np.ndarray :
+    # Running sum of the edge weights over the whole CSR array, row u's neighbours cover (cum[start - 1], cum[end - 1]]
+    return np.cumsum(np.asarray(csr.weights, dtype=np.float64))
+
+
+def _walks(indptr : np.ndarray, indices : np.ndarray, cumulative : np.ndarray, starts : np.ndarray, walk_length : int,
+           teleport : float, rng : np.random.Generator) -> np.ndarray :
+    '''Weighted random walks from every start row in lockstep
+
+    returns : int32 array of shape (len(starts), walk_length + 1), starts in column 0'''
+    num_nodes = len(indptr) - 1
+    paths = np.empty((len(starts), walk_length + 1), dtype=np.int32)
+    paths[:, 0] = starts
+    current = np.asarray(starts, dtype=np.int64)
+    for step in range(1, walk_length + 1) :
+        row_start = indptr[current]
+        row_end = indptr[current + 1]
+        jump = (row_end == row_start) | (rng.random(len(current)) <= teleport)
+        nxt = rng.integers(num_nodes, size=len(current))
+        walking = np.flatnonzero(~jump)
+        if(len(walking)) :
+            low = np.where(row_start[walking] > 0, cumulative[np.maximum(row_start[walking] - 1, 0)], 0.0)
+            high = cumulative[row_end[walking] - 1]
+            target = low + rng.random(len(walking)) * (high - low)
+            # Sorted needles let searchsorted narrow each search from the previous one, several times faster
+            order = np.argsort(target)
+            pos = np.empty(len(target), dtype=np.int64)
+            pos[order] = np.searchsorted(cumulative, target[order], side="right")
+            # Guard against rounding past the end of the row
+            pos = np.clip(pos, row_start[walking], row_end[walking] - 1)
+            nxt[walking] = indices[pos]
+        paths[:, step] = nxt
+        current = nxt.astype(np.int64)
+    return paths
+
+
+_WORKER = None
+
+
+def _init_worker(source) -> None :
+    global _WORKER
+    csr = CSRGraph.load(source) if isinstance(source, str) else source
+    _WORKER = (np.asarray(csr.indptr), np.asarray(csr.indices), _transition_cumsum(csr))
+
+
+def _walk_shard(starts : np.ndarray, walk_length : int, teleport : float, seed) -> np.ndarray :
+    # Runs in a worker process set up by _init_worker
+    indptr, indices, cumulative = _WORKER
+    return _walks(indptr, indices, cumulative, starts, walk_length, teleport, np.random.default_rng(seed))
+
+
+def iter_walks(source, num_walks : int = 10, walk_length : int = 40, teleport : float = 0.0, n_jobs : int = 1,
+               chunk_size : int = 100_000, seed : int = None) :
+    '''Shards of the walk corpus in order, see walk_corpus. At most 2 * n_jobs shards are in flight, so a
+    consumer that reduces each shard (like train_embeddings) never holds the whole corpus'''
+    csr = CSRGraph.load(source) if isinstance(source, str) else source
+    rng = np.random.default_rng(seed)
+    # Every node starts num_walks walks, in a shuffled order so shards see a mix of the graph
+    starts = np.concatenate([rng.permutation(csr.num_nodes) for _ in range(num_walks)]).astype(np.int64)
+    shards = [starts[i : i + chunk_size] for i in range(0, len(starts), chunk_size)]
+    shard_seeds = np.random.SeedSequence(seed).spawn(len(shards))
+
+    if(n_jobs == 1 or len(shards) <= 1) :
+        indptr, indices, cumulative = np.asarray(csr.indptr), np.asarray(csr.indices), _transition_cumsum(csr)
+        for shard, s in zip(shards, shard_seeds) :
+            instrumentation.count("walk_steps_total", len(shard) * walk_length, walk="walk_corpus")
+            yield _walks(indptr, indices, cumulative, shard, walk_length, teleport, np.random.default_rng(s))
+        return
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(source,)) as pool :
+        pending = deque()
+        jobs = iter(zip(shards, shard_seeds))
+        for shard, s in itertools.islice(jobs, 2 * n_jobs) :
+            pending.append((len(shard), pool.submit(_walk_shard, shard, walk_length, teleport, s)))
+        while pending :
+            size, future = pending.popleft()
+            for shard, s in itertools.islice(jobs, 1) :
+                pending.append((len(shard), pool.submit(_walk_shard, shard, walk_length, teleport, s)))
+            instrumentation.count("walk_steps_total", size * walk_length, walk="walk_corpus")
+            yield future.result()
+
+
+@instrumentation.timed("walk_duration_seconds", stage="walk_corpus")
+def walk_corpus(source, num_walks : int = 10, walk_length : int = 40, teleport : float = 0.0, n_jobs : int = 1,
+                chunk_size : int = 100_000, seed : int = None) -> np.ndarray :
+    '''DeepWalk-style corpus: num_walks weighted random walks from every track
+    source : str/CSRGraph -> path of a graph store (workers memory-map it) or an in-memory CSRGraph
+    teleport : float -> probability of jumping to a uniformly random track at each step
+    n_jobs : int -> number of worker processes, walks are sharded in chunks of chunk_size starts
+    seed : int -> seed for a reproducible corpus (independent of n_jobs)
+
+    returns : int32 array of csr rows of shape (num_nodes * num_walks, walk_length + 1), one walk per row'''
+    walks = list(iter_walks(source, num_walks=num_walks, walk_length=walk_length, teleport=teleport, n_jobs=n_jobs,
+                            chunk_size=chunk_size, seed=seed))
+    if not walks :
+        return np.empty((0, walk_length + 1), dtype=np.int32)
+    return np.concatenate(walks)
+
+
+def cooccurrence_counts(shards, num_nodes : int, window : int = 5) -> sp.csr_matrix :
+    '''Symmetric skip-gram counts: (u, v) is counted whenever v appears within window steps of u in a walk
+    shards : iterable of walk arrays (e.g. iter_walks) or a single walk array
+
+    Memory grows with the number of distinct track pairs seen within a window, which is fine for the
+    playlist datasets; lower num_walks or window for graphs with millions of tracks'''
+    if(isinstance(shards, np.ndarray)) :
+        shards = [shards]
+    counts = sp.csr_matrix((num_nodes, num_nodes), dtype=np.float64)
+    for chunk in shards :
+        offsets = range(1, min(window, chunk.shape[1] - 1) + 1)
+        if not len(offsets) :
+            break
+        rows = np.concatenate([chunk[:, :-offset].ravel() for offset in offsets]).astype(np.int64)
+        cols = np.concatenate([chunk[:, offset:].ravel() for offset in offsets]).astype(np.int64)
+        # Pairs in both directions as row-major keys, counted by one sort; sorted keys are already in CSR order
+        keys, values = np.unique(np.concatenate([rows * num_nodes + cols, cols * num_nodes + rows]), return_counts=True)
+        indptr = np.searchsorted(keys // num_nodes, np.arange(num_nodes + 1))
+        counts = counts + sp.csr_matrix((values.astype(np.float64), keys % num_nodes, indptr), shape=(num_nodes, num_nodes))
+    return counts
+
+
+def ppmi(counts : sp.csr_matrix, negative : float = 1.0, smoothing : float = 0.75) -> sp.csr_matrix :
+    '''Shifted positive PMI of a co-occurrence count matrix, max(log(#(u,v) D / (#u #v^smoothing)) - log(negative), 0)
+    smoothing : float -> context distribution smoothing exponent (word2vec uses 0.75)'''
+    counts = counts.tocoo()
+    total = counts.sum()
+    word = np.asarray(counts.sum(axis=1)).ravel()
+    context = np.asarray(counts.sum(axis=0)).ravel() ** smoothing
+    context /= context.sum()
+    pmi = np.log(counts.data * 1.0) - np.log(total) - np.log(word[counts.row] / total) - np.log(context[counts.col]) - np.log(negative)
+    keep = pmi > 0
+    return sp.csr_matrix((pmi[keep], (counts.row[keep], counts.col[keep])), shape=counts.shape)
+
+
+def factorise(M : sp.spmatrix, dimensions : int = 64, seed : int = None) -> np.ndarray :
+    '''Symmetric SVD embedding U * sqrt(S) of M, L2-normalised rows as float32'''
+    n = M.shape[0]
+    dimensions = max(1, min(dimensions, n - 1))
+    U, S, _ = svds(M.astype(np.float64), k=dimensions, random_state=seed)
+    order = np.argsort(-S)
+    vectors = U[:, order] * np.sqrt(S[order])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+@instrumentation.timed("stage_duration_seconds")
+def train_embeddings(source, dimensions : int = 64, num_walks : int = 10, walk_length : int = 40, window : int = 5,
+                     teleport : float = 0.0, negative : float = 1.0, n_jobs : int = 1, seed : int = None) -> "EmbeddingIndex" :
+    '''Walk corpus -> windowed co-occurrence counts -> shifted PPMI -> truncated SVD
+    source : str/CSRGraph -> graph store path or CSRGraph
+    dimensions : int -> embedding size
+    window : int -> skip-gram window in walk steps
+    negative : float -> PMI shift, log(negative) as in skip-gram with that many negative samples
+
+    returns : EmbeddingIndex over the graph's tracks'''
+    csr = CSRGraph.load(source) if isinstance(source, str) else source
+    shards = iter_walks(source, num_walks=num_walks, walk_length=walk_length, teleport=teleport, n_jobs=n_jobs, seed=seed)
+    counts = cooccurrence_counts(shards, csr.num_nodes, window=window)
+    vectors = factorise(ppmi(counts, negative=negative), dimensions=dimensions, seed=seed)
+    meta = {"dimensions" : int(vectors.shape[1]), "num_walks" : num_walks, "walk_length" : walk_length,
+            "window" : window, "teleport" : teleport, "negative" : negative, "seed" : seed, "graph_fingerprint" : csr.fingerprint()}
+    return EmbeddingIndex(np.asarray(csr.nodes), vectors, meta)
+
+
+class EmbeddingIndex :
+    '''Exact cosine nearest-neighbour index over L2-normalised float32 track vectors
+    nodes : np.ndarray -> track IDs, sorted (the CSR row order)
+    vectors : np.ndarray -> one row per track
+    meta : dict -> training parameters, saved alongside'''
+
+    def __init__(self, nodes : np.ndarray, vectors : np.ndarray, meta : dict = None) -> None :
+        self.nodes = nodes
+        self.vectors = vectors
+        self.meta = meta or {}
+
+    @property
+    def num_nodes(self) -> int :
+        return len(self.nodes)
+
+    def rows(self, tracks : list) -> np.ndarray :
+        '''Rows of a list of track IDs, raises KeyError if a track has no embedding, see graphStore.node_rows'''
+        return node_rows(self.nodes, tracks)
+
+    def search(self, queries : np.ndarray, k : int = 10, exclude : np.ndarray = None, block_size : int = None) -> tuple :
+        '''Top-k rows by cosine similarity for a batch of query vectors
+        queries : np.ndarray -> b x dimensions, normalised or not
+        exclude : np.ndarray -> one row per query to leave out (e.g. the query track itself), -1 for none
+        block_size : int -> index rows scored at once, default keeps the b x block score matrix around 128 MB
+
+        returns : (rows, scores) arrays of shape b x k, best first'''
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        b = len(queries)
+        k = min(k, self.num_nodes)
+        block_size = block_size or max(k, 2 ** 25 // max(b, 1))
+        best_rows = np.empty((b, 0), dtype=np.int64)
+        best_scores = np.empty((b, 0), dtype=np.float32)
+        for first in range(0, self.num_nodes, block_size) :
+            scores = queries @ np.asarray(self.vectors[first : first + block_size]).T
+            if(exclude is not None) :
+                local = np.asarray(exclude) - first
+                hit = np.flatnonzero((local >= 0) & (local < scores.shape[1]))
+                scores[hit, local[hit]] = -np.inf
+            keep = min(k, scores.shape[1])
+            top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep] if keep < scores.shape[1] else np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            # Merge with the best of the earlier blocks
+            best_rows = np.concatenate([best_rows, top + first], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            if(best_rows.shape[1] > k) :
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def trained_on(self, csr : CSRGraph) -> bool :
+        '''True if the index was trained on this version of the graph, false for other graphs and indexes saved without a fingerprint'''
+        return self.meta.get("graph_fingerprint") == csr.fingerprint()
+
+    def similar(self, tracks : list, k : int = 10) -> list :
+        '''Most similar tracks of every given track, the track itself excluded
+
+        returns : one list of (track ID, similarity) per track, best first'''
+        rows = self.rows(tracks)
+        result_rows, scores = self.search(np.asarray(self.vectors[rows]), k=k, exclude=rows)
+        return [[(track, float(score)) for track, score in zip(self.nodes[r].tolist(), s.tolist()) if np.isfinite(score)]
+                for r, s in zip(result_rows, scores)]
+
+    def save(self, path : str) -> None :
+        '''Write the index into directory path, e.g. the graph store it was trained on'''
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, EMBEDDINGS_FILE), np.asarray(self.vectors, dtype=np.float32), allow_pickle=False)
+        np.save(os.path.join(path, EMBEDDING_NODES_FILE), np.asarray(self.nodes), allow_pickle=False)
+        with open(os.path.join(path, EMBEDDING_META_FILE), 'w') as f :
+            json.dump(self.meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path : str, mmap : bool = True) -> "EmbeddingIndex" :
+        '''Open an index written by save(). mmap : bool -> memory-map the vectors instead of reading them'''
+        mmap_mode = 'r' if mmap else None
+        meta = {}
+        if(os.path.exists(os.path.join(path, EMBEDDING_META_FILE))) :
+            with open(os.path.join(path, EMBEDDING_META_FILE)) as f :
+                meta = json.load(f)
+        return cls(np.load(os.path.join(path, EMBEDDING_NODES_FILE), mmap_mode=mmap_mode, allow_pickle=False),
+                   np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode=mmap_mode, allow_pickle=False), meta)
+
+
+def has_embeddings(path : str) -> bool :
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, EMBEDDINGS_FILE)) and os.path.exists(os.path.join(path, EMBEDDING_NODES_FILE))
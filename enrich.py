@@ -1,18 +1,61 @@
 from API import SpotifyAPI
+import logging
+import re
 import requests
 import networkx as nx
-from collections import Counter
+from collections import Counter, defaultdict
+import featureStore
+import instrumentation
 
+logger = logging.getLogger(__name__)
+
+
+# Node attribute holding the object URI for each batch type, tracks are the nodes themselves
+URI_ATTRIBUTES = {"artists" : "Artist URI", "albums" : "Album URI", "playlists" : "Playlist URI"}
 
 def batch(nodes : list, batch_size : int) -> list :
     '''nodes : list of all track object IDs from a network
     batch_size() : Size of each batch, maxsize = 50 
     '''
-    batches = []
+    return list(iter_batches(nodes, batch_size))
+
+def iter_batches(ids, batch_size : int) :
+    '''Lazily group an iterable of object IDs into comma separated batches, maxsize = 50
+    '''
     batch_size = batch_size if batch_size < 50 else 50      #force size to 50
-    for i in range(0, len(nodes), batch_size) :
-        batches.append(','.join(nodes[i : i + batch_size]))
-    return batches
+    current = []
+    for object_id in ids :
+        current.append(object_id)
+        if(len(current) == batch_size) :
+            yield ','.join(current)
+            current = []
+    if(current) :
+        yield ','.join(current)
+
+def iter_ids(G : nx.graph, type : str = "tracks", skip_attribute : str = None) :
+    '''Stream the unique object IDs of a graph
+    type : str -> tracks/artists/albums/playlists
+    skip_attribute : str -> leave out nodes that already have this attribute, e.g. "popularity" for tracks
+    that were enriched before, so only new nodes (and their artists/albums) are requested
+    '''
+    uri_attribute = URI_ATTRIBUTES.get(type)
+    seen = set()
+    for node, attrs in G.nodes(data = True) :
+        if(skip_attribute is not None and skip_attribute in attrs) :
+            continue
+        uri = node if uri_attribute is None else attrs.get(uri_attribute)
+        if(uri is None) :
+            continue
+        object_id = uri.split(":")[-1]
+        if(object_id not in seen) :
+            seen.add(object_id)
+            yield object_id
+
+def plan_batches(G : nx.graph, batch_size : int, type : str = "tracks", skip_attribute : str = None) :
+    '''Generator of deduplicated batches for the batch API query, see iter_ids. IDs that are
+    already cached need no special handling here, fetch serves them from the cache without a request
+    '''
+    return iter_batches(iter_ids(G, type, skip_attribute), batch_size)
 
 def node_batch(G : nx.graph, batch_size : int, type : str = "tracks") -> list :
     '''Takes a graph as input, extracts object ID from URIs and creates batches
@@ -20,59 +63,90 @@ def node_batch(G : nx.graph, batch_size : int, type : str = "tracks") -> list :
     G : graph -> Input graph
     type : str -> tracks/artist/albums/playlists -> creates batch based on object type
     type = "{object}" will create a batch based on {object} URIs 
+    Every object ID appears once, even if several nodes share it
     '''
-    nodeList = []
-    if(type == "tracks") :
-        for node in G.nodes(data = False) :
-            nodeList.append(node.split(":")[-1])
-    elif(type == "artists") :
-        for node, attrs in G.nodes(data = True) :
-            for attr, val in attrs.items() :
-                if(attr == "Artist URI") :
-                    nodeList.append(val.split(":")[-1])
-    elif(type == "albums") :
-        for node, attrs in G.nodes(data = True) :
-            for attr, val in attrs.items() :
-                if(attr == "Album URI") :
-                    nodeList.append(val.split(":")[-1])
-    elif(type == "playlists") :
-        for node, attrs in G.nodes(data = True) :
-            for attr, val in attrs.items() :
-                if(attr == "Playlist URI") :
-                    nodeList.append(val.split(":")[-1])
-        
-    trackBatch = batch(nodeList, batch_size)
-    
-    return trackBatch
+    return list(plan_batches(G, batch_size, type))
 
-def get_track_details(batches : list, api_object, token : str) -> dict :
-    '''
-    Take a batch as input and query the 'tracks' endpoint to get details
-    token : str -> Oauth token
-    return : dict with details for all tracks in the batch
+# Key holding the list of objects in each endpoint's batch response
+RESPONSE_KEYS = {"tracks" : "tracks", "audio-features" : "audio_features", "artists" : "artists"}
+
+def request_batches(batches : list, api_object, token : str, search_type : str) -> list :
+    '''Query search_type once per batch of comma-separated IDs
+    return : list of (batch, response) pairs for the batches that succeeded
     '''
-    if(len(batches) == 0) :
-        return None
-    
-    details = []
+    if(hasattr(api_object, "fetch_batches")) :
+        # Concurrent client (asyncAPI.AsyncSpotifyAPI) manages its own token, failed batches come back as None
+        return [(b, data) for b, data in zip(batches, api_object.fetch_batches(search_type, batches)) if data is not None]
+
+    responses = []
     for batch in batches :
         try:
             query = "ids=" + batch
-            data = api_object.get_data(token, 'tracks', query, batch=True)
-            details.append(data)
+            data = api_object.get_data(token, search_type, query, batch=True)
+            responses.append((batch, data))
         except requests.exceptions.HTTPError as http_err:
-            print(f"HTTP error occurred: {http_err}")  # Handle HTTP errors
+            logger.warning("HTTP error occurred: %s", http_err)  # Handle HTTP errors
         except requests.exceptions.ConnectionError as conn_err:
-            print(f"Connection error occurred: {conn_err}")  # Handle connection errors
+            logger.warning("Connection error occurred: %s", conn_err)  # Handle connection errors
         except requests.exceptions.Timeout as timeout_err:
-            print(f"Timeout error occurred: {timeout_err}")  # Handle timeout errors
+            logger.warning("Timeout error occurred: %s", timeout_err)  # Handle timeout errors
         except ValueError as json_err:
-            print(f"JSON decode error: {json_err}")  # Handle JSON parsing errors
+            logger.warning("JSON decode error: %s", json_err)  # Handle JSON parsing errors
         except Exception as err:
-            print(f"An unexpected error occurred: {err}")  # Handle other unexpected errors
+            logger.warning("An unexpected error occurred: %s", err)  # Handle other unexpected errors
+    return responses
+
+def fetch(batches : list, api_object, token : str, search_type : str) -> list :
+    '''Batch responses for search_type. When api_object has a cache only the missing or stale IDs are
+    requested (re-batched by 50) and the responses are rebuilt from the cache in the original batch layout
+    '''
+    with instrumentation.timer("stage_duration_seconds", stage="enrich.fetch", endpoint=search_type) :
+        return _fetch(batches, api_object, token, search_type)
+
+def _fetch(batches : list, api_object, token : str, search_type : str) -> list :
+    cache = getattr(api_object, "cache", None)
+    if(cache is None) :
+        instrumentation.count("enrich_cache_misses_total", sum(b.count(",") + 1 for b in batches), endpoint=search_type)
+        return [data for _, data in request_batches(batches, api_object, token, search_type)]
+
+    key = RESPONSE_KEYS[search_type]
+    batch_ids = [b.split(",") for b in batches]
+    all_ids = list(dict.fromkeys(object_id for ids in batch_ids for object_id in ids))
+    missing = cache.missing(search_type, all_ids)
+    instrumentation.count("enrich_cache_hits_total", len(all_ids) - len(missing), endpoint=search_type)
+    instrumentation.count("enrich_cache_misses_total", len(missing), endpoint=search_type)
+    for requested, data in request_batches(batch(missing, 50), api_object, token, search_type) :
+        if(key in data) :
+            # Spotify returns the objects in request order, null for unknown IDs
+            cache.put_many(search_type, dict(zip(requested.split(","), data[key])))
+
+    objects = cache.get_many(search_type, all_ids)
+    return [{key : [objects[object_id] for object_id in ids if objects.get(object_id) is not None]} for ids in batch_ids]
 
-    return details
+def iter_fetch(batches, api_object, token : str, search_type : str, chunk_size : int = 64) :
+    '''Streaming fetch: pulls chunk_size batches at a time from an iterable (e.g. plan_batches) and yields
+    their responses, so a whole graph can be enriched as a pipeline without materialising every batch
+    '''
+    chunk = []
+    for b in batches :
+        chunk.append(b)
+        if(len(chunk) == chunk_size) :
+            yield from fetch(chunk, api_object, token, search_type)
+            chunk = []
+    if(chunk) :
+        yield from fetch(chunk, api_object, token, search_type)
+
+def get_track_details(batches : list, api_object, token : str) -> dict :
+    '''
+    Take a batch as input and query the 'tracks' endpoint to get details
+    token : str -> Oauth token
+    return : dict with details for all tracks in the batch
+    '''
+    if(len(batches) == 0) :
+        return None
+    return fetch(batches, api_object, token, 'tracks')
 
+@instrumentation.timed("stage_duration_seconds", stage="enrich.update_track_attributes")
 def update_track_attributes(G : nx.Graph, track_details : dict) -> None :
     track_details_dict = {}
     for details in track_details :
@@ -86,6 +160,7 @@ def update_track_attributes(G : nx.Graph, track_details : dict) -> None :
             }
             track_details_dict.update(new_dict)
     nx.set_node_attributes(G, track_details_dict)
+    featureStore.invalidate(G, list(track_details_dict))
     return
          
 
@@ -97,18 +172,9 @@ def get_audio_features(batches : list, api_object, token : str) -> dict :
     '''
     if(len(batches) == 0) :
         return None
-    
-    features = []
-    for batch in batches :
-        try:
-            query = "ids=" + batch
-            data = api_object.get_data(token, 'audio-features', query, batch=True)
-            features.append(data)
-        except Exception as err:
-            print(f"An unexpected error occurred: {err}")  # Handle other unexpected errors
-
-    return features
+    return fetch(batches, api_object, token, 'audio-features')
 
+@instrumentation.timed("stage_duration_seconds", stage="enrich.update_audio_attributes")
 def update_audio_attributes(G : nx.Graph, audio_features : dict) -> None :
     audio_features_dict = {}
     # List of keys to include in the value dictionary.
@@ -123,6 +189,7 @@ def update_audio_attributes(G : nx.Graph, audio_features : dict) -> None :
             audio_features_dict.update(new_dict)
             
     nx.set_node_attributes(G, audio_features_dict)
+    featureStore.invalidate(G, list(audio_features_dict))
     
     return
 
@@ -134,18 +201,9 @@ def get_artist_details(batches : list, api_object, token : str) -> dict :
     '''
     if(len(batches) == 0) :
         return None
-    
-    features = []
-    for batch in batches :
-        try:
-            query = "ids=" + batch
-            data = api_object.get_data(token, 'artists', query, batch=True)
-            features.append(data)
-        except Exception as err:
-            print(f"An unexpected error occurred: {err}")  # Handle other unexpected errors
-
-    return features
+    return fetch(batches, api_object, token, 'artists')
 
+@instrumentation.timed("stage_duration_seconds", stage="enrich.update_artist_details")
 def update_artist_details(G : nx.Graph, artist_details : dict, top_genres : list) -> None :
     artist_details_dict = {}
     for artists in artist_details :
@@ -158,17 +216,54 @@ def update_artist_details(G : nx.Graph, artist_details : dict, top_genres : list
             }
             artist_details_dict.update(new_dict)
     
-    for node, attrs in G.nodes(data=True) :
-        for artist_uri in list(artist_details_dict) :
-            if(artist_uri == G.nodes[node]["Artist URI"]) :
-                cleanedGenres = clean_genres(artist_details_dict[artist_uri]["genres"], top_genres)
-                artist_details_dict[node] = artist_details_dict[artist_uri]
-                artist_details_dict[node]["genres"] = list(cleanedGenres)
-                
-    nx.set_node_attributes(G, artist_details_dict)
+    # Index tracks by artist once, then join each artist's details onto its tracks
+    artist_tracks = defaultdict(list)
+    for node, artist_uri in G.nodes(data="Artist URI") :
+        if(artist_uri is not None) :
+            artist_tracks[artist_uri].append(node)
+
+    matcher = GenreMatcher(top_genres)
+    track_details_dict = {}
+    for artist_uri, details in artist_details_dict.items() :
+        cleanedGenres = matcher.match(details["genres"])
+        for node in artist_tracks.get(artist_uri, []) :
+            track_details_dict[node] = {"artist_popularity" : details["artist_popularity"], "genres" : list(cleanedGenres)}
+
+    nx.set_node_attributes(G, track_details_dict)
+    featureStore.invalidate(G, list(track_details_dict))
     
     return
 
+class GenreMatcher :
+    '''Maps Spotify genre strings onto the top genres they contain, with the same case-insensitive substring
+    rule as clean_genres. The top genres are compiled once into a single regex: a lookahead alternation, longest
+    genre first, finds at every position of a genre string the longest top genre starting there in one pass.
+    Shorter top genres found at the same position are substrings of that match, so each match expands to the
+    genres it contains, computed once per top genre. Results are also memoized per Spotify genre string
+    all_genres : list -> top genres to match, output keeps this order'''
+
+    def __init__(self, all_genres : list) -> None :
+        self.genres = [(genre, genre.lower()) for genre in all_genres]
+        alternatives = sorted({lowered for _, lowered in self.genres}, key=len, reverse=True)
+        self._pattern = re.compile("(?=(" + "|".join(map(re.escape, alternatives)) + "))") if alternatives else None
+        self._contains = {match : tuple(i for i, (_, genre) in enumerate(self.genres) if genre in match) for match in alternatives}
+        self._memo = {}
+
+    def match_one(self, track_genre : str) -> tuple :
+        if(track_genre not in self._memo) :
+            found = set()
+            if(self._pattern is not None) :
+                for match in self._pattern.finditer(track_genre.lower()) :
+                    found.update(self._contains[match.group(1)])
+            self._memo[track_genre] = tuple(sorted(found))
+        return self._memo[track_genre]
+
+    def match(self, track_genres : list) -> list :
+        found = set()
+        for track_genre in track_genres :
+            found.update(self.match_one(track_genre))
+        return [self.genres[i][0] for i in sorted(found)]
+
 def clean_genres(track_genres : list, all_genres : list) -> list :
     cleanedGenre = set()
     for track_genre in track_genres :
@@ -0,0 +1,140 @@
+import inspect
+import weakref
+import numpy as np
+import networkx as nx
+
+'''Precomputed audio-feature matrix for content-aware walks. A FeatureStore stacks the chosen node attributes
+into one L2-normalised float32 matrix, so the cosine similarity of a track with all of its neighbours is a
+row gather and a single matrix-vector product. The enrich update functions call invalidate() whenever they
+write node attributes, and every store built over that graph rebuilds itself on its next use.'''
+
+# The registries below use weak keys, and their values only reference the graph weakly (FeatureStore keeps a
+# weakref to G, bound-method listeners are held as WeakMethods), so a graph is freed once nothing else uses it
+# Graph -> version counter, bumped by invalidate()
+_versions = weakref.WeakKeyDictionary()
+# Graph -> {attributes tuple : FeatureStore}, shared by graphWalk and walkEngine
+_stores = weakref.WeakKeyDictionary()
+# Graph -> references to the callbacks notified with the updated nodes on every invalidate()
+_listeners = weakref.WeakKeyDictionary()
+
+
+def invalidate(G : nx.Graph, nodes : list = None) -> None :
+    '''Mark every feature store built over G as stale
+    nodes : list -> nodes whose attributes changed, passed on to registered listeners (None = unknown/all)'''
+    _versions[G] = _versions.get(G, 0) + 1
+    refs = _listeners.get(G)
+    if(not refs) :
+        return
+    # Listeners whose object was garbage collected are dropped on the way
+    refs[:] = [ref for ref in refs if ref() is not None]
+    for ref in list(refs) :
+        callback = ref()
+        if(callback is not None) :
+            callback(G, nodes)
+
+
+def register_listener(G : nx.Graph, callback) -> None :
+    '''Call callback(G, nodes) whenever the node features of G are invalidated. A bound method is held weakly,
+    so it stops being called once its object is freed. Plain functions are held strongly and must not capture G'''
+    ref = weakref.WeakMethod(callback) if inspect.ismethod(callback) else _StrongRef(callback)
+    _listeners.setdefault(G, []).append(ref)
+
+
+def unregister_listener(G : nx.Graph, callback) -> None :
+    '''Stop calling callback on invalidations of G, a no-op if it was not registered'''
+    refs = _listeners.get(G)
+    if(refs) :
+        refs[:] = [ref for ref in refs if ref() is not None and ref() != callback]
+
+
+class _StrongRef :
+    # Same call interface as weakref.WeakMethod, for plain functions
+    def __init__(self, callback) -> None :
+        self.callback = callback
+
+    def __call__(self) :
+        return self.callback
+
+
+def version(G : nx.Graph) -> int :
+    return _versions.get(G, 0)
+
+
+class FeatureStore :
+    '''L2-normalised float32 matrix of node attributes
+    G : nx.Graph -> graph holding the attributes
+    attributes : list -> attribute names, in column order
+    nodes : list -> row order, default G's node order. Missing attribute values are stored as 0
+    The store only keeps a weak reference to G, its owner (a graph, walker or scorer) keeps the graph alive'''
+
+    def __init__(self, G : nx.Graph, attributes : list, nodes : list = None) -> None :
+        self._graph = weakref.ref(G)
+        self.attributes = list(attributes)
+        self._nodes = nodes
+        self._version = None
+        self._num_nodes = None
+        self._matrix = None
+        self._index = None
+
+    @property
+    def G(self) -> nx.Graph :
+        G = self._graph()
+        if(G is None) :
+            raise ReferenceError("The graph of this feature store was garbage collected")
+        return G
+
+    def _build(self) -> None :
+        nodes = list(self.G.nodes) if self._nodes is None else list(self._nodes)
+        raw = np.zeros((len(nodes), len(self.attributes)), dtype=np.float64)
+        # Columnar graphs (attributeTable.ColumnarGraph) hand out whole attribute columns
+        table = getattr(self.G, "table", None)
+        for j, attr in enumerate(self.attributes) :
+            if(table is not None) :
+                values = table.column(attr, nodes, default=0)
+                if(values.dtype != object) :
+                    raw[:, j] = values
+                    continue
+            else :
+                values = [self.G.nodes[node].get(attr) for node in nodes]
+            raw[:, j] = [0 if v is None else v for v in values]
+        raw[~np.isfinite(raw)] = 0
+        norms = np.linalg.norm(raw, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self._matrix = (raw / norms).astype(np.float32)
+        self._index = {node : i for i, node in enumerate(nodes)}
+        self._version = version(self.G)
+        self._num_nodes = self.G.number_of_nodes()
+
+    def _stale(self) -> bool :
+        return self._matrix is None or self._version != version(self.G) or self._num_nodes != self.G.number_of_nodes()
+
+    @property
+    def matrix(self) -> np.ndarray :
+        '''Normalised feature matrix, rebuilt if the graph's features were invalidated since the last build'''
+        if(self._stale()) :
+            self._build()
+        return self._matrix
+
+    @property
+    def index(self) -> dict :
+        if(self._stale()) :
+            self._build()
+        return self._index
+
+    def rows(self, nodes : list) -> np.ndarray :
+        index = self.index
+        return np.fromiter((index[node] for node in nodes), dtype=np.int64, count=len(nodes))
+
+    def similarity(self, u, nodes : list) -> np.ndarray :
+        '''Cosine similarity of node u with each of nodes'''
+        F = self.matrix
+        return F[self.rows(nodes)] @ F[self.index[u]]
+
+
+def get_feature_store(G : nx.Graph, attributes : list) -> FeatureStore :
+    '''Shared FeatureStore of G for the given attributes'''
+    stores = _stores.setdefault(G, {})
+    key = tuple(attributes)
+    if(key not in stores) :
+        stores[key] = FeatureStore(G, attributes)
+    return stores[key]
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+import networkx as nx
+import scipy.sparse as sp
+
+'''Builds the song co-occurrence graph directly from an interactions_X.csv file. The playlist x song
+incidence matrix B is streamed from the CSV in chunks and the co-occurrence weights are computed as the
+sparse product B.T @ B, one block of playlists at a time, instead of looping over song pairs in Python.
+The playlist membership itself (the non-zeros of B) is kept in G.graph[PLAYLIST_MEMBERSHIP], so playlists with
+a single track, or graphs built without common_playlists, can still be extended incrementally.'''
+
+# G.graph key of the playlist membership: (playlist IDs, song IDs), two parallel arrays with one entry per
+# playlist/song pair
+PLAYLIST_MEMBERSHIP = "playlist_membership"
+
+
+def read_incidence(interactions_file : str, chunksize : int = 1_000_000) -> tuple :
+    '''Stream the playlist_id,song_id rows of an interactions file into a binary sparse incidence matrix
+    interactions_file : str -> path to interactions_X.csv
+    chunksize : int -> number of CSV rows parsed at a time
+
+    returns : (B, playlists, songs) -> B is a CSR matrix of shape (n_playlists, n_songs) with B[p, s] = 1
+    if song s is in playlist p, playlists and songs hold the original IDs for each row/column of B'''
+    playlist_index = {}
+    song_index = {}
+    rows = []
+    cols = []
+    for chunk in pd.read_csv(interactions_file, usecols=["playlist_id", "song_id"], chunksize=chunksize) :
+        playlist_codes, playlist_uniques = pd.factorize(chunk["playlist_id"])
+        song_codes, song_uniques = pd.factorize(chunk["song_id"])
+        # Map chunk-local codes to global codes, only the (small) unique arrays go through Python
+        playlist_map = np.array([playlist_index.setdefault(p, len(playlist_index)) for p in playlist_uniques.tolist()], dtype=np.int32)
+        song_map = np.array([song_index.setdefault(s, len(song_index)) for s in song_uniques.tolist()], dtype=np.int32)
+        rows.append(playlist_map[playlist_codes])
+        cols.append(song_map[song_codes])
+
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+    cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int32)
+    B = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(len(playlist_index), len(song_index)))
+    # A song listed twice in one playlist is still a single co-occurrence
+    B.data[:] = 1
+
+    playlists = np.array(list(playlist_index), dtype=np.int64)
+    songs = np.array(list(song_index), dtype=object)
+    return B, playlists, songs
+
+
+def playlist_membership(B : sp.csr_matrix, playlists : np.ndarray, songs : np.ndarray) -> tuple :
+    '''(playlist IDs, song IDs) of every non-zero of the incidence matrix, grouped by playlist'''
+    B = B.tocoo()
+    order = np.lexsort((B.col, B.row))
+    return playlists[B.row[order]].astype(np.int64), songs[B.col[order]]
+
+
+def cooccurrence_matrix(B : sp.csr_matrix, block_size : int = 100_000) -> sp.csr_matrix :
+    '''Compute the symmetric song x song co-occurrence matrix C = B.T @ B without its diagonal
+    B : csr_matrix -> binary playlist x song incidence matrix
+    block_size : int -> number of playlists multiplied at once, bounds the size of the intermediate products
+
+    returns : CSR matrix where C[u, v] is the number of playlists containing both u and v'''
+    n_songs = B.shape[1]
+    C = sp.csr_matrix((n_songs, n_songs), dtype=np.int32)
+    for start in range(0, B.shape[0], block_size) :
+        block = B[start : start + block_size]
+        C = C + (block.T @ block).tocsr()
+    C.setdiag(0)
+    C.eliminate_zeros()
+    C.sort_indices()
+    return C
+
+
+def common_playlists(B : sp.csr_matrix, playlists : np.ndarray, upper : sp.coo_matrix, max_pairs : int = 2_000_000) -> tuple :
+    '''List the playlists shared by every co-occurring song pair. Playlists are expanded into their song pairs
+    a block at a time, in ascending ID order, and each block is scattered straight into its pairs' slots, so
+    memory beyond the result is bounded by max_pairs
+    B : csr_matrix -> binary playlist x song incidence matrix
+    playlists : np.ndarray -> playlist ID for each row of B
+    upper : coo_matrix -> co-occurrence counts of the pairs u < v in row-major order, i.e. the sorted upper
+    triangle of cooccurrence_matrix(B)
+    max_pairs : int -> song pairs expanded at once (a larger playlist is expanded on its own)
+
+    returns : (indptr, shared) -> shared[indptr[i] : indptr[i + 1]] are the sorted playlist IDs of pair i'''
+    n_songs = B.shape[1]
+    edge_keys = upper.row.astype(np.int64) * n_songs + upper.col
+    counts = upper.data.astype(np.int64)
+    indptr = np.zeros(len(edge_keys) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    shared = np.empty(indptr[-1], dtype=np.int64)
+    filled = np.zeros(len(edge_keys), dtype=np.int64)
+
+    order = np.argsort(playlists, kind="stable")
+    B = B[order]
+    B.sort_indices()
+    ids = np.asarray(playlists, dtype=np.int64)[order]
+    sizes = np.diff(B.indptr).astype(np.int64)
+    cumulative_pairs = np.cumsum(sizes * (sizes - 1) // 2)
+    start = 0
+    while start < B.shape[0] :
+        done = cumulative_pairs[start - 1] if start else 0
+        end = max(start + 1, int(np.searchsorted(cumulative_pairs, done + max_pairs, side="right")))
+        lo, hi = B.indptr[start], B.indptr[end]
+        songs = B.indices[lo : hi].astype(np.int64)
+        # Every song pairs with the songs after it in its (sorted) playlist
+        position = np.arange(hi - lo)
+        later = np.repeat(B.indptr[start + 1 : end + 1] - lo, sizes[start : end]) - position - 1
+        total = int(later.sum())
+        if(total) :
+            first = np.repeat(position, later)
+            second = first + 1 + np.arange(total) - np.repeat(np.cumsum(later) - later, later)
+            owners = np.repeat(ids[start : end], sizes[start : end])[first]
+            keys = songs[first] * n_songs + songs[second]
+            edge = np.searchsorted(edge_keys, keys)
+            if(np.any(edge == len(edge_keys)) or np.any(edge_keys[np.minimum(edge, len(edge_keys) - 1)] != keys)) :
+                raise ValueError("Song pairs of the incidence matrix are missing from the co-occurrence matrix")
+            # Slot of every pair within its edge: the edge's fill level plus its rank among this block's pairs
+            by_edge = np.argsort(edge, kind="stable")
+            edge = edge[by_edge]
+            group = np.flatnonzero(np.r_[True, edge[1:] != edge[:-1]])
+            group_sizes = np.diff(np.r_[group, total])
+            rank = np.arange(total) - np.repeat(group, group_sizes)
+            shared[indptr[edge] + filled[edge] + rank] = owners[by_edge]
+            filled[edge[group]] += group_sizes
+        start = end
+
+    if(not np.array_equal(filled, counts)) :
+        raise ValueError("Co-occurrence counts do not match the playlists of the incidence matrix")
+    return indptr, shared
+
+
+def build_graph(interactions_file : str, chunksize : int = 1_000_000, block_size : int = 100_000, with_playlists : bool = True,
+                max_pairs : int = 2_000_000) -> nx.Graph :
+    '''Build the co-occurrence graph described in the README (same layout as X_graph.pickle)
+    interactions_file : str -> path to interactions_X.csv
+    chunksize : int -> number of CSV rows parsed at a time
+    block_size : int -> number of playlists multiplied at once
+    with_playlists : bool -> if true also store the common_playlists edge attribute
+    max_pairs : int -> song pairs expanded at once while listing common_playlists
+
+    returns : networkX graph with song URIs as nodes, weight/common_playlists edge attributes and the playlist membership'''
+    B, playlists, songs = read_incidence(interactions_file, chunksize=chunksize)
+    # Upper triangle in row-major order, the pair order common_playlists fills
+    C = sp.triu(cooccurrence_matrix(B, block_size=block_size), k=1).tocsr()
+    C.sort_indices()
+    C = C.tocoo()
+
+    G = nx.Graph()
+    G.graph[PLAYLIST_MEMBERSHIP] = playlist_membership(B, playlists, songs)
+    G.add_nodes_from(songs.tolist())
+    u = songs[C.row]
+    v = songs[C.col]
+    if(with_playlists) :
+        indptr, shared = common_playlists(B, playlists, C, max_pairs=max_pairs)
+        bounds = indptr.tolist()
+        G.add_edges_from(
+            (a, b, {"weight": w, "common_playlists": shared[bounds[i] : bounds[i + 1]].tolist()})
+            for i, (a, b, w) in enumerate(zip(u, v, C.data.tolist()))
+        )
+    else :
+        G.add_edges_from((a, b, {"weight": w}) for a, b, w in zip(u, v, C.data.tolist()))
+    return G
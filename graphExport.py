@@ -0,0 +1,187 @@
+import gzip
+import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from xml.sax.saxutils import escape, quoteattr
+import networkx as nx
+
+'''Streaming GEXF / GraphML writers for Gephi. Nodes and edges are serialised one at a time straight into a
+buffered (optionally gzip-compressed) file, so memory stays bounded by one element instead of a whole XML tree,
+and list attributes (genres, common_playlists) are written as their string form without touching the graph.
+The output matches nx.write_gexf / nx.write_graphml on a graph whose lists were converted with str(),
+including networkX's GEXF naming rules: id, label (and edge type) attributes become XML attributes instead of
+attvalues, and an attribute called "key" (the musical key written by enrich) is titled "networkx_key". Dynamic
+GEXF attributes (start/end, spells, viz) are not supported.'''
+
+XML_TYPES = {bool : "boolean", int : "long", float : "double", str : "string"}
+# Attributes nx.write_gexf writes as XML attributes of the element rather than as attvalues
+GEXF_NODE_FIELDS = ("id", "label")
+GEXF_EDGE_FIELDS = ("id", "label", "type")
+# nx.write_gexf renames this attribute, it is reserved for multigraph edge keys
+GEXF_RENAMED = {"key" : "networkx_key"}
+
+
+def _value_type(value) -> type :
+    # Python type an attribute value is written as, lists and other objects become strings
+    for kind in (bool, int, float) :
+        if(isinstance(value, kind)) :
+            return kind
+    if(hasattr(value, "item") and not isinstance(value, (list, tuple))) :
+        return _value_type(value.item())
+    return str
+
+
+def _attribute_types(items) -> dict :
+    '''attribute -> Python type over an iterable of attribute dicts, in order of first appearance.
+    An attribute with both ints and floats is a float, any other mix is a string'''
+    types = {}
+    for attrs in items :
+        for key, value in attrs.items() :
+            current = _value_type(value)
+            known = types.get(key)
+            if(known is None or known is current) :
+                types[key] = current
+            elif({known, current} == {int, float}) :
+                types[key] = float
+            else :
+                types[key] = str
+    return types
+
+
+def _format(value, kind : type, gexf : bool) -> str :
+    if(hasattr(value, "item") and not isinstance(value, (list, tuple, str))) :
+        value = value.item()
+    if(kind is bool and gexf) :
+        return "true" if value else "false"
+    if(kind is float and gexf and isinstance(value, float) and not math.isfinite(value)) :
+        return "NaN" if math.isnan(value) else ("INF" if value > 0 else "-INF")
+    return str(value)
+
+
+def _open(path : str, compress : bool) :
+    if(compress or str(path).endswith(".gz")) :
+        return gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+    return open(path, "w", encoding="utf-8", buffering=1 << 20)
+
+
+def write_gexf(G : nx.Graph, path : str, compress : bool = False, weight : str = "weight") -> None :
+    '''Stream G to a GEXF 1.2 file. compress : bool -> gzip the output (also implied by a .gz path)'''
+    node_types = _attribute_types(attrs for _, attrs in G.nodes(data=True))
+    edge_types = _attribute_types(attrs for _, _, attrs in G.edges(data=True))
+    for field in GEXF_NODE_FIELDS :
+        node_types.pop(field, None)
+    for field in GEXF_EDGE_FIELDS + (weight,) :
+        edge_types.pop(field, None)
+    node_ids = {key : str(i) for i, key in enumerate(node_types)}
+    edge_ids = {key : str(i + len(node_ids)) for i, key in enumerate(edge_types)}
+    edgetype = "directed" if G.is_directed() else "undirected"
+
+    with _open(path, compress) as f :
+        f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        f.write('<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:schemaLocation="http://www.gexf.net/1.2draft http://www.gexf.net/1.2draft/gexf.xsd" version="1.2">\n')
+        f.write(f'  <meta lastmodifieddate="{date.today().isoformat()}">\n    <creator>NetworkX {nx.__version__}</creator>\n  </meta>\n')
+        f.write(f'  <graph defaultedgetype="{edgetype}" mode="static" name={quoteattr(str(G.graph.get("name", "")))}>\n')
+        for cls, types, ids in (("edge", edge_types, edge_ids), ("node", node_types, node_ids)) :
+            if(types) :
+                f.write(f'    <attributes mode="static" class="{cls}">\n')
+                for key, kind in types.items() :
+                    title = GEXF_RENAMED.get(key, str(key))
+                    f.write(f'      <attribute id="{ids[key]}" title={quoteattr(title)} type="{XML_TYPES[kind]}" />\n')
+                f.write('    </attributes>\n')
+
+        f.write('    <nodes>\n')
+        for node, attrs in G.nodes(data=True) :
+            head = f'      <node id={quoteattr(str(attrs.get("id", node)))} label={quoteattr(str(attrs.get("label", node)))}'
+            f.write(_gexf_element(head, "node", attrs, node_types, node_ids, "        "))
+        f.write('    </nodes>\n')
+
+        f.write('    <edges>\n')
+        counter = 0
+        for u, v, attrs in G.edges(data=True) :
+            # Same numbering as nx.write_gexf: edges without an id attribute are counted from 0
+            if("id" in attrs) :
+                edge_id = attrs["id"]
+            else :
+                edge_id = counter
+                counter += 1
+            source = G.nodes[u].get("id", u)
+            target = G.nodes[v].get("id", v)
+            head = f'      <edge source={quoteattr(str(source))} target={quoteattr(str(target))} id={quoteattr(str(edge_id))}'
+            if("label" in attrs) :
+                head += f' label={quoteattr(str(attrs["label"]))}'
+            if(weight in attrs) :
+                head += f' weight="{_format(attrs[weight], _value_type(attrs[weight]), True)}"'
+            if("type" in attrs) :
+                head += f' type={quoteattr(str(attrs["type"]))}'
+            f.write(_gexf_element(head, "edge", attrs, edge_types, edge_ids, "        ", skip=weight))
+        f.write('    </edges>\n  </graph>\n</gexf>\n')
+
+
+def _gexf_element(head : str, tag : str, attrs, types : dict, ids : dict, indent : str, skip : str = None) -> str :
+    values = [(key, value) for key, value in attrs.items() if key != skip and key in ids]
+    if(not values) :
+        return head + ' />\n'
+    lines = [head + '>\n', indent + '<attvalues>\n']
+    for key, value in values :
+        lines.append(f'{indent}  <attvalue for="{ids[key]}" value={quoteattr(_format(value, types[key], True))} />\n')
+    lines.append(indent + '</attvalues>\n')
+    lines.append(indent[:-2] + f'</{tag}>\n')
+    return "".join(lines)
+
+
+def write_graphml(G : nx.Graph, path : str, compress : bool = False) -> None :
+    '''Stream G to a GraphML file. compress : bool -> gzip the output (also implied by a .gz path)'''
+    node_types = _attribute_types(attrs for _, attrs in G.nodes(data=True))
+    edge_types = _attribute_types(attrs for _, _, attrs in G.edges(data=True))
+    node_keys = {key : f"d{i}" for i, key in enumerate(node_types)}
+    edge_keys = {key : f"d{i + len(node_keys)}" for i, key in enumerate(edge_types)}
+    edgedefault = "directed" if G.is_directed() else "undirected"
+
+    with _open(path, compress) as f :
+        f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+        for cls, types, keys in (("edge", edge_types, edge_keys), ("node", node_types, node_keys)) :
+            for key in reversed(list(types)) :
+                f.write(f'  <key id="{keys[key]}" for="{cls}" attr.name={quoteattr(str(key))} attr.type="{XML_TYPES[types[key]]}" />\n')
+        f.write(f'  <graph edgedefault="{edgedefault}">\n')
+        for node, attrs in G.nodes(data=True) :
+            f.write(_graphml_element(f'    <node id={quoteattr(str(node))}', "node", attrs, node_types, node_keys))
+        for u, v, attrs in G.edges(data=True) :
+            f.write(_graphml_element(f'    <edge source={quoteattr(str(u))} target={quoteattr(str(v))}', "edge", attrs, edge_types, edge_keys))
+        f.write('  </graph>\n</graphml>\n')
+
+
+def _graphml_element(head : str, tag : str, attrs, types : dict, keys : dict) -> str :
+    if(not attrs) :
+        return head + ' />\n'
+    lines = [head + '>\n']
+    for key, value in attrs.items() :
+        lines.append(f'      <data key="{keys[key]}">{escape(_format(value, types[key], False))}</data>\n')
+    lines.append(f'    </{tag}>\n')
+    return "".join(lines)
+
+
+def export_graph(G : nx.Graph, gexf_path : str = "bigGraph.gexf", graphml_path : str = "bigGraph.graphml", compress : bool = False) -> list :
+    '''Write G as GEXF and GraphML at the same time, one thread per file (compression runs outside the GIL)
+    gexf_path / graphml_path : str -> output files, None to skip a format
+    compress : bool -> gzip both files, ".gz" is appended to paths that lack it
+
+    returns : list of written paths'''
+    jobs = []
+    for path, writer in ((gexf_path, write_gexf), (graphml_path, write_graphml)) :
+        if(path is None) :
+            continue
+        path = str(path)
+        if(compress and not path.endswith(".gz")) :
+            path += ".gz"
+        jobs.append((path, writer))
+    if(len(jobs) == 1) :
+        jobs[0][1](G, jobs[0][0])
+    elif(jobs) :
+        with ThreadPoolExecutor(max_workers=len(jobs)) as pool :
+            futures = [pool.submit(writer, G, path) for path, writer in jobs]
+            for future in futures :
+                future.result()
+    return [path for path, _ in jobs]
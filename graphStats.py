@@ -0,0 +1,246 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy import stats
+from scipy.sparse.csgraph import connected_components
+from graphStore import CSRGraph
+
+'''Whole-graph statistics over CSR arrays. Core numbers come from one linear-time bucket peeling pass, so each
+edge is touched once however many k values are asked about afterwards.
+Clustering counts triangles with sparse matrix products instead of intersecting neighbour sets node by node.
+Average path length and diameter are computed per connected component from BFS columns that hold one source
+of every component at once: exact when every node is a source, otherwise estimated from uniformly sampled
+sources with confidence intervals, with the diameter bracketed by double-sweep lower and 2 * eccentricity
+upper bounds.'''
+
+
+def core_numbers(csr : CSRGraph) -> np.ndarray :
+    '''Core number of every node in csr row order, same values as nx.core_number (graph without self-loops).
+    Batagelj-Zaversnik bucket peeling: nodes are kept sorted by current degree in one array, with the start of
+    every degree bucket, so removing the lowest-degree node and moving each of its neighbours down one bucket
+    are constant-time swaps, O(nodes + edges) overall'''
+    n = csr.num_nodes
+    if(n == 0) :
+        return np.zeros(0, dtype=np.int64)
+    degree = csr.degree().astype(np.int64)
+    # Nodes by ascending degree (counting sort), position of every node, and start of every degree bucket
+    order = np.argsort(degree, kind="stable")
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+    bucket_start = np.searchsorted(degree[order], np.arange(degree.max() + 1))
+
+    # Plain lists: the loop below does scalar reads and writes, which are several times faster on lists
+    indptr = np.asarray(csr.indptr).tolist()
+    indices = np.asarray(csr.indices).tolist()
+    degree = degree.tolist()
+    order = order.tolist()
+    position = position.tolist()
+    bucket_start = bucket_start.tolist()
+    for i in range(n) :
+        v = order[i]
+        dv = degree[v]
+        for u in indices[indptr[v] : indptr[v + 1]] :
+            du = degree[u]
+            if(du > dv) :
+                # Swap u with the first node of its bucket, then shrink the bucket from the front
+                pu = position[u]
+                pw = bucket_start[du]
+                w = order[pw]
+                if(u != w) :
+                    order[pu], order[pw] = w, u
+                    position[u], position[w] = pw, pu
+                bucket_start[du] += 1
+                degree[u] = du - 1
+    # Degrees of removed nodes are frozen at the moment they are peeled, which is their core number
+    return np.asarray(degree, dtype=np.int64)
+
+
+def k_core_sizes(core : np.ndarray, k_values : list = None) -> tuple :
+    '''Number of nodes in the k-core for each k, from the core numbers alone (a node is in the k-core iff its core number >= k)
+    k_values : list -> k values to report, default 0..max core number
+
+    returns : (k_values array, sizes array)'''
+    counts = np.bincount(np.asarray(core, dtype=np.int64))
+    at_least = np.cumsum(counts[::-1])[::-1]
+    k_values = np.arange(len(counts)) if k_values is None else np.asarray(k_values, dtype=np.int64)
+    sizes = np.where(k_values < len(at_least), at_least[np.minimum(k_values, len(at_least) - 1)], 0)
+    return k_values, sizes
+
+
+def simple_adjacency(csr : CSRGraph) -> sp.csr_matrix :
+    '''Unweighted 0/1 adjacency matrix of csr without self-loops'''
+    n = csr.num_nodes
+    indptr = np.asarray(csr.indptr)
+    indices = np.asarray(csr.indices)
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    keep = rows != indices
+    return sp.csr_matrix((np.ones(keep.sum()), (rows[keep], indices[keep])), shape=(n, n))
+
+
+def triangles(csr : CSRGraph, block_size : int = 4096) -> np.ndarray :
+    '''Number of triangles through every node in csr row order, same values as nx.triangles.
+    Row i of (A @ A) * A counts the closed two-step walks through i, i.e. twice its triangles. The product is
+    formed block_size rows at a time so memory stays bounded on graphs with high-degree hubs'''
+    A = simple_adjacency(csr)
+    n = A.shape[0]
+    closed = np.zeros(n)
+    for start in range(0, n, block_size) :
+        block = A[start : start + block_size]
+        closed[start : start + block_size] = np.asarray((block @ A).multiply(block).sum(axis=1)).ravel()
+    return (closed // 2).astype(np.int64)
+
+
+def clustering_coefficients(csr : CSRGraph, block_size : int = 4096) -> np.ndarray :
+    '''Local clustering coefficient of every node in csr row order, same values as nx.clustering (unweighted)'''
+    degree = np.diff(simple_adjacency(csr).indptr).astype(np.float64)
+    possible = degree * (degree - 1)
+    with np.errstate(divide="ignore", invalid="ignore") :
+        return np.where(possible > 0, 2 * triangles(csr, block_size) / possible, 0.0)
+
+
+def average_clustering(csr : CSRGraph, count_zeros : bool = True, block_size : int = 4096) -> float :
+    '''Average clustering coefficient, same value as nx.average_clustering (unweighted)
+    count_zeros : bool -> include nodes with a coefficient of zero in the average'''
+    coefficients = clustering_coefficients(csr, block_size)
+    if(not count_zeros) :
+        coefficients = coefficients[coefficients > 0]
+    return float(coefficients.mean()) if len(coefficients) else 0.0
+
+
+def _columns_per_batch(n : int) -> int :
+    # Two dense n x batch matrices are live per BFS level, keep them around 256 MB
+    return int(max(1, min(64, 2 ** 25 // max(n, 1))))
+
+
+def _bfs_columns(A : sp.csr_matrix, starts : np.ndarray) -> np.ndarray :
+    '''Level-synchronous BFS, one column per boolean start vector (n x b). A column may hold one start node in each
+    connected component, every node then gets its distance to the start of its own component
+
+    returns : int32 distance matrix n x b, -1 where no start of the column is reachable'''
+    dist = np.where(starts, 0, -1).astype(np.int32)
+    frontier = starts.astype(np.float64)
+    level = 0
+    while True :
+        new = ((A @ frontier) > 0) & (dist < 0)
+        if not new.any() :
+            return dist
+        level += 1
+        dist[new] = level
+        frontier = new.astype(np.float64)
+
+
+def _by_component(order : np.ndarray, bounds : np.ndarray, dist : np.ndarray) -> tuple :
+    # Per-component (distance sum, eccentricity) of every column, nodes grouped by component with order/bounds
+    grouped = dist[order]
+    return np.add.reduceat(np.maximum(grouped, 0), bounds, axis=0, dtype=np.int64), np.maximum.reduceat(grouped, bounds, axis=0)
+
+
+def _farthest(labels : np.ndarray, dist : np.ndarray, num_components : int) -> np.ndarray :
+    # One node at the largest distance in every component
+    order = np.lexsort((-dist, labels))
+    first = np.searchsorted(labels[order], np.arange(num_components))
+    return order[first]
+
+
+def path_length_stats(csr : CSRGraph, num_sources : int = 256, exact : bool = False, sweeps : int = 4,
+                      confidence : float = 0.95, seed : int = None) -> dict :
+    '''Average shortest path length and diameter of every connected component (unweighted), from BFS
+    csr : CSRGraph -> graph, e.g. NetworkAnalysis.csr
+    num_sources : int -> BFS sources sampled uniformly per component, components with at most this many nodes are exact
+    exact : bool -> run a BFS from every node, the average path length and diameter are then exact
+    sweeps : int -> BFS sweeps per component for the diameter bounds, starting at its highest-degree node and moving
+    to the farthest node found (the double-sweep lower bound; every BFS from s also bounds it by 2 * ecc(s) from above)
+    confidence : float -> level of the confidence intervals
+
+    returns : dict with "avg_path_length" (mean over all connected node pairs, equal to
+    nx.average_shortest_path_length on a connected graph) and its "avg_path_length_ci", "diameter" (largest lower
+    bound over the components, exact when the bounds meet) and "diameter_upper_bound", "num_sources", "exact",
+    "labels" (component of every node in csr row order, 0 is the largest) and "components", a dict of per-component
+    arrays: "size", "avg_path_length", "ci_low", "ci_high", "diameter", "diameter_upper_bound" and "num_sources"'''
+    A = simple_adjacency(csr)
+    n = A.shape[0]
+    num_components, labels = connected_components(A, directed=False)
+    # Relabel by decreasing size so component 0 is the giant component
+    size = np.bincount(labels, minlength=num_components)
+    rank = np.empty(num_components, dtype=np.int64)
+    rank[np.argsort(-size, kind="stable")] = np.arange(num_components)
+    labels = rank[labels]
+    size = np.bincount(labels, minlength=num_components)
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(num_components))
+
+    # Source j of every component goes into column j, so one BFS column serves all components at once
+    rng = np.random.default_rng(seed)
+    shuffled = np.lexsort((rng.random(n), labels))
+    position = np.empty(n, dtype=np.int64)
+    position[shuffled] = np.arange(n) - bounds[labels[shuffled]]
+    k = size.copy() if exact else np.minimum(size, num_sources)
+    columns = int(k.max()) if n else 0
+
+    mean_sum = np.zeros(num_components)
+    mean_square_sum = np.zeros(num_components)
+    lower = np.zeros(num_components, dtype=np.int64)
+    upper = np.maximum(size - 1, 0)
+    pairs = np.maximum(size - 1, 1)
+    batch = _columns_per_batch(n)
+    for first in range(0, columns, batch) :
+        js = np.arange(first, min(first + batch, columns))
+        dist = _bfs_columns(A, position[:, None] == js[None, :])
+        sums, ecc = _by_component(order, bounds, dist)
+        has_source = k[:, None] > js[None, :]
+        means = sums / pairs[:, None]
+        mean_sum += np.where(has_source, means, 0).sum(axis=1)
+        mean_square_sum += np.where(has_source, means ** 2, 0).sum(axis=1)
+        lower = np.maximum(lower, np.where(has_source, ecc, 0).max(axis=1))
+        upper = np.minimum(upper, np.where(has_source, 2 * ecc, upper[:, None]).min(axis=1))
+
+    if(not exact and n) :
+        # Double sweeps: BFS from the highest-degree node of every component, then repeatedly from the farthest node found
+        degree = np.diff(A.indptr)
+        start = np.lexsort((-degree, labels))[bounds]
+        for _ in range(sweeps) :
+            column = np.zeros((n, 1), dtype=bool)
+            column[start, 0] = True
+            dist = _bfs_columns(A, column)
+            ecc = _by_component(order, bounds, dist)[1][:, 0]
+            lower = np.maximum(lower, ecc)
+            upper = np.minimum(upper, 2 * ecc)
+            start = _farthest(labels, dist[:, 0], num_components)
+    upper = np.where(k == size, lower, np.maximum(upper, lower))
+
+    # Per component: mean over the sampled sources of their mean distance, with a t interval corrected for
+    # sampling without replacement from a finite population
+    with np.errstate(divide="ignore", invalid="ignore") :
+        average = np.where(size > 1, mean_sum / k, np.nan)
+        variance = np.maximum(mean_square_sum - k * average ** 2, 0) / (k - 1)
+        standard_error = np.sqrt(variance / k * (size - k) / np.maximum(size - 1, 1))
+    standard_error = np.where(k == size, 0.0, np.where(k > 1, standard_error, np.nan))
+    margin = stats.t.ppf(0.5 + confidence / 2, np.maximum(k - 1, 1)) * standard_error
+
+    # Over all connected pairs: components weighted by their number of ordered node pairs
+    weight = (size * (size - 1)).astype(np.float64)
+    connected = weight > 0
+    if(connected.any()) :
+        weight /= weight.sum()
+        overall = float(np.sum(weight[connected] * average[connected]))
+        overall_margin = float(stats.norm.ppf(0.5 + confidence / 2) * np.sqrt(np.sum((weight[connected] * standard_error[connected]) ** 2)))
+    else :
+        overall, overall_margin = 0.0, 0.0
+
+    return {
+        "avg_path_length" : overall,
+        "avg_path_length_ci" : (overall - overall_margin, overall + overall_margin),
+        "diameter" : int(lower.max()) if n else 0,
+        "diameter_upper_bound" : int(upper.max()) if n else 0,
+        "num_sources" : int(k.sum()),
+        "exact" : bool(np.all(k == size)),
+        "labels" : labels,
+        "components" : {
+            "size" : size,
+            "avg_path_length" : average,
+            "ci_low" : average - margin,
+            "ci_high" : average + margin,
+            "diameter" : lower,
+            "diameter_upper_bound" : upper,
+            "num_sources" : k,
+        },
+    }
@@ -0,0 +1,323 @@
+import os
+import json
+import hashlib
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+from graphBuilder import PLAYLIST_MEMBERSHIP
+
+'''Compact on-disk graph store. A graph is saved as a directory of .npy files: CSR adjacency arrays
+(indptr/indices), edge weights, the common_playlists lists of every edge, the playlist x track incidence matrix
+and one column per node attribute.
+Arrays are memory-mapped on load, so opening a store costs the same regardless of graph size and several
+processes reading the same store share one copy through the page cache.'''
+
+META_FILE = "meta.json"
+NODES = "nodes"
+INDPTR = "indptr"
+INDICES = "indices"
+WEIGHTS = "weights"
+PLAYLIST_INDPTR = "playlist_indptr"
+PLAYLIST_IDS = "playlist_ids"
+INCIDENCE_PLAYLISTS = "incidence_playlists"
+INCIDENCE_INDPTR = "incidence_indptr"
+INCIDENCE_INDICES = "incidence_indices"
+
+# Node attribute column kinds
+NUMERIC = "numeric"
+INTEGER = "integer"
+STRING = "string"
+LIST = "list"
+
+
+def _column_kind(values : list) -> str :
+    kind = None
+    for value in values :
+        if(value is None) :
+            continue
+        if(isinstance(value, (bool, int, np.integer))) :
+            current = INTEGER
+        elif(isinstance(value, (float, np.floating))) :
+            current = NUMERIC
+        elif(isinstance(value, (list, tuple, set))) :
+            current = LIST
+        else :
+            current = STRING
+        if(kind is None or kind == current) :
+            kind = current
+        elif({kind, current} == {INTEGER, NUMERIC}) :
+            kind = NUMERIC
+        else :
+            return STRING
+    return kind or NUMERIC
+
+
+def _encode_column(values : list, kind : str) -> np.ndarray :
+    if(kind in (NUMERIC, INTEGER)) :
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    if(kind == LIST) :
+        values = [json.dumps(list(v)) if v is not None else "" for v in values]
+    else :
+        values = ["" if v is None else str(v) for v in values]
+    return np.array(values, dtype=str)
+
+
+def node_array(nodes : list) -> np.ndarray :
+    '''Node IDs as an array that keeps them as they are: a string array for string IDs, int64 for integer IDs and an
+    object array for any other (mutually orderable) IDs, so .tolist() gives back the original labels'''
+    nodes = list(nodes)
+    if(all(isinstance(node, str) for node in nodes)) :
+        return np.array(nodes, dtype=str)
+    if(all(isinstance(node, (int, np.integer)) and not isinstance(node, (bool, np.bool_)) for node in nodes)) :
+        return np.array(nodes, dtype=np.int64)
+    array = np.empty(len(nodes), dtype=object)
+    array[:] = nodes
+    return array
+
+
+def _plain(value) :
+    # numpy scalar -> Python value, so KeyErrors show the ID as the caller wrote it
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def node_rows(nodes : np.ndarray, queries : list) -> np.ndarray :
+    '''Rows of query IDs in a sorted node array, raises KeyError for any ID that is not in it. Queries are compared
+    as given and never cast to the node dtype: a cast to a fixed-width string array would cut an overlong unknown
+    ID down to a real one'''
+    if(isinstance(queries, (str, bytes)) or np.ndim(queries) == 0) :
+        raise TypeError(f"Expected a list of node IDs, got the single ID {queries!r}")
+    if(isinstance(queries, np.ndarray) and queries.dtype != object) :
+        query = queries
+    else :
+        query = node_array(queries)
+    if(len(query) == 0) :
+        return np.empty(0, dtype=np.int64)
+    if(nodes.dtype == object and query.dtype != object) :
+        query = query.astype(object)
+    elif(query.dtype.kind.replace("u", "i") != nodes.dtype.kind) :
+        # IDs of the wrong type, e.g. a string in a graph with integer IDs
+        raise KeyError(_plain(query[0]))
+    try :
+        rows = np.searchsorted(nodes, query)
+    except (TypeError, ValueError) :
+        raise KeyError(_plain(query[0])) from None
+    found = rows < len(nodes)
+    found[found] = nodes[rows[found]] == query[found]
+    if not found.all() :
+        raise KeyError(_plain(query[~found][0]))
+    return rows
+
+
+def _decode_value(value, kind : str) :
+    if(kind in (NUMERIC, INTEGER)) :
+        if(np.isnan(value)) :
+            return None
+        return int(value) if kind == INTEGER else float(value)
+    if(value == "") :
+        return None
+    if(kind == LIST) :
+        return json.loads(value)
+    return str(value)
+
+
+class CSRGraph :
+    '''Undirected weighted graph held as CSR arrays. Rows are ordered by sorted node ID, so a node is
+    located with a binary search over `nodes` instead of a Python dict built at load time. Node IDs keep their
+    type (see node_array), only string and integer IDs can be saved as a store.'''
+
+    def __init__(self, nodes : np.ndarray, indptr : np.ndarray, indices : np.ndarray, weights : np.ndarray,
+                 node_columns : dict = None, column_kinds : dict = None,
+                 playlist_indptr : np.ndarray = None, playlist_ids : np.ndarray = None,
+                 incidence_playlists : np.ndarray = None, incidence_indptr : np.ndarray = None, incidence_indices : np.ndarray = None) -> None :
+        self.nodes = nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.node_columns = node_columns or {}
+        self.column_kinds = column_kinds or {}
+        self.playlist_indptr = playlist_indptr
+        self.playlist_ids = playlist_ids
+        # Playlist membership in CSR form: the tracks (rows) of playlist incidence_playlists[p] are
+        # incidence_indices[incidence_indptr[p] : incidence_indptr[p + 1]]
+        self.incidence_playlists = incidence_playlists
+        self.incidence_indptr = incidence_indptr
+        self.incidence_indices = incidence_indices
+
+    @property
+    def num_nodes(self) -> int :
+        return len(self.nodes)
+
+    @property
+    def num_edges(self) -> int :
+        return len(self.indices) // 2
+
+    def degree(self) -> np.ndarray :
+        return np.diff(self.indptr)
+
+    def index(self, node) -> int :
+        '''Row of a node ID, raises KeyError if the node is not in the graph'''
+        try :
+            return int(node_rows(self.nodes, [node])[0])
+        except KeyError :
+            raise KeyError(node) from None
+
+    def indices_of(self, nodes : list) -> np.ndarray :
+        '''Rows of several node IDs at once, raises KeyError if any node is missing'''
+        return node_rows(self.nodes, nodes)
+
+    def playlist_membership(self) -> tuple :
+        '''(playlist IDs, track IDs) of every playlist/track pair, see graphBuilder.PLAYLIST_MEMBERSHIP, None if not stored'''
+        if(self.incidence_playlists is None) :
+            return None
+        counts = np.diff(np.asarray(self.incidence_indptr))
+        return (np.repeat(np.asarray(self.incidence_playlists), counts),
+                np.asarray(self.nodes, dtype=object)[np.asarray(self.incidence_indices)])
+
+    def fingerprint(self) -> str :
+        '''Hash of the node IDs, adjacency and weights, to tell whether data derived from a graph (e.g. saved
+        embeddings) still belongs to it'''
+        digest = hashlib.blake2b(digest_size=16)
+        nodes = np.asarray(self.nodes)
+        digest.update(repr(nodes.tolist()).encode() if nodes.dtype == object else nodes.dtype.str.encode() + nodes.tobytes())
+        for arr in (self.indptr, self.indices, self.weights) :
+            digest.update(np.ascontiguousarray(arr).tobytes())
+        return digest.hexdigest()
+
+    def neighbours(self, i : int) -> np.ndarray :
+        return self.indices[self.indptr[i] : self.indptr[i + 1]]
+
+    def neighbour_weights(self, i : int) -> np.ndarray :
+        return self.weights[self.indptr[i] : self.indptr[i + 1]]
+
+    def to_scipy(self) -> sp.csr_matrix :
+        return sp.csr_matrix((self.weights, self.indices, self.indptr), shape=(self.num_nodes, self.num_nodes))
+
+    @classmethod
+    def from_matrix(cls, C : sp.spmatrix, nodes : list) -> "CSRGraph" :
+        '''Build from a symmetric co-occurrence matrix (e.g. graphBuilder.cooccurrence_matrix) and its node IDs'''
+        nodes = node_array(nodes)
+        order = np.argsort(nodes, kind="stable")
+        C = sp.csr_matrix(C)[order][:, order].tocsr()
+        C.sort_indices()
+        return cls(nodes[order], C.indptr.astype(np.int64), C.indices.astype(np.int32), C.data)
+
+    @classmethod
+    def from_networkx(cls, G : nx.Graph, node_attributes : list = None, weight : str = "weight", with_playlists : bool = True) -> "CSRGraph" :
+        '''Convert a networkX graph
+        node_attributes : list -> attribute columns to keep, default all
+        with_playlists : bool -> if true also keep the common_playlists edge attribute and the playlist membership'''
+        nodes = node_array(sorted(G.nodes))
+        C = nx.to_scipy_sparse_array(G, nodelist=nodes.tolist(), weight=weight, format="csr")
+        C.sort_indices()
+
+        if(node_attributes is None) :
+            node_attributes = []
+            for _, attrs in G.nodes(data=True) :
+                node_attributes.extend(attr for attr in attrs if attr not in node_attributes)
+        node_columns = {}
+        column_kinds = {}
+        for attr in node_attributes :
+            values = [G.nodes[node].get(attr) for node in nodes]
+            column_kinds[attr] = _column_kind(values)
+            node_columns[attr] = _encode_column(values, column_kinds[attr])
+
+        playlist_indptr = None
+        playlist_ids = None
+        rows = np.repeat(np.arange(len(nodes)), np.diff(C.indptr))
+        lists = [G[nodes[u]][nodes[v]].get("common_playlists") for u, v in zip(rows, C.indices)] if with_playlists else []
+        if(lists and all(pl is not None for pl in lists)) :
+            playlist_indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+            np.cumsum([len(pl) for pl in lists], out=playlist_indptr[1:])
+            playlist_ids = np.fromiter((p for pl in lists for p in pl), dtype=np.int64, count=playlist_indptr[-1])
+
+        incidence = (None, None, None)
+        membership = G.graph.get(PLAYLIST_MEMBERSHIP) if with_playlists else None
+        if(membership is not None) :
+            playlists, tracks = membership
+            rows = node_rows(nodes, tracks)
+            playlists = np.asarray(playlists, dtype=np.int64)
+            order = np.lexsort((rows, playlists))
+            playlists, rows = playlists[order], rows[order]
+            starts = np.flatnonzero(np.r_[True, playlists[1:] != playlists[:-1]]) if len(playlists) else np.empty(0, dtype=np.int64)
+            incidence = (playlists[starts], np.r_[starts, len(playlists)].astype(np.int64), rows.astype(np.int32))
+
+        return cls(nodes, C.indptr.astype(np.int64), C.indices.astype(np.int32), C.data,
+                   node_columns, column_kinds, playlist_indptr, playlist_ids, *incidence)
+
+    def to_networkx(self) -> nx.Graph :
+        '''Materialise the store as a networkX graph with all node and edge attributes'''
+        G = nx.Graph()
+        nodes = self.nodes.tolist()
+        columns = {attr : (np.asarray(col).tolist(), self.column_kinds.get(attr, STRING)) for attr, col in self.node_columns.items()}
+        for i, node in enumerate(nodes) :
+            attrs = {}
+            for attr, (col, kind) in columns.items() :
+                value = _decode_value(col[i], kind)
+                if(value is not None) :
+                    attrs[attr] = value
+            G.add_node(node, **attrs)
+
+        indptr = np.asarray(self.indptr)
+        rows = np.repeat(np.arange(self.num_nodes), np.diff(indptr))
+        upper = np.flatnonzero(rows < np.asarray(self.indices))
+        weights = np.asarray(self.weights)[upper].tolist()
+        for pos, u, v, w in zip(upper.tolist(), rows[upper].tolist(), np.asarray(self.indices)[upper].tolist(), weights) :
+            attrs = {"weight": w}
+            if(self.playlist_ids is not None) :
+                attrs["common_playlists"] = self.playlist_ids[self.playlist_indptr[pos] : self.playlist_indptr[pos + 1]].tolist()
+            G.add_edge(nodes[u], nodes[v], **attrs)
+        if(self.incidence_playlists is not None) :
+            G.graph[PLAYLIST_MEMBERSHIP] = self.playlist_membership()
+        return G
+
+    def save(self, path : str) -> None :
+        '''Write the graph as a directory of .npy files plus a meta.json describing the node columns'''
+        if(self.nodes.dtype == object) :
+            raise TypeError("Only graphs with string or integer node IDs can be saved as a store")
+        os.makedirs(path, exist_ok=True)
+        arrays = {NODES : self.nodes, INDPTR : self.indptr, INDICES : self.indices, WEIGHTS : self.weights}
+        if(self.playlist_ids is not None) :
+            arrays[PLAYLIST_INDPTR] = self.playlist_indptr
+            arrays[PLAYLIST_IDS] = self.playlist_ids
+        if(self.incidence_playlists is not None) :
+            arrays[INCIDENCE_PLAYLISTS] = self.incidence_playlists
+            arrays[INCIDENCE_INDPTR] = self.incidence_indptr
+            arrays[INCIDENCE_INDICES] = self.incidence_indices
+        columns = []
+        for i, (attr, col) in enumerate(self.node_columns.items()) :
+            # Attribute names contain spaces, so columns are stored under positional file names
+            arrays[f"column_{i}"] = col
+            columns.append({"name" : attr, "file" : f"column_{i}", "kind" : self.column_kinds.get(attr, STRING)})
+        for name, arr in arrays.items() :
+            np.save(os.path.join(path, name + ".npy"), np.asarray(arr), allow_pickle=False)
+
+        meta = {"num_nodes" : self.num_nodes, "num_edges" : self.num_edges, "columns" : columns}
+        with open(os.path.join(path, META_FILE), 'w') as f :
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path : str, mmap : bool = True) -> "CSRGraph" :
+        '''Open a store written by save(). mmap : bool -> memory-map the arrays instead of reading them'''
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, META_FILE)) as f :
+            meta = json.load(f)
+
+        def _load(name) :
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode, allow_pickle=False)
+
+        node_columns = {col["name"] : _load(col["file"]) for col in meta["columns"]}
+        column_kinds = {col["name"] : col["kind"] for col in meta["columns"]}
+        playlist_indptr = None
+        playlist_ids = None
+        if(os.path.exists(os.path.join(path, PLAYLIST_IDS + ".npy"))) :
+            playlist_indptr = _load(PLAYLIST_INDPTR)
+            playlist_ids = _load(PLAYLIST_IDS)
+        incidence = (None, None, None)
+        if(os.path.exists(os.path.join(path, INCIDENCE_PLAYLISTS + ".npy"))) :
+            incidence = tuple(_load(name) for name in (INCIDENCE_PLAYLISTS, INCIDENCE_INDPTR, INCIDENCE_INDICES))
+        return cls(_load(NODES), _load(INDPTR), _load(INDICES), _load(WEIGHTS),
+                   node_columns, column_kinds, playlist_indptr, playlist_ids, *incidence)
+
+
+def is_graph_store(path : str) -> bool :
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILE))
@@ -1,8 +1,12 @@
+import logging
 import networkx as nx
 import random
 import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
+from featureStore import get_feature_store
+import instrumentation
+
+logger = logging.getLogger(__name__)
 
 '''Function for the graph walk, takes a song as input and performs a graph walk based on the
 edge weights of neighboring nodes as a simple recommendation system '''
@@ -19,34 +23,18 @@ def cosine_sim(G : nx.graph, u : nx.nodes, v : nx.nodes, attributes : list) -> f
 
     returns : Float -> Cosine similarity of nodes u and v'''
     
-    attributes_1 = G.nodes[u]
-    attributes_2 = G.nodes[v]
-    
-    vec1 = []
-    for k, v in attributes_1.items() :
-        if(k in attributes) :
-            vec1.append(v)
-            
-    vec2 = []
-    for k, v in attributes_2.items() :
-        if(k in attributes) :
-            vec2.append(v)
-    
-    vec1 = np.array(vec1).reshape(1, -1)
-    vec2 = np.array(vec2).reshape(1, -1)
-    return cosine_similarity(vec1, vec2)[0][0]
+    return float(get_feature_store(G, attributes).similarity(u, [v])[0])
 
 
 def jaccard_similarity(list1 : list, list2 : list) -> float:
     set1, set2 = set(list1), set(list2)
     intersection = len(set1.intersection(set2))
     union = len(set1.union(set2))
-    print(f"intersection : {intersection}")
-    print(f"union : {union}")
+    logger.info("intersection : %s, union : %s", intersection, union)
     return intersection / union
 
 
-def getRecommendation(G : nx.graph, current_track : nx.nodes, prev_tracks : list, teleport : float = 0.1, context : str = False, attributes : list = ['popularity']) -> nx.nodes :
+def getRecommendation(G : nx.graph, current_track : nx.nodes, prev_tracks : list, teleport : float = 0.1, context : str = False, attributes : list = ['popularity'], audio_index = None) -> nx.nodes :
     '''Gets next recommendation given a current track. Iterates through all neighbours and randomly selects one out of the neighbours with
     highest edge weight
     @params
@@ -54,12 +42,18 @@ def getRecommendation(G : nx.graph, current_track : nx.nodes, prev_tracks : list
     current_track : nx.node -> current track node
     prev_tracks : list(nx.nodes) -> cache of recommended songs so far to avoid short cycles of recommendations
     teleport : float(0, 1) -> teleportation probability. Probability of abandoning current walk and teleporting to a new node for a new walk.
+    audio_index : audioIndex.AudioIndex -> teleport to one of the sound-alikes of the current track instead of any track
     
     returns : Node of next track '''
     
     if(random.random() <= teleport) :
+        instrumentation.count("walk_teleports_total", walk="graphWalk")
+        logger.debug("Teleported")
+        if(audio_index is not None) :
+            target = audio_index.teleport_target(current_track, exclude=prev_tracks)
+            if(target is not None) :
+                return target
         all_nodes = list(set(G.nodes) - set(prev_tracks))
-        print(f"Teleported")
         return random.choice(all_nodes)
     
     neighbours = list(G.neighbors(current_track))
@@ -70,11 +64,14 @@ def getRecommendation(G : nx.graph, current_track : nx.nodes, prev_tracks : list
     maxEdgeweight = -1
     maxSimilarity = -1
     candidates = []
-    for neighbour in neighbours :
+    if(context) :
+        # One gather + matrix-vector product over the precomputed feature matrix for all neighbours
+        similarities = get_feature_store(G, attributes).similarity(current_track, neighbours)
+    for i, neighbour in enumerate(neighbours) :
         if(neighbour in prev_tracks) :
             continue
         if(context) :
-            similarity = cosine_sim(G, current_track, neighbour, attributes = attributes)
+            similarity = similarities[i]
             if(similarity > maxSimilarity) :
                 maxSimilarity = similarity
                 candidates = [neighbour]
@@ -90,19 +87,21 @@ def getRecommendation(G : nx.graph, current_track : nx.nodes, prev_tracks : list
                 candidates.append(neighbour)
     
     if(len(candidates)) :
-        print(f"u : {current_track} | v : {candidates[0]} | Cos similarity : {maxSimilarity}")
+        logger.debug("u : %s | v : %s | Cos similarity : %s", current_track, candidates[0], maxSimilarity)
 
     return random.choice(candidates) if candidates else None
 
 
 
     
-def graphWalk(G : nx.Graph, current_track : nx.nodes, walk_length : int = 10, teleport : float = 0.1, context = False, attributes : list = ['popularity']) -> list :
+@instrumentation.timed("walk_duration_seconds", stage="graphWalk")
+def graphWalk(G : nx.Graph, current_track : nx.nodes, walk_length : int = 10, teleport : float = 0.1, context = False, attributes : list = ['popularity'], audio_index = None) -> list :
     '''Take a graph and a starting track and return a list of recommendations from starting track
     G : networkX graph -> co-occurence graph
     current_track : networkX node -> starting track
     walk_length : int -> number of recommendations required/ size of graph walk
     teleport : float(0, 1) -> teleportation probability. Probability of abandoning current walk and teleporting to a new node for a new walk.
+    audio_index : audioIndex.AudioIndex -> makes teleports land on sound-alikes of the current track, e.g. audioIndex.get_audio_index(G)
     
     returns : list of recommended track nodes'''
 
@@ -113,7 +112,7 @@ def graphWalk(G : nx.Graph, current_track : nx.nodes, walk_length : int = 10, te
         # print(f"Current Track : {current_track}")
         if(current_track == None) :
             break 
-        next_track = getRecommendation(G, current_track, played_tracks, teleport=teleport, context=context, attributes=attributes)
+        next_track = getRecommendation(G, current_track, played_tracks, teleport=teleport, context=context, attributes=attributes, audio_index=audio_index)
         if(next_track == None) :
             next_track = random.choice(list(G.nodes()))
         
@@ -124,6 +123,7 @@ def graphWalk(G : nx.Graph, current_track : nx.nodes, walk_length : int = 10, te
         recommendations[next_track] = G.nodes[next_track]
         current_track = next_track
     
+    instrumentation.count("walk_steps_total", len(played_tracks), walk="graphWalk")
     return recommendations
 
  
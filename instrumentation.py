@@ -0,0 +1,190 @@
+import bisect
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+'''Stage-level instrumentation shared by the whole pipeline. One process-wide Registry holds counters and
+histograms keyed by metric name and labels: NetworkAnalysis methods record their duration under
+stage_duration_seconds{stage=...}, the Spotify clients record every request (latency, bytes, status, 429s),
+enrich records cache hits and fetch/join times and the walks record durations and steps. Recording is a dict
+update under a lock, so it stays on in the hot paths, and nothing is printed: read the results with
+metrics.snapshot(), metrics.to_prometheus() or metrics.log_summary(). Set metrics.enabled = False to turn
+recording off entirely.'''
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from single graph-walk steps up to whole-graph metrics on the big dataset
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+
+class Histogram :
+    '''Cumulative-bucket histogram with sum, count, min and max'''
+
+    def __init__(self, buckets : tuple = DEFAULT_BUCKETS) -> None :
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value : float) -> None :
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self) -> dict :
+        return {"count" : self.count, "sum" : self.sum, "min" : self.min, "max" : self.max,
+                "mean" : self.sum / self.count if self.count else None,
+                "buckets" : dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))}
+
+
+def _key(labels : dict) -> tuple :
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _label_text(key : tuple, extra : tuple = ()) -> str :
+    pairs = key + extra
+    if(not pairs) :
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Registry :
+    '''Thread-safe store of counters and histograms'''
+
+    def __init__(self) -> None :
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name : str, text : str) -> None :
+        '''Help text shown in the Prometheus export'''
+        self._help[name] = text
+
+    def count(self, name : str, value : float = 1, **labels) -> None :
+        if(not self.enabled) :
+            return
+        key = _key(labels)
+        with self._lock :
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name : str, value : float, buckets : tuple = DEFAULT_BUCKETS, **labels) -> None :
+        if(not self.enabled) :
+            return
+        key = _key(labels)
+        with self._lock :
+            series = self._histograms.setdefault(name, {})
+            if(key not in series) :
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name : str, **labels) :
+        '''Observe the duration of the with-block in seconds, also when it raises'''
+        start = time.perf_counter()
+        try :
+            yield
+        finally :
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name : str, **labels) :
+        '''Decorator timing every call, labelled stage=<qualified function name> unless a stage is given'''
+        def decorator(fn) :
+            stage = labels.get("stage", fn.__qualname__)
+            extra = {key : value for key, value in labels.items() if key != "stage"}
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs) :
+                if(not self.enabled) :
+                    return fn(*args, **kwargs)
+                with self.timer(name, stage=stage, **extra) :
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self) -> None :
+        with self._lock :
+            self._counters = {}
+            self._histograms = {}
+
+    def snapshot(self) -> dict :
+        '''{"counters" : {name : [{"labels", "value"}]}, "histograms" : {name : [{"labels", count, sum, ...}]}}'''
+        with self._lock :
+            return {
+                "counters" : {name : [{"labels" : dict(key), "value" : value} for key, value in series.items()]
+                              for name, series in self._counters.items()},
+                "histograms" : {name : [{"labels" : dict(key), **histogram.to_dict()} for key, histogram in series.items()]
+                                for name, series in self._histograms.items()},
+            }
+
+    def to_json(self, **kwargs) -> str :
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self) -> str :
+        '''Prometheus text exposition format'''
+        lines = []
+        with self._lock :
+            for name, series in self._counters.items() :
+                if(name in self._help) :
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items() :
+                    lines.append(f"{name}{_label_text(key)} {value}")
+            for name, series in self._histograms.items() :
+                if(name in self._help) :
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items() :
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts) :
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_label_text(key, (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_label_text(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_label_text(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self, log : logging.Logger = None, level : int = logging.INFO) -> None :
+        '''One structured (JSON) log record per series'''
+        log = log or logger
+        snapshot = self.snapshot()
+        for name, series in snapshot["counters"].items() :
+            for entry in series :
+                log.log(level, json.dumps({"metric" : name, "type" : "counter", **entry}))
+        for name, series in snapshot["histograms"].items() :
+            for entry in series :
+                entry = {key : value for key, value in entry.items() if key != "buckets"}
+                log.log(level, json.dumps({"metric" : name, "type" : "histogram", **entry}))
+
+
+metrics = Registry()
+metrics.describe("stage_duration_seconds", "Duration of NetworkAnalysis and enrichment stages")
+metrics.describe("spotify_requests_total", "Spotify API requests by endpoint and HTTP status")
+metrics.describe("spotify_request_duration_seconds", "Spotify API request latency")
+metrics.describe("spotify_response_bytes_total", "Bytes received from the Spotify API")
+metrics.describe("spotify_rate_limited_total", "429 responses from the Spotify API")
+metrics.describe("enrich_cache_hits_total", "Object IDs served from the response cache")
+metrics.describe("enrich_cache_misses_total", "Object IDs requested from the API")
+metrics.describe("walk_duration_seconds", "Duration of graph walks")
+metrics.describe("walk_steps_total", "Steps taken by graph walks")
+metrics.describe("walk_teleports_total", "Teleports taken by graph walks")
+metrics.describe("server_request_duration_seconds", "Recommendation server request latency")
+metrics.describe("server_requests_total", "Recommendation server requests by endpoint and HTTP status")
+metrics.describe("server_cache_hits_total", "Recommendations answered from the result cache")
+metrics.describe("server_cache_misses_total", "Recommendations computed")
+metrics.describe("server_coalesced_total", "Requests that waited for an identical request in flight")
+metrics.describe("server_reloads_total", "Graphs hot-reloaded after being published")
+
+timer = metrics.timer
+timed = metrics.timed
+count = metrics.count
+observe = metrics.observe
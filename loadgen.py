@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import aiohttp
+
+'''Load generator for server.py. A fixed number of concurrent clients send requests back to back for a number
+of requests or seconds, and latency percentiles (of 200 responses), throughput, 404s and errors are reported
+per endpoint and overall.
+Seed tracks are drawn from the served catalogue (GET /tracks) with Zipf-distributed popularity, so a realistic
+share of requests repeats and hits the result cache; --zipf 0 draws uniformly.
+
+    python loadgen.py --url http://127.0.0.1:8080 --concurrency 32 --duration 30
+    python loadgen.py --serve ./graph_store --mix walk=1,continue=1 --requests 5000 --out load.json'''
+
+ENDPOINTS = ("walk", "continue", "similar", "sound_alike")
+
+
+def parse_mix(text : str) -> dict :
+    '''"walk=2,continue=1" -> {"walk" : 2/3, "continue" : 1/3}'''
+    mix = {}
+    for part in text.split(",") :
+        name, _, weight = part.partition("=")
+        if(name not in ENDPOINTS) :
+            raise ValueError(f"Unknown endpoint {name}, expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    total = sum(mix.values())
+    return {name : weight / total for name, weight in mix.items()}
+
+
+def summarise(latencies : list, not_found : int, errors : int, elapsed : float) -> dict :
+    '''Counts, throughput and latency percentiles (of the 200 responses) in milliseconds'''
+    ms = np.asarray(latencies) * 1000
+    requests = len(latencies) + not_found + errors
+    summary = {"requests" : requests, "ok" : len(latencies), "not_found" : not_found, "errors" : errors,
+               "not_found_share" : not_found / requests if requests else 0.0,
+               "throughput_rps" : requests / elapsed if elapsed else 0.0}
+    if(len(ms)) :
+        summary.update({"mean_ms" : float(ms.mean()), "p50_ms" : float(np.percentile(ms, 50)), "p90_ms" : float(np.percentile(ms, 90)),
+                        "p99_ms" : float(np.percentile(ms, 99)), "max_ms" : float(ms.max())})
+    return summary
+
+
+class LoadGenerator :
+    '''Concurrent clients against a running server
+    url : str -> base URL of the server
+    mix : dict -> share of requests per endpoint, see parse_mix
+    zipf : float -> popularity exponent of seed tracks, 0 for uniform
+    playlist_size : int -> seed tracks per continuation request'''
+
+    def __init__(self, url : str, mix : dict, zipf : float = 1.1, playlist_size : int = 5, k : int = 10, seed : int = 0) -> None :
+        self.url = url.rstrip("/")
+        self.mix = mix
+        self.zipf = zipf
+        self.playlist_size = playlist_size
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.latencies = {name : [] for name in mix}
+        self.not_found = {name : 0 for name in mix}
+        self.errors = {name : 0 for name in mix}
+        self.statuses = {}
+
+    async def load_tracks(self, session : aiohttp.ClientSession, limit : int) -> None :
+        async with session.get(f"{self.url}/tracks", params={"limit" : limit}) as response :
+            response.raise_for_status()
+            tracks = (await response.json())["tracks"]
+        if(not tracks) :
+            raise ValueError("The server has no tracks")
+        self.tracks = np.asarray(tracks, dtype=object)
+        # Random popularity order, so the popular tracks are not simply the first node IDs
+        self.rng.shuffle(self.tracks)
+        weights = 1 / np.arange(1, len(tracks) + 1) ** self.zipf
+        self.popularity = weights / weights.sum()
+
+    def _tracks(self, size : int) -> list :
+        return self.tracks[self.rng.choice(len(self.tracks), size=size, p=self.popularity)].tolist()
+
+    def request(self) -> tuple :
+        '''(endpoint, path, query parameters) of a random request'''
+        endpoint = self.rng.choice(list(self.mix), p=list(self.mix.values()))
+        if(endpoint == "continue") :
+            return endpoint, "/recommend/continue", {"tracks" : ",".join(self._tracks(self.playlist_size)), "k" : self.k}
+        params = {"track" : self._tracks(1)[0]}
+        if(endpoint != "walk") :
+            params["k"] = self.k
+        return endpoint, f"/recommend/{endpoint}", params
+
+    async def _client(self, session : aiohttp.ClientSession, remaining : list, deadline : float) -> None :
+        while time.monotonic() < deadline :
+            if(remaining[0] is not None) :
+                if(remaining[0] <= 0) :
+                    return
+                remaining[0] -= 1
+            endpoint, path, params = self.request()
+            start = time.perf_counter()
+            try :
+                async with session.get(f"{self.url}{path}", params=params) as response :
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError :
+                status = "connection error"
+            elapsed = time.perf_counter() - start
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            # Only 200s enter the latency percentiles. 404s (unknown track, or one without audio features) are
+            # counted on their own, so a storm of cheap rejections cannot pass for good latency
+            if(status == 200) :
+                self.latencies[endpoint].append(elapsed)
+            elif(status == 404) :
+                self.not_found[endpoint] += 1
+            else :
+                self.errors[endpoint] += 1
+
+    async def run(self, concurrency : int = 16, requests : int = None, duration : float = 10.0, track_limit : int = 100_000) -> dict :
+        '''Run the clients until requests were sent or duration seconds passed, whichever comes first'''
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session :
+            await self.load_tracks(session, track_limit)
+            remaining = [requests]
+            deadline = time.monotonic() + (duration if requests is None or duration else float("inf"))
+            start = time.perf_counter()
+            await asyncio.gather(*(self._client(session, remaining, deadline) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+
+        every = [latency for latencies in self.latencies.values() for latency in latencies]
+        return {"url" : self.url, "concurrency" : concurrency, "elapsed_seconds" : elapsed, "statuses" : self.statuses,
+                "overall" : summarise(every, sum(self.not_found.values()), sum(self.errors.values()), elapsed),
+                "endpoints" : {name : summarise(self.latencies[name], self.not_found[name], self.errors[name], elapsed) for name in self.mix}}
+
+
+async def wait_until_healthy(url : str, timeout : float = 300) -> None :
+    '''Poll GET /health until the server answers, the graph is loaded before the server starts listening'''
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session :
+        while True :
+            try :
+                async with session.get(f"{url}/health") as response :
+                    if(response.status == 200) :
+                        return
+            except aiohttp.ClientError :
+                pass
+            if(time.monotonic() > deadline) :
+                raise TimeoutError(f"{url} did not become healthy within {timeout} seconds")
+            await asyncio.sleep(0.5)
+
+
+def main() -> None :
+    parser = argparse.ArgumentParser(description="Measure recommendation server latency under concurrent load")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--serve", metavar="GRAPH", help="start server.py on this graph first and stop it afterwards")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--requests", type=int, help="total requests, default run for --duration seconds")
+    parser.add_argument("--duration", type=float, help="seconds to run (default 10 unless --requests is given)")
+    parser.add_argument("--mix", default="walk=1,continue=1", help="endpoint weights, e.g. walk=2,continue=1,similar=1,sound_alike=1")
+    parser.add_argument("--zipf", type=float, default=1.1, help="popularity exponent of seed tracks, 0 for uniform")
+    parser.add_argument("--playlist-size", type=int, default=5)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the report to this JSON file")
+    args = parser.parse_args()
+    if(args.requests is None and args.duration is None) :
+        args.duration = 10.0
+
+    server = None
+    if(args.serve) :
+        port = args.url.rstrip("/").rsplit(":", 1)[-1]
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+                                   "--graph", args.serve, "--port", port])
+    try :
+        if(server is not None) :
+            asyncio.run(wait_until_healthy(args.url))
+        generator = LoadGenerator(args.url, parse_mix(args.mix), zipf=args.zipf, playlist_size=args.playlist_size, k=args.k, seed=args.seed)
+        report = asyncio.run(generator.run(concurrency=args.concurrency, requests=args.requests, duration=args.duration))
+    finally :
+        if(server is not None) :
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(report, indent=2))
+    if(args.out) :
+        with open(args.out, "w") as f :
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__" :
+    main()
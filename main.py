@@ -3,12 +3,16 @@ import sys
 sys.dont_write_bytecode = True
 
 import json
+import logging
 import networkx as nx
 import pandas as pd
 from API import SpotifyAPI
 from NetworkAnalysis import NetworkAnalysis
 import enrich
 from graphWalk import graphWalk, jaccard_similarity
+import instrumentation
+
+logging.basicConfig(level=logging.INFO)
 
 
 # %%
@@ -69,4 +73,10 @@ print(f"Jaccard Sim : {jaccard_sim}")
 # for node, attr in recommendations.items() :
 #     print(f"Track : {node}")
 #     print(f"Attrs : {attr}")
-    
\ No newline at end of file
+    
+
+# %%
+# Stage timings, API requests (latency, bytes, 429s), cache hits and walk metrics of this run
+instrumentation.metrics.log_summary()
+with open("metrics.prom", "w") as f :
+    f.write(instrumentation.metrics.to_prometheus())
@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+import zlib
+import numpy as np
+from aiohttp import web
+
+'''Local stand-in for the Spotify Web API, so enrichment and asyncAPI.AsyncSpotifyAPI can run without
+credentials or network. Batch endpoints (tracks, audio-features, artists) answer with generated objects that are
+deterministic per object ID, and the token endpoint hands out short-lived client tokens. Faults can be injected
+in order (429 with a Retry-After value, 401, 5xx, dropped connections and stalls), which exercises the client's
+retry, backoff and token-refresh paths:
+
+    python mockSpotify.py --port 8099 --faults 429,500,reset
+    python mockSpotify.py --check      # run AsyncSpotifyAPI against every fault scenario and report the outcome'''
+
+AUDIO_FEATURES = ["acousticness", "danceability", "duration_ms", "energy", "instrumentalness", "key", "liveness",
+                  "loudness", "mode", "speechiness", "tempo", "time_signature", "valence"]
+GENRES = ["pop", "dance pop", "rock", "classic rock", "hip hop", "rap", "trap", "country", "edm", "electro house",
+          "indie rock", "indie pop", "r&b", "mellow gold", "soft rock", "latin", "k-pop", "metal", "jazz", "folk"]
+# Key holding the list of objects in each endpoint's batch response, as in enrich.RESPONSE_KEYS
+RESPONSE_KEYS = {"tracks" : "tracks", "audio-features" : "audio_features", "artists" : "artists"}
+
+
+def mock_object(search_type : str, object_id : str) -> dict :
+    '''Generated Spotify object of an ID, the same on every call'''
+    rng = np.random.default_rng(zlib.crc32(object_id.encode()))
+    if(search_type == "tracks") :
+        return {"uri" : "spotify:track:" + object_id, "popularity" : int(rng.integers(0, 100)),
+                "duration_ms" : int(rng.integers(90_000, 400_000)),
+                "artists" : [{"uri" : f"spotify:artist:{int(rng.integers(0, 10_000)):022d}"}]}
+    if(search_type == "audio-features") :
+        features = {key : float(rng.random()) for key in AUDIO_FEATURES}
+        features.update({"uri" : "spotify:track:" + object_id, "key" : int(rng.integers(0, 12)), "mode" : int(rng.integers(0, 2)),
+                         "loudness" : float(-60 * rng.random()), "tempo" : float(60 + 140 * rng.random()),
+                         "duration_ms" : int(rng.integers(90_000, 400_000)), "time_signature" : 4})
+        return features
+    return {"uri" : "spotify:artist:" + object_id, "popularity" : int(rng.integers(0, 100)),
+            "genres" : rng.choice(GENRES, size=int(rng.integers(0, 4)), replace=False).tolist()}
+
+
+class MockSpotifyServer :
+    '''aiohttp server with Spotify's token and batch endpoints
+    faults : list -> answers for the next data requests, in order, before normal service resumes. Each is an
+    HTTP status (429 is sent with retry_after, 401 also revokes the current token), "reset" to drop the
+    connection or "stall" to answer only after stall seconds
+    retry_after : str -> Retry-After header of injected 429s, delta-seconds or an HTTP date
+    token_ttl : int -> expires_in of issued tokens
+    latency : float -> seconds every data request takes
+    stall : float -> seconds a "stall" fault holds its request
+    failing : collection of IDs whose batches always get a 500'''
+
+    def __init__(self, faults : list = (), retry_after : str = "0", token_ttl : int = 3600, latency : float = 0.0,
+                 stall : float = 60.0, failing = ()) -> None :
+        self.faults = list(faults)
+        self.failing = set(failing)
+        self.retry_after = retry_after
+        self.token_ttl = token_ttl
+        self.latency = latency
+        self.stall = stall
+        self.requests = 0
+        self.token_requests = 0
+        self._tokens = set()
+        self._runner = None
+        self.url = None
+
+    def app(self) -> web.Application :
+        app = web.Application()
+        app.router.add_post("/api/token", self._token)
+        app.router.add_get("/v1/{search_type}", self._batch)
+        return app
+
+    async def _token(self, request : web.Request) -> web.Response :
+        self.token_requests += 1
+        token = f"mock-token-{self.token_requests}"
+        self._tokens.add(token)
+        return web.json_response({"access_token" : token, "token_type" : "Bearer", "expires_in" : self.token_ttl})
+
+    async def _batch(self, request : web.Request) -> web.StreamResponse :
+        self.requests += 1
+        search_type = request.match_info["search_type"]
+        if(self.faults) :
+            fault = self.faults.pop(0)
+            if(fault == "reset") :
+                request.transport.close()
+                return web.Response()
+            if(fault == "stall") :
+                await asyncio.sleep(self.stall)
+            elif(int(fault) == 429) :
+                return web.json_response({"error" : {"status" : 429}}, status=429, headers={"Retry-After" : self.retry_after})
+            elif(int(fault) == 401) :
+                self._tokens.clear()
+                return web.json_response({"error" : {"status" : 401}}, status=401)
+            else :
+                return web.json_response({"error" : {"status" : int(fault)}}, status=int(fault))
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if(token not in self._tokens) :
+            return web.json_response({"error" : {"status" : 401, "message" : "The access token expired"}}, status=401)
+        if(search_type not in RESPONSE_KEYS) :
+            return web.json_response({"error" : {"status" : 404}}, status=404)
+        if(self.latency) :
+            await asyncio.sleep(self.latency)
+        ids = request.query.get("ids", "").split(",")
+        if(self.failing.intersection(ids)) :
+            return web.json_response({"error" : {"status" : 500}}, status=500)
+        return web.json_response({RESPONSE_KEYS[search_type] : [mock_object(search_type, object_id) for object_id in ids]})
+
+    async def start(self, host : str = "127.0.0.1", port : int = 0) -> str :
+        '''Start listening (port 0 picks a free one), returns the base URL'''
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None :
+        if(self._runner is not None) :
+            await self._runner.cleanup()
+
+    def client(self, **kwargs) :
+        '''AsyncSpotifyAPI pointed at this server'''
+        from asyncAPI import AsyncSpotifyAPI
+        return AsyncSpotifyAPI(base_URL=self.url + "/v1/", token_URL=self.url + "/api/token", **kwargs)
+
+
+# Check -> (faults, IDs whose batches always fail with a 500). Batches without failing IDs must come back
+# complete despite the faults, batches with one must come back as None without costing the others
+CHECKS = {
+    "429" : (["429", "429"], ()),
+    "429 with HTTP-date Retry-After" : (["429"], ()),
+    "401 then refresh" : (["401"], ()),
+    "5xx backoff" : (["500", "503"], ()),
+    "connection reset" : (["reset"], ()),
+    "stall past the timeout" : (["stall"], ()),
+    "one batch failing for good" : ([], ("c",)),
+}
+
+
+async def check_client(batches : list = ("a,b", "c", "d,e,f")) -> dict :
+    '''Run AsyncSpotifyAPI against every CHECKS scenario, returns {check : (passed, seconds)}'''
+    results = {}
+    for name, (faults, failing) in CHECKS.items() :
+        retry_after = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime()) if "HTTP-date" in name else "0"
+        server = MockSpotifyServer(faults=faults, retry_after=retry_after, stall=2.0, failing=failing)
+        await server.start()
+        api = server.client(timeout=0.5, backoff=0.01)
+        start = time.perf_counter()
+        try :
+            responses = await api.fetch_batches_async("tracks", list(batches))
+        finally :
+            await server.stop()
+        passed = True
+        for batch, response in zip(batches, responses) :
+            ids = batch.split(",")
+            if(any(object_id in failing for object_id in ids)) :
+                passed &= response is None
+            else :
+                passed &= response is not None and [track["uri"] for track in response["tracks"]] == ["spotify:track:" + i for i in ids]
+        results[name] = (bool(passed), time.perf_counter() - start)
+    return results
+
+
+def main() -> None :
+    parser = argparse.ArgumentParser(description="Serve a local mock of the Spotify Web API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--faults", default="", help="comma-separated faults for the first data requests, e.g. 429,401,500,reset,stall")
+    parser.add_argument("--retry-after", default="1")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--check", action="store_true", help="run AsyncSpotifyAPI against every fault instead of serving")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR if args.check else logging.INFO)
+    if(args.check) :
+        print(json.dumps({name : {"passed" : ok, "seconds" : round(seconds, 3)} for name, (ok, seconds) in asyncio.run(check_client()).items()}, indent=2))
+        return
+    server = MockSpotifyServer(faults=[fault for fault in args.faults.split(",") if fault], retry_after=args.retry_after, latency=args.latency)
+    web.run_app(server.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,109 @@
+import os
+import numpy as np
+import networkx as nx
+from attributeTable import ColumnarGraph, columnar_graph
+from graphBuilder import PLAYLIST_MEMBERSHIP
+
+'''Typed Parquet export of an enriched graph. A graph is written as a directory with two files:
+nodes.parquet has one row per track and one column per node attribute (genres as a list<string> column, names
+and URIs dictionary-encoded), and edges.parquet has source/target (dictionary-encoded over the track URIs),
+weight and common_playlists as list<int64>. When the graph carries its playlist membership, playlists.parquet
+holds one playlist_id/song_id row per playlist track. The files can be read with pandas/pyarrow directly, and
+read_parquet turns them back into a ColumnarGraph without re-enrichment. pyarrow is only needed here.'''
+
+NODES_FILE = "nodes.parquet"
+EDGES_FILE = "edges.parquet"
+PLAYLISTS_FILE = "playlists.parquet"
+NODE_ID = "Track URI"
+
+
+def write_parquet(G : nx.Graph, path : str, compression : str = "zstd") -> None :
+    '''Write G as nodes.parquet and edges.parquet into directory path'''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    os.makedirs(path, exist_ok=True)
+    G = columnar_graph(G)
+    nodes = G.table.to_arrow(index_name=NODE_ID)
+    pq.write_table(nodes, os.path.join(path, NODES_FILE), compression=compression)
+
+    index = {node : i for i, node in enumerate(G)}
+    dictionary = nodes.column(NODE_ID).combine_chunks()
+    num_edges = G.number_of_edges()
+    source = np.empty(num_edges, dtype=np.int32)
+    target = np.empty(num_edges, dtype=np.int32)
+    columns = {}
+    for i, (u, v, attrs) in enumerate(G.edges(data=True)) :
+        source[i] = index[u]
+        target[i] = index[v]
+        for key, value in attrs.items() :
+            if(key not in columns) :
+                columns[key] = [None] * num_edges
+            columns[key][i] = value
+    arrays = [pa.DictionaryArray.from_arrays(pa.array(source), dictionary),
+              pa.DictionaryArray.from_arrays(pa.array(target), dictionary)]
+    names = ["source", "target"]
+    for key, values in columns.items() :
+        arrays.append(pa.array(values, type=pa.list_(pa.int64()) if key == "common_playlists" else None))
+        names.append(key)
+    pq.write_table(pa.Table.from_arrays(arrays, names=names), os.path.join(path, EDGES_FILE), compression=compression)
+
+    membership = G.graph.get(PLAYLIST_MEMBERSHIP)
+    if(membership is not None) :
+        playlists, songs = membership
+        songs = pa.array(np.asarray(songs, dtype=object).tolist()).dictionary_encode()
+        table = pa.Table.from_arrays([pa.array(np.asarray(playlists, dtype=np.int64)), songs], names=["playlist_id", "song_id"])
+        pq.write_table(table, os.path.join(path, PLAYLISTS_FILE), compression=compression)
+    elif(os.path.exists(os.path.join(path, PLAYLISTS_FILE))) :
+        os.remove(os.path.join(path, PLAYLISTS_FILE))
+
+
+def _column_values(column) :
+    # Python/NumPy values of a (null-free) Arrow column in the form AttributeTable.set_column expects
+    import pyarrow as pa
+    column = column.combine_chunks() if hasattr(column, "combine_chunks") else column
+    if(pa.types.is_dictionary(column.type)) :
+        return np.asarray(column.dictionary.to_pylist(), dtype=object)[column.indices.to_numpy()].tolist()
+    if(pa.types.is_integer(column.type) or pa.types.is_floating(column.type) or pa.types.is_boolean(column.type)) :
+        return column.to_numpy(zero_copy_only=False)
+    return column.to_pylist()
+
+
+def read_parquet(path : str) -> ColumnarGraph :
+    '''Load a directory written by write_parquet as a ColumnarGraph with all node and edge attributes'''
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    nodes = pq.read_table(os.path.join(path, NODES_FILE))
+    edges = pq.read_table(os.path.join(path, EDGES_FILE))
+
+    G = ColumnarGraph()
+    node_ids = nodes.column(NODE_ID).to_pylist()
+    G.add_nodes_from(node_ids)
+    node_array = np.asarray(node_ids, dtype=object)
+    for name in nodes.column_names :
+        if(name == NODE_ID) :
+            continue
+        column = nodes.column(name)
+        if(column.null_count) :
+            # Only nodes that had the attribute get it back
+            valid = column.is_valid()
+            present = valid.to_numpy(zero_copy_only=False)
+            G.table.set_column(name, node_array[present].tolist(), _column_values(pc.filter(column, valid)))
+        else :
+            G.table.set_column(name, node_ids, _column_values(column))
+
+    endpoints = [_column_values(edges.column(name)) for name in ("source", "target")]
+    attributes = [name for name in edges.column_names if name not in ("source", "target")]
+    columns = [edges.column(name).to_pylist() for name in attributes]
+    G.add_edges_from(
+        (u, v, {key : value for key, value in zip(attributes, values) if value is not None})
+        for u, v, *values in zip(*endpoints, *columns)
+    )
+    if(os.path.exists(os.path.join(path, PLAYLISTS_FILE))) :
+        playlists = pq.read_table(os.path.join(path, PLAYLISTS_FILE))
+        G.graph[PLAYLIST_MEMBERSHIP] = (playlists.column("playlist_id").to_numpy(),
+                                        np.asarray(_column_values(playlists.column("song_id")), dtype=object))
+    return G
+
+
+def is_parquet_graph(path : str) -> bool :
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, NODES_FILE)) and os.path.exists(os.path.join(path, EDGES_FILE))
@@ -0,0 +1,104 @@
+import numpy as np
+import networkx as nx
+from graphStore import CSRGraph
+from featureStore import FeatureStore
+import instrumentation
+
+'''Playlist continuation over the co-occurrence graph. The score of a candidate track is the sum of its
+co-occurrence weights with every track already in the playlist, i.e. the seed rows of the weight matrix summed
+as one sparse vector-matrix product. Only the CSR slices of the seeds are read, so the cost depends on the
+seeds' degrees and not on the size of the graph. Audio-feature similarity to the playlist can be blended in,
+and the best candidates are picked with a partial sort (argpartition).'''
+
+
+class PlaylistScorer :
+    '''Continuation scorer over a CSRGraph
+    csr : CSRGraph -> graph arrays, e.g. NetworkAnalysis.csr or CSRGraph.load(store)
+    G : nx.Graph -> graph holding the node attributes used for the feature blend, not needed otherwise'''
+
+    def __init__(self, csr : CSRGraph, G : nx.Graph = None) -> None :
+        self.csr = csr
+        self.G = G
+        self.num_nodes = csr.num_nodes
+        self.indptr = np.asarray(csr.indptr)
+        self.indices = np.asarray(csr.indices)
+        self.weights = np.asarray(csr.weights, dtype=np.float64)
+        self._features = {}
+
+    def _feature_matrix(self, attributes : list) -> np.ndarray :
+        '''Row-normalised attribute matrix in CSR row order, rebuilt when the graph's features are invalidated'''
+        key = tuple(attributes)
+        if(key not in self._features) :
+            self._features[key] = FeatureStore(self.G, attributes, nodes=self.csr.nodes.tolist())
+        return self._features[key].matrix
+
+    def cooccurrence(self, seeds : np.ndarray, seed_weights : np.ndarray = None) -> tuple :
+        '''Summed weight rows of the seed rows
+        seed_weights : np.ndarray -> multiplier of every seed row, e.g. to favour recently added tracks
+
+        returns : (candidate rows, scores), candidates are the rows co-occurring with at least one seed'''
+        starts = self.indptr[seeds]
+        ends = self.indptr[seeds + 1]
+        if(int((ends - starts).sum()) == 0) :
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        # Contiguous slice copies, much faster than a fancy-index gather over hub rows
+        columns = np.concatenate([self.indices[start : end] for start, end in zip(starts, ends)])
+        values = np.concatenate([self.weights[start : end] for start, end in zip(starts, ends)])
+        if(seed_weights is not None) :
+            values = values * np.repeat(np.asarray(seed_weights, dtype=np.float64), ends - starts)
+        total = len(columns)
+        if(total * 8 < self.num_nodes) :
+            # Few entries: aggregate over the distinct columns only
+            candidates, inverse = np.unique(columns, return_inverse=True)
+            return candidates, np.bincount(inverse, weights=values, minlength=len(candidates))
+        scores = np.bincount(columns, weights=values, minlength=self.num_nodes)
+        candidates = np.flatnonzero(scores)
+        return candidates, scores[candidates]
+
+    def score(self, seeds : np.ndarray, k : int = 10, feature_weight : float = 0.0, attributes : list = ['popularity'],
+              seed_weights : np.ndarray = None) -> tuple :
+        '''Top-k continuation rows of a playlist given as CSR rows
+        feature_weight : float -> share of cosine similarity to the playlist's mean feature vector in the score,
+        the co-occurrence share (1 - feature_weight) is scaled to [0, 1] by the best candidate first
+
+        returns : (rows, scores), best first, seeds excluded'''
+        seeds = np.asarray(seeds, dtype=np.int64)
+        if(seed_weights is None) :
+            seeds = np.unique(seeds)
+        else :
+            # A track listed twice counts with the sum of its weights
+            seeds, inverse = np.unique(seeds, return_inverse=True)
+            seed_weights = np.bincount(inverse, weights=np.asarray(seed_weights, dtype=np.float64), minlength=len(seeds))
+        candidates, scores = self.cooccurrence(seeds, seed_weights)
+        keep = ~np.isin(candidates, seeds, assume_unique=True)
+        candidates, scores = candidates[keep], scores[keep]
+        if(len(candidates) == 0) :
+            return candidates, scores
+        if(feature_weight) :
+            F = self._feature_matrix(attributes)
+            profile = F[seeds].mean(axis=0)
+            norm = np.linalg.norm(profile)
+            similarity = F[candidates] @ (profile / norm) if norm > 0 else np.zeros(len(candidates))
+            scores = (1 - feature_weight) * scores / scores.max() + feature_weight * similarity
+        if(k < len(candidates)) :
+            top = np.argpartition(-scores, k - 1)[:k]
+        else :
+            top = np.arange(len(candidates))
+        # Best first, equal scores in row order
+        top = top[np.lexsort((candidates[top], -scores[top]))]
+        return candidates[top], scores[top]
+
+    @instrumentation.timed("stage_duration_seconds")
+    def continue_playlist(self, seed_tracks : list, k : int = 10, feature_weight : float = 0.0, attributes : list = ['popularity'],
+                          seed_weights : list = None) -> list :
+        '''Tracks to continue a playlist with
+        seed_tracks : list -> track IDs already in the playlist
+        k : int -> number of recommendations
+        feature_weight : float -> 0 for co-occurrence only, 1 for audio-feature similarity only (among co-occurring tracks)
+        attributes : list -> node attributes compared by the feature blend
+        seed_weights : list -> optional weight of every seed track
+
+        returns : list of (track ID, score), best first'''
+        rows, scores = self.score(self.csr.indices_of(seed_tracks), k=k, feature_weight=feature_weight,
+                                  attributes=attributes, seed_weights=seed_weights)
+        return list(zip(self.csr.nodes[rows].tolist(), scores.tolist()))
@@ -0,0 +1,123 @@
+import json
+import sqlite3
+import time
+
+'''Persistent cache of Spotify API objects. Responses are stored per endpoint and object ID in a SQLite file,
+so re-enriching a graph only requests the IDs that are missing or older than their endpoint's TTL. The
+cache is bounded to `max_entries` rows, the least recently read entries are evicted first.'''
+
+DAY = 24 * 60 * 60
+
+# Track and artist metadata (popularity, genres) drifts slowly, audio features never change
+DEFAULT_TTLS = {
+    "tracks" : 7 * DAY,
+    "audio-features" : 365 * DAY,
+    "artists" : 7 * DAY,
+}
+
+
+class ResponseCache :
+    '''SQLite backed cache of API objects keyed by (endpoint, object ID)
+    path : str -> SQLite file, ":memory:" for a throwaway cache
+    ttls : dict -> endpoint -> time to live in seconds, endpoints not listed use default_ttl
+    max_entries : int -> maximum number of cached objects'''
+
+    def __init__(self, path : str = "spotify_cache.sqlite", ttls : dict = None, default_ttl : float = 7 * DAY, max_entries : int = 5_000_000) -> None :
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "endpoint TEXT NOT NULL, id TEXT NOT NULL, body TEXT, fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+            "PRIMARY KEY (endpoint, id)) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self.conn.commit()
+        # Running row count, so puts do not scan the table. Rows written by other connections are only seen
+        # when it is recounted, i.e. on open, clear and eviction
+        self._count()
+
+    def ttl(self, endpoint : str) -> float :
+        return self.ttls.get(endpoint, self.default_ttl)
+
+    def get_many(self, endpoint : str, ids : list) -> dict :
+        '''Fresh cached objects for ids, as id -> object. Missing or expired IDs are left out'''
+        now = time.time()
+        oldest = now - self.ttl(endpoint)
+        found = {}
+        ids = list(ids)
+        # Stay below SQLite's bound-parameter limit
+        for i in range(0, len(ids), 500) :
+            chunk = ids[i : i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT id, body FROM responses WHERE endpoint = ? AND fetched_at >= ? AND id IN ({placeholders})",
+                [endpoint, oldest, *chunk],
+            ).fetchall()
+            found.update((object_id, json.loads(body)) for object_id, body in rows)
+        if(found) :
+            self.conn.executemany("UPDATE responses SET accessed_at = ? WHERE endpoint = ? AND id = ?",
+                                  [(now, endpoint, object_id) for object_id in found])
+            self.conn.commit()
+        return found
+
+    def put_many(self, endpoint : str, objects : dict) -> None :
+        '''Store id -> object pairs, objects may be None for IDs Spotify does not know'''
+        now = time.time()
+        ids = list(objects)
+        existing = 0
+        for i in range(0, len(ids), 500) :
+            chunk = ids[i : i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            existing += self.conn.execute(
+                f"SELECT COUNT(*) FROM responses WHERE endpoint = ? AND id IN ({placeholders})", [endpoint, *chunk]
+            ).fetchone()[0]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO responses (endpoint, id, body, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            [(endpoint, object_id, json.dumps(obj), now, now) for object_id, obj in objects.items()],
+        )
+        self.size += len(ids) - existing
+        if(self.size > self.max_entries) :
+            self._evict()
+        self.conn.commit()
+
+    def missing(self, endpoint : str, ids : list) -> list :
+        '''IDs with no fresh cached object, in input order'''
+        ids = list(ids)
+        oldest = time.time() - self.ttl(endpoint)
+        found = set()
+        for i in range(0, len(ids), 500) :
+            chunk = ids[i : i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(row[0] for row in self.conn.execute(
+                f"SELECT id FROM responses WHERE endpoint = ? AND fetched_at >= ? AND id IN ({placeholders})",
+                [endpoint, oldest, *chunk],
+            ))
+        return [object_id for object_id in ids if object_id not in found]
+
+    def _count(self) -> None :
+        self.size = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def _evict(self) -> None :
+        # Only reached when the running count is over the bound, recount once so other writers are included
+        self._count()
+        excess = self.size - self.max_entries
+        if(excess > 0) :
+            self.conn.execute(
+                "DELETE FROM responses WHERE (endpoint, id) IN (SELECT endpoint, id FROM responses ORDER BY accessed_at LIMIT ?)", (excess,)
+            )
+            self.size -= excess
+
+    def clear(self, endpoint : str = None) -> None :
+        if(endpoint is None) :
+            self.conn.execute("DELETE FROM responses")
+        else :
+            self.conn.execute("DELETE FROM responses WHERE endpoint = ?", (endpoint,))
+        self.conn.commit()
+        self._count()
+
+    def close(self) -> None :
+        self.conn.close()
@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from NetworkAnalysis import NetworkAnalysis
+from walkEngine import CSRWalker
+from audioIndex import AUDIO_FEATURES
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+'''Long-running recommendation service. The analysed graph (a graph store, Parquet directory, pickle or
+interactions CSV, see NetworkAnalysis) is loaded once and served over HTTP:
+
+    GET /recommend/walk?track=...&length=10&teleport=0.1&context=false&attributes=energy,valence
+    GET /recommend/continue?tracks=a,b,c&k=10&feature_weight=0       (or POST {"tracks" : [...], ...})
+    GET /recommend/similar?track=...&k=10                            (track embeddings, see embeddings)
+    GET /recommend/sound_alike?track=...&k=10&attributes=...         (audio features, see audioIndex)
+    GET /tracks?limit=1000, /health, /metrics
+
+Results are kept in an LRU cache with a TTL, keyed by endpoint, parameters and graph version, and identical
+requests that arrive while one is being computed wait for that computation instead of starting their own.
+Recommendations run on one compute thread, so the event loop only parses requests, answers cache hits and
+writes responses. The graph path is polled and a newly published graph is loaded in the background and swapped
+in atomically; requests already running finish on the graph they started on.
+
+    python server.py --graph ./graph_store --port 8080'''
+
+
+class ResultCache :
+    '''LRU cache whose entries also expire ttl seconds after they were stored
+    max_entries : int -> least recently used entries are evicted beyond this size
+    ttl : float -> seconds an entry stays valid'''
+
+    def __init__(self, max_entries : int = 10_000, ttl : float = 300) -> None :
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key) :
+        '''Cached value, None when missing or expired'''
+        entry = self._entries.get(key)
+        if(entry is None) :
+            return None
+        value, expires = entry
+        if(time.monotonic() >= expires) :
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value) -> None :
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries :
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None :
+        self._entries.clear()
+
+    def __len__(self) -> int :
+        return len(self._entries)
+
+
+def graph_signature(path : str) -> tuple :
+    '''Changes whenever a graph is published at path: the path's own inode/mtime, plus the newest file
+    mtime inside it for a store or Parquet directory'''
+    stat = os.stat(path)
+    signature = (stat.st_ino, stat.st_mtime_ns)
+    if(os.path.isdir(path)) :
+        with os.scandir(path) as entries :
+            signature += (max((entry.stat().st_mtime_ns for entry in entries if entry.is_file()), default=0),)
+    return signature
+
+
+# Attributes compared by context walks when the request names none
+DEFAULT_CONTEXT_ATTRIBUTES = ["popularity"]
+
+
+class GraphState :
+    '''One loaded graph and the engines built over it, replaced as a whole on reload'''
+
+    def __init__(self, path : str, version : int) -> None :
+        self.path = path
+        self.version = version
+        self.signature = graph_signature(path)
+        self.network = NetworkAnalysis(path)
+        # Build every lazily created structure now, on the loading thread and before the state is swapped in,
+        # so the first requests after a (re)load do not pay for them: the networkX graph behind context walks and
+        # feature blends, the default feature matrices, the embeddings and the sound-alike index
+        G = self.network.G
+        self.walker = CSRWalker(self.network.csr, G)
+        self.walker._feature_matrix(DEFAULT_CONTEXT_ATTRIBUTES)
+        scorer = self.network.playlist_scorer
+        scorer.G = G
+        scorer._feature_matrix(AUDIO_FEATURES)
+        self.network.embeddings
+        len(self.network.audio_index(AUDIO_FEATURES))
+        self.num_nodes = self.network.csr.num_nodes
+
+    def check_tracks(self, tracks) -> None :
+        '''Raise UnknownTrack unless every track is in this graph. Requests are checked before anything is computed
+        or cached, so only real lookup misses become 404s'''
+        try :
+            self.network.csr.indices_of(list(tracks))
+        except KeyError as error :
+            raise UnknownTrack(f"unknown track {error.args[0]}") from None
+
+
+class BadRequest(Exception) :
+    '''Invalid or missing request parameter'''
+
+
+class UnknownTrack(Exception) :
+    '''A requested track is not in the served graph, or lacks the data the endpoint needs'''
+
+
+class RecommendationService :
+    '''Serves recommendations from the graph at path
+    cache_size / cache_ttl : LRU size and time to live (seconds) of the result cache
+    reload_interval : float -> seconds between checks for a newly published graph, 0 to disable'''
+
+    def __init__(self, path : str, cache_size : int = 10_000, cache_ttl : float = 300, reload_interval : float = 5.0) -> None :
+        self.path = path
+        self.cache = ResultCache(cache_size, cache_ttl)
+        self.reload_interval = reload_interval
+        self.state = None
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recommend")
+        self._reload_task = None
+
+    async def start(self, app : web.Application = None) -> None :
+        loop = asyncio.get_running_loop()
+        self.state = await loop.run_in_executor(self._executor, GraphState, self.path, 1)
+        logger.info("Serving %s (%d tracks)", self.path, self.state.num_nodes)
+        if(self.reload_interval) :
+            self._reload_task = asyncio.create_task(self._watch())
+
+    async def stop(self, app : web.Application = None) -> None :
+        if(self._reload_task is not None) :
+            self._reload_task.cancel()
+        self._executor.shutdown(wait=False)
+
+    async def _watch(self) -> None :
+        while True :
+            await asyncio.sleep(self.reload_interval)
+            try :
+                await self.reload()
+            except Exception :
+                # A half-written or broken graph keeps the current one in service
+                logger.exception("Reloading %s failed", self.path)
+
+    async def reload(self, force : bool = False) -> bool :
+        '''Load the graph again if it changed on disk (or force), returns whether it was swapped'''
+        if(not force and graph_signature(self.path) == self.state.signature) :
+            return False
+        loop = asyncio.get_running_loop()
+        # Loaded on a separate thread so requests keep being answered from the current graph meanwhile
+        state = await loop.run_in_executor(None, GraphState, self.path, self.state.version + 1)
+        self.state = state
+        self.cache.clear()
+        instrumentation.count("server_reloads_total")
+        logger.info("Reloaded %s as version %d (%d tracks)", self.path, state.version, state.num_nodes)
+        return True
+
+    async def recommend(self, endpoint : str, params : tuple, compute) :
+        '''Cached / coalesced result of compute(state) for an endpoint and hashable parameters'''
+        state = self.state
+        key = (state.version, endpoint, params)
+        result = self.cache.get(key)
+        if(result is not None) :
+            instrumentation.count("server_cache_hits_total", endpoint=endpoint)
+            return result
+        future = self._inflight.get(key)
+        if(future is not None) :
+            instrumentation.count("server_coalesced_total", endpoint=endpoint)
+            return await asyncio.shield(future)
+
+        instrumentation.count("server_cache_misses_total", endpoint=endpoint)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, compute, state)
+        self._inflight[key] = future
+        try :
+            result = await asyncio.shield(future)
+        finally :
+            self._inflight.pop(key, None)
+        self.cache.put(key, result)
+        return result
+
+
+# The parameter helpers read from request.query (strings) or from a JSON body (typed values) alike
+
+def _int(params, name : str, default : int, low : int = 1, high : int = 1000) -> int :
+    value = params.get(name, default)
+    if(isinstance(value, bool) or isinstance(value, float) and not value.is_integer()) :
+        raise BadRequest(f"{name} must be an integer")
+    try :
+        value = int(value)
+    except (TypeError, ValueError) :
+        raise BadRequest(f"{name} must be an integer")
+    if(not low <= value <= high) :
+        raise BadRequest(f"{name} must be between {low} and {high}")
+    return value
+
+
+def _float(params, name : str, default : float, low : float = 0.0, high : float = 1.0) -> float :
+    value = params.get(name, default)
+    if(isinstance(value, bool)) :
+        raise BadRequest(f"{name} must be a number")
+    try :
+        value = float(value)
+    except (TypeError, ValueError) :
+        raise BadRequest(f"{name} must be a number")
+    if(not low <= value <= high) :
+        raise BadRequest(f"{name} must be between {low} and {high}")
+    return value
+
+
+def _track(params) -> str :
+    track = params.get("track")
+    if(not track or not isinstance(track, str)) :
+        raise BadRequest("track is required")
+    return track
+
+
+def _names(params, name : str, default : list = None) -> tuple :
+    '''Comma-separated query value or JSON list of strings'''
+    value = params.get(name)
+    if(value is None or value == "") :
+        return tuple(default or ())
+    if(isinstance(value, str)) :
+        return tuple(part for part in value.split(",") if part)
+    if(not isinstance(value, list) or not all(isinstance(part, str) for part in value)) :
+        raise BadRequest(f"{name} must be a list of strings")
+    return tuple(value)
+
+
+def _pairs(results : list) -> list :
+    return [{"track" : track, "score" : score} for track, score in results]
+
+
+@web.middleware
+async def _errors(request : web.Request, handler) :
+    resource = request.match_info.route.resource
+    endpoint = resource.canonical if resource is not None else "unmatched"
+    with instrumentation.timer("server_request_duration_seconds", endpoint=endpoint) :
+        try :
+            response = await handler(request)
+        except web.HTTPException as error :
+            response = error
+        except UnknownTrack as error :
+            response = web.json_response({"error" : str(error)}, status=404)
+        except (BadRequest, ValueError) as error :
+            # ValueError: malformed JSON body, or an engine the graph does not have (e.g. no embeddings)
+            response = web.json_response({"error" : str(error)}, status=400)
+        except Exception :
+            # Anything else, KeyErrors included, is a bug and not a missing track
+            logger.exception("%s %s failed", request.method, request.path)
+            response = web.json_response({"error" : "internal server error"}, status=500)
+    instrumentation.count("server_requests_total", endpoint=endpoint, status=response.status)
+    return response
+
+
+def create_app(service : RecommendationService) -> web.Application :
+    '''aiohttp application serving service, the graph is loaded on startup'''
+    routes = web.RouteTableDef()
+
+    @routes.get("/health")
+    async def health(request : web.Request) :
+        state = service.state
+        return web.json_response({"status" : "ok", "graph" : state.path, "version" : state.version,
+                                  "tracks" : state.num_nodes, "cached_results" : len(service.cache)})
+
+    @routes.get("/metrics")
+    async def metrics(request : web.Request) :
+        return web.Response(text=instrumentation.metrics.to_prometheus(), content_type="text/plain")
+
+    @routes.get("/tracks")
+    async def tracks(request : web.Request) :
+        limit = _int(request.query, "limit", 1000, high=1_000_000)
+        return web.json_response({"tracks" : service.state.network.csr.nodes[:limit].tolist()})
+
+    @routes.get("/recommend/walk")
+    async def walk(request : web.Request) :
+        track = _track(request.query)
+        length = _int(request.query, "length", 10, high=200)
+        teleport = _float(request.query, "teleport", 0.1)
+        context = request.query.get("context", "false").lower() in ("1", "true", "yes")
+        attributes = _names(request.query, "attributes", DEFAULT_CONTEXT_ATTRIBUTES)
+        service.state.check_tracks([track])
+
+        def compute(state : GraphState) :
+            return state.walker.graph_walk(track, walk_length=length, teleport=teleport, context=context, attributes=list(attributes))
+        result = await service.recommend("walk", (track, length, teleport, context, attributes), compute)
+        return web.json_response({"track" : track, "recommendations" : result})
+
+    @routes.route("*", "/recommend/continue")
+    async def continue_playlist(request : web.Request) :
+        if(request.method == "POST") :
+            params = await request.json()
+            if(not isinstance(params, dict)) :
+                raise BadRequest("body must be a JSON object")
+        else :
+            params = request.query
+        seeds = _names(params, "tracks")
+        k = _int(params, "k", 10)
+        feature_weight = _float(params, "feature_weight", 0.0)
+        attributes = _names(params, "attributes", AUDIO_FEATURES)
+        if(not seeds) :
+            raise BadRequest("tracks is required")
+        service.state.check_tracks(seeds)
+
+        def compute(state : GraphState) :
+            return _pairs(state.network.continue_playlist(list(seeds), k=k, feature_weight=feature_weight, attributes=list(attributes)))
+        # Order does not change the score, so permutations of a playlist share a cache entry
+        result = await service.recommend("continue", (tuple(sorted(set(seeds))), k, feature_weight, attributes), compute)
+        return web.json_response({"tracks" : list(seeds), "recommendations" : result})
+
+    @routes.get("/recommend/similar")
+    async def similar(request : web.Request) :
+        track = _track(request.query)
+        k = _int(request.query, "k", 10)
+        service.state.check_tracks([track])
+
+        def compute(state : GraphState) :
+            return _pairs(state.network.similar_tracks([track], k=k)[0])
+        result = await service.recommend("similar", (track, k), compute)
+        return web.json_response({"track" : track, "recommendations" : result})
+
+    @routes.get("/recommend/sound_alike")
+    async def sound_alike(request : web.Request) :
+        track = _track(request.query)
+        k = _int(request.query, "k", 10)
+        attributes = _names(request.query, "attributes", AUDIO_FEATURES)
+        service.state.check_tracks([track])
+
+        def compute(state : GraphState) :
+            if(track not in state.network.audio_index(list(attributes))) :
+                raise UnknownTrack(f"track {track} has no audio features")
+            return _pairs(state.network.sound_alikes(track, k=k, attributes=list(attributes)))
+        result = await service.recommend("sound_alike", (track, k, attributes), compute)
+        return web.json_response({"track" : track, "recommendations" : result})
+
+    app = web.Application(middlewares=[_errors])
+    app.add_routes(routes)
+    app.on_startup.append(service.start)
+    app.on_cleanup.append(service.stop)
+    return app
+
+
+def main() -> None :
+    parser = argparse.ArgumentParser(description="Serve graph-walk and content-based recommendations over HTTP")
+    parser.add_argument("--graph", required=True, help="graph store / Parquet directory, pickle or interactions CSV")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cache-size", type=int, default=10_000, help="maximum number of cached results")
+    parser.add_argument("--cache-ttl", type=float, default=300, help="seconds a cached result stays valid")
+    parser.add_argument("--reload-interval", type=float, default=5.0, help="seconds between checks for a new graph, 0 to disable")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    service = RecommendationService(args.graph, cache_size=args.cache_size, cache_ttl=args.cache_ttl, reload_interval=args.reload_interval)
+    web.run_app(create_app(service), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__" :
+    main()
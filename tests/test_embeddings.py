@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from embeddings import EmbeddingIndex
+
+
+@pytest.fixture
+def index() -> EmbeddingIndex :
+    nodes = np.array(["spotify:track:a", "spotify:track:b", "spotify:track:c"])
+    vectors = np.array([[1, 0], [0.9, 0.1], [0, 1]], dtype=np.float32)
+    return EmbeddingIndex(nodes, vectors)
+
+
+def test_similar_excludes_the_track_itself(index) :
+    [neighbours] = index.similar(["spotify:track:a"], k=1)
+    assert neighbours[0][0] == "spotify:track:b"
+
+
+def test_overlong_unknown_track_has_no_embedding(index) :
+    with pytest.raises(KeyError) :
+        index.similar(["spotify:track:a-not-a-track"])
+    with pytest.raises(KeyError) :
+        index.rows(["spotify:track:b", "spotify:track:cXYZ"])
+
+
+def test_single_track_id_is_rejected(index) :
+    with pytest.raises(TypeError) :
+        index.rows("spotify:track:a")
@@ -0,0 +1,28 @@
+import pytest
+
+from enrich import GenreMatcher, clean_genres
+
+TOP_GENRES = ["Hip Hop", "Pop", "Rock", "Indie", "indie pop", "Electro", "Electro House", "R&B", "hop"]
+
+
+@pytest.mark.parametrize("track_genres", [
+    ["k-pop"],
+    ["indie pop"],
+    ["electro house", "classic rock"],
+    ["hip hop"],
+    ["r&b", "jazz"],
+    ["popop"],
+    [],
+])
+def test_matches_the_substring_rule(track_genres) :
+    matcher = GenreMatcher(TOP_GENRES)
+    assert set(matcher.match(track_genres)) == clean_genres(track_genres, TOP_GENRES)
+
+
+def test_overlapping_genres_at_one_position_are_all_found() :
+    assert GenreMatcher(TOP_GENRES).match(["Indie Pop"]) == ["Pop", "Indie", "indie pop"]
+
+
+def test_keeps_the_top_genre_order_and_handles_no_genres() :
+    assert GenreMatcher(TOP_GENRES).match(["hip hop"]) == ["Hip Hop", "hop"]
+    assert GenreMatcher([]).match(["pop"]) == []
@@ -0,0 +1,47 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from graphStore import CSRGraph
+
+
+@pytest.fixture
+def csr() -> CSRGraph :
+    G = nx.Graph()
+    G.add_edge("spotify:track:a", "spotify:track:b", weight=2)
+    G.add_edge("spotify:track:b", "spotify:track:c", weight=1)
+    return CSRGraph.from_networkx(G)
+
+
+def test_indices_of_known_ids(csr) :
+    assert csr.indices_of(["spotify:track:c", "spotify:track:a"]).tolist() == [2, 0]
+    assert csr.index("spotify:track:b") == 1
+    assert csr.indices_of([]).tolist() == []
+
+
+def test_overlong_unknown_id_is_not_truncated_to_a_real_one(csr) :
+    with pytest.raises(KeyError) :
+        csr.indices_of(["spotify:track:aXYZ"])
+    with pytest.raises(KeyError) :
+        csr.indices_of(["spotify:track:b", "spotify:track:c-not-a-track"])
+    with pytest.raises(KeyError) :
+        csr.index("spotify:track:aXYZ")
+
+
+def test_ids_of_the_wrong_type_are_missing(csr) :
+    with pytest.raises(KeyError) :
+        csr.indices_of([1])
+    with pytest.raises(TypeError) :
+        csr.indices_of("spotify:track:a")
+
+
+def test_integer_and_tuple_ids_keep_their_type() :
+    ints = CSRGraph.from_networkx(nx.path_graph(3))
+    assert ints.nodes.dtype == np.int64
+    assert ints.indices_of([2, 0]).tolist() == [2, 0]
+    with pytest.raises(KeyError) :
+        ints.indices_of(["2"])
+    tuples = CSRGraph.from_networkx(nx.relabel_nodes(nx.path_graph(3), {i : (i, "t") for i in range(3)}))
+    assert tuples.index((1, "t")) == 1
+    with pytest.raises(KeyError) :
+        tuples.indices_of([(5, "t")])
@@ -0,0 +1,85 @@
+import asyncio
+import numpy as np
+import pandas as pd
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from NetworkAnalysis import NetworkAnalysis
+from audioIndex import AUDIO_FEATURES
+from server import RecommendationService, create_app
+
+TRACKS = [f"spotify:track:{i:022d}" for i in range(12)]
+KNOWN = TRACKS[0]
+# Longer than every stored ID and starting with a real one, the shape fixed-width string casts used to truncate
+OVERLONG = KNOWN + "XYZ"
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory) -> str :
+    path = tmp_path_factory.mktemp("server")
+    rng = np.random.default_rng(0)
+    interactions = pd.DataFrame({"playlist_id" : np.repeat(np.arange(6), 4),
+                                 "song_id" : [TRACKS[(p * 2 + i) % len(TRACKS)] for p in range(6) for i in range(4)]})
+    interactions.to_csv(path / "interactions.csv", index=False)
+    network = NetworkAnalysis(str(path / "interactions.csv"))
+    # Every track but the last has audio features
+    for attr in AUDIO_FEATURES :
+        network.G.table.set_column(attr, TRACKS[:-1], rng.random(len(TRACKS) - 1).tolist())
+    network.save_store(str(path / "store"))
+    NetworkAnalysis(str(path / "store")).train_embeddings(dimensions=4, num_walks=2, walk_length=5, seed=0)
+    return str(path / "store")
+
+
+def request(store : str, method : str, url : str, patch = None, **kwargs) -> tuple :
+    '''(status, JSON body, cached results) of one request against a fresh server'''
+    async def run() :
+        service = RecommendationService(store, reload_interval=0)
+        async with TestClient(TestServer(create_app(service))) as client :
+            if(patch is not None) :
+                patch(service.state)
+            response = await client.request(method, url, **kwargs)
+            return response.status, await response.json(), len(service.cache)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("method, url, kwargs", [
+    ("GET", "/recommend/walk", {"params" : {"track" : OVERLONG}}),
+    ("GET", "/recommend/continue", {"params" : {"tracks" : f"{TRACKS[1]},{OVERLONG}"}}),
+    ("POST", "/recommend/continue", {"json" : {"tracks" : [OVERLONG]}}),
+    ("GET", "/recommend/similar", {"params" : {"track" : OVERLONG}}),
+    ("GET", "/recommend/sound_alike", {"params" : {"track" : OVERLONG}}),
+])
+def test_unknown_track_is_404_and_not_cached(store, method, url, kwargs) :
+    status, body, cached = request(store, method, url, **kwargs)
+    assert status == 404
+    assert OVERLONG in body["error"]
+    assert cached == 0
+
+
+def test_track_without_audio_features_is_404(store) :
+    status, body, _ = request(store, "GET", "/recommend/sound_alike", params={"track" : TRACKS[-1]})
+    assert status == 404
+    assert "audio features" in body["error"]
+
+
+@pytest.mark.parametrize("url, params", [
+    ("/recommend/walk", {"track" : KNOWN}),
+    ("/recommend/continue", {"tracks" : KNOWN}),
+    ("/recommend/similar", {"track" : KNOWN}),
+    ("/recommend/sound_alike", {"track" : KNOWN}),
+])
+def test_known_track_is_served_and_cached(store, url, params) :
+    status, body, cached = request(store, "GET", url, params=params)
+    assert status == 200
+    assert body["recommendations"]
+    assert cached == 1
+
+
+def test_internal_key_error_is_500(store) :
+    def broken(state) :
+        def similar_tracks(tracks, k = 10) :
+            raise KeyError("bug")
+        state.network.similar_tracks = similar_tracks
+    status, _, cached = request(store, "GET", "/recommend/similar", patch=broken, params={"track" : KNOWN})
+    assert status == 500
+    assert cached == 0
@@ -0,0 +1,309 @@
+import random
+import numpy as np
+import networkx as nx
+from collections import deque
+from graphStore import CSRGraph
+from featureStore import FeatureStore
+import instrumentation
+
+'''Graph walk engine over CSR arrays. Produces the same walks as graphWalk.graphWalk (highest edge weight or
+highest cosine similarity among unplayed neighbours, random tie-break, teleports to unplayed tracks) but
+neighbour lists are pre-sorted by weight once, and the played-tracks window is kept as a hash set.'''
+
+
+class CSRWalker :
+    '''Recommendation walker over a CSRGraph
+    csr : CSRGraph -> graph arrays, e.g. NetworkAnalysis.csr or CSRGraph.load(store)
+    G : nx.Graph -> graph holding the node attributes used by context walks, not needed otherwise
+    seed : int -> seed of the walker's random generator'''
+
+    def __init__(self, csr : CSRGraph, G : nx.Graph = None, seed : int = None) -> None :
+        self.csr = csr
+        self.G = G
+        self.rng = random.Random(seed)
+        self.num_nodes = csr.num_nodes
+
+        # Sort each adjacency row by descending weight. tie_end[pos] is the end of the run of equal weights
+        # starting at pos, so the argmax-weight neighbours of a node are sorted_indices[indptr[u] : tie_end[indptr[u]]]
+        indptr = np.asarray(csr.indptr)
+        weights = np.asarray(csr.weights)
+        rows = np.repeat(np.arange(self.num_nodes), np.diff(indptr))
+        order = np.lexsort((-weights, rows))
+        self.indptr = indptr
+        self.sorted_indices = np.asarray(csr.indices)[order]
+        sorted_weights = weights[order]
+        boundary = np.ones(len(order) + 1, dtype=bool)
+        boundary[1:-1] = (rows[1:] != rows[:-1]) | (sorted_weights[1:] != sorted_weights[:-1])
+        starts = np.flatnonzero(boundary)
+        self.tie_end = np.repeat(starts[1:], np.diff(starts))
+        self.sorted_weights = sorted_weights
+        # Row-major (row * num_nodes + column) key of every CSR entry, sorted, for vectorised edge lookups
+        self.edge_keys = rows * self.num_nodes + np.asarray(csr.indices)
+
+        self._features = {}
+
+    def _feature_matrix(self, attributes : list) -> np.ndarray :
+        '''Row-normalised attribute matrix in CSR row order, so that a dot product between two rows is their cosine similarity'''
+        key = tuple(attributes)
+        if(key not in self._features) :
+            self._features[key] = FeatureStore(self.G, attributes, nodes=self.csr.nodes.tolist())
+        return self._features[key].matrix
+
+    def _teleport(self, played : dict) -> int :
+        if(len(played) >= self.num_nodes) :
+            raise IndexError("Cannot teleport, every track has been played")
+        while True :
+            candidate = self.rng.randrange(self.num_nodes)
+            if(candidate not in played) :
+                return candidate
+
+    def _max_weight_neighbour(self, u : int, played : dict) -> int :
+        pos = int(self.indptr[u])
+        end = int(self.indptr[u + 1])
+        while pos < end :
+            group_end = int(self.tie_end[pos])
+            size = group_end - pos
+            if(size > 4 * len(played)) :
+                # Most of the group is unplayed, rejection sampling stays uniform over the unplayed ones
+                for _ in range(8) :
+                    candidate = int(self.sorted_indices[pos + self.rng.randrange(size)])
+                    if(candidate not in played) :
+                        return candidate
+            candidates = [c for c in self.sorted_indices[pos : group_end].tolist() if c not in played]
+            if(candidates) :
+                return self.rng.choice(candidates)
+            pos = group_end
+        return -1
+
+    def _max_similarity_neighbour(self, u : int, played : dict, F : np.ndarray) -> int :
+        neighbours = np.asarray(self.csr.indices[self.indptr[u] : self.indptr[u + 1]])
+        if(played) :
+            neighbours = neighbours[[c not in played for c in neighbours.tolist()]]
+        if(len(neighbours) == 0) :
+            return -1
+        similarity = F[neighbours] @ F[u]
+        candidates = neighbours[similarity == similarity.max()]
+        return int(candidates[self.rng.randrange(len(candidates))])
+
+    def next_track(self, u : int, played : dict, teleport : float = 0.1, F : np.ndarray = None) -> int :
+        '''Row of the next track after row u, or -1 when u has no unplayed neighbour (see graphWalk.getRecommendation)
+        played : dict -> played-track window as row -> number of occurrences
+        F : np.ndarray -> normalised feature matrix for context walks, None to follow edge weights'''
+        if(self.rng.random() <= teleport) :
+            return self._teleport(played)
+        if(F is not None) :
+            return self._max_similarity_neighbour(u, played, F)
+        return self._max_weight_neighbour(u, played)
+
+    def walk(self, start : int, walk_length : int = 10, teleport : float = 0.1, context : bool = False, attributes : list = ['popularity']) -> list :
+        '''Rows visited by a walk from row start, start included. Same parameters as graphWalk.graphWalk'''
+        F = self._feature_matrix(attributes) if context else None
+        path = [start]
+        window = deque()
+        played = {}
+        current = start
+        for _ in range(walk_length) :
+            next_track = self.next_track(current, played, teleport=teleport, F=F)
+            if(next_track < 0) :
+                next_track = self.rng.randrange(self.num_nodes)
+
+            window.append(next_track)
+            played[next_track] = played.get(next_track, 0) + 1
+            if(len(window) > walk_length) :
+                dropped = window.popleft()
+                played[dropped] -= 1
+                if(played[dropped] == 0) :
+                    del played[dropped]
+
+            path.append(next_track)
+            current = next_track
+        return path
+
+    @instrumentation.timed("walk_duration_seconds", stage="CSRWalker.graph_walk")
+    def graph_walk(self, current_track, walk_length : int = 10, teleport : float = 0.1, context : bool = False, attributes : list = ['popularity']) -> list :
+        '''Take a starting track ID and return the recommended track IDs in walk order, without duplicates,
+        i.e. the keys of graphWalk.graphWalk's result'''
+        path = self.walk(self.csr.index(current_track), walk_length=walk_length, teleport=teleport, context=context, attributes=attributes)
+        instrumentation.count("walk_steps_total", len(path) - 1, walk="CSRWalker.graph_walk")
+        return list(dict.fromkeys(self.csr.nodes[path].tolist()))
+
+    def _batch_max_weight(self, rng : np.random.Generator, paths : np.ndarray, step : int, walking : np.ndarray,
+                          played_keys : np.ndarray, next_tracks : np.ndarray) -> None :
+        '''Lockstep version of _max_weight_neighbour for the walks in `walking`, writes their choice into next_tracks'''
+        current = paths[walking, step - 1]
+        group_start = self.indptr[current]
+        row_end = self.indptr[current + 1]
+        # Distinct tracks of each walk's played window, duplicates masked out
+        played = np.sort(paths[walking, 1 : step], axis=1)
+        distinct = np.ones(played.shape, dtype=bool)
+        distinct[:, 1:] = played[:, 1:] != played[:, :-1]
+        played_weight = self._edge_weights(current, played)
+
+        while len(walking) :
+            group_size = self.tie_end[group_start] - group_start
+            group_weight = self.sorted_weights[group_start]
+            unplayed = group_size - ((played_weight == group_weight[:, None]) & distinct).sum(axis=1)
+
+            # The whole argmax group has been played, move on to the next weight
+            exhausted = unplayed == 0
+            group_start = np.where(exhausted, group_start + group_size, group_start)
+            dead = exhausted & (group_start >= row_end)
+            ready = ~exhausted
+            # Uniform pick among the unplayed tracks of the group by rejection sampling
+            for _ in range(16) :
+                idx = np.flatnonzero(ready)
+                if not len(idx) :
+                    break
+                candidates = self.sorted_indices[group_start[idx] + (rng.random(len(idx)) * group_size[idx]).astype(np.int64)].astype(np.int64)
+                accepted = ~_contains(played_keys, walking[idx] * self.num_nodes + candidates)
+                next_tracks[walking[idx[accepted]]] = candidates[accepted]
+                ready[idx[accepted]] = False
+            # Groups that are mostly played are finished one walk at a time
+            for i in np.flatnonzero(ready) :
+                window = set(paths[walking[i], 1 : step].tolist())
+                group = self.sorted_indices[group_start[i] : group_start[i] + group_size[i]].tolist()
+                candidates = [c for c in group if c not in window]
+                next_tracks[walking[i]] = candidates[rng.integers(len(candidates))]
+
+            keep = exhausted & ~dead
+            walking = walking[keep]
+            group_start = group_start[keep]
+            row_end = row_end[keep]
+            played_weight = played_weight[keep]
+            distinct = distinct[keep]
+
+    def _edge_weights(self, u : np.ndarray, v : np.ndarray) -> np.ndarray :
+        '''Weights of the edges (u[i], v[i, j]), NaN where there is no edge'''
+        weights = np.full(v.shape, np.nan)
+        if(len(self.edge_keys) == 0 or v.size == 0) :
+            return weights
+        keys = u[:, None] * self.num_nodes + v
+        pos = np.minimum(np.searchsorted(self.edge_keys, keys), len(self.edge_keys) - 1)
+        found = self.edge_keys[pos] == keys
+        weights[found] = np.asarray(self.csr.weights)[pos[found]]
+        return weights
+
+    def batch_walk(self, starts : np.ndarray, walk_length : int = 10, teleport : float = 0.1, context : bool = False,
+                   attributes : list = ['popularity'], seed : int = None, F : np.ndarray = None) -> np.ndarray :
+        '''Run one walk per start row in lockstep, every step advances all walks at once with NumPy array
+        operations under the same rules as walk()
+        starts : np.ndarray -> start rows
+        F : np.ndarray -> normalised feature matrix for context walks, built from G when not given
+
+        returns : int array of shape (len(starts), walk_length + 1) with the visited rows, starts in column 0'''
+        rng = np.random.default_rng(seed)
+        if(context and F is None) :
+            F = self._feature_matrix(attributes)
+        starts = np.asarray(starts, dtype=np.int64)
+        num_walks = len(starts)
+        paths = np.empty((num_walks, walk_length + 1), dtype=np.int64)
+        paths[:, 0] = starts
+        walk_ids = np.arange(num_walks, dtype=np.int64)
+        indptr = self.indptr
+        indices = np.asarray(self.csr.indices)
+
+        for step in range(1, walk_length + 1) :
+            current = paths[:, step - 1]
+            # Played window: every track recommended so far in the walk (the seed itself is not part of it)
+            played_keys = np.sort((walk_ids[:, None] * self.num_nodes + paths[:, 1 : step]).ravel())
+            next_tracks = np.full(num_walks, -1, dtype=np.int64)
+
+            teleporting = rng.random(num_walks) <= teleport
+            todo = np.flatnonzero(teleporting)
+            while len(todo) :
+                candidates = rng.integers(self.num_nodes, size=len(todo))
+                accepted = ~_contains(played_keys, todo * self.num_nodes + candidates)
+                next_tracks[todo[accepted]] = candidates[accepted]
+                todo = todo[~accepted]
+
+            walking = np.flatnonzero(~teleporting)
+            degree = indptr[current[walking] + 1] - indptr[current[walking]]
+            walking = walking[degree > 0]
+            if(len(walking) and not context) :
+                self._batch_max_weight(rng, paths, step, walking, played_keys, next_tracks)
+            elif(len(walking)) :
+                degree = degree[degree > 0]
+                # Flatten the adjacency rows of all current tracks into one array of (walk, neighbour) entries
+                segment_starts = np.zeros(len(walking), dtype=np.int64)
+                np.cumsum(degree[:-1], out=segment_starts[1:])
+                segment = np.repeat(np.arange(len(walking)), degree)
+                positions = np.arange(degree.sum()) - segment_starts[segment] + indptr[current[walking]][segment]
+                neighbours = indices[positions].astype(np.int64)
+                owners = walking[segment]
+
+                score = np.einsum('ij,ij->i', F[neighbours], F[current[owners]])
+                score[_contains(played_keys, owners * self.num_nodes + neighbours)] = -np.inf
+
+                best = np.maximum.reduceat(score, segment_starts)
+                # Random tie-break: among the entries equal to their segment's maximum keep the one with the largest random key
+                key = rng.random(len(score))
+                key[score != best[segment]] = -1
+                winners = np.flatnonzero(key == np.maximum.reduceat(key, segment_starts)[segment])
+                _, first = np.unique(segment[winners], return_index=True)
+                chosen = neighbours[winners[first]]
+                found = np.isfinite(best)
+                next_tracks[walking[found]] = chosen[found]
+
+            # Dead ends and fully played neighbourhoods restart from any track, as in graphWalk
+            dead = np.flatnonzero(next_tracks < 0)
+            next_tracks[dead] = rng.integers(self.num_nodes, size=len(dead))
+            paths[:, step] = next_tracks
+
+        return paths
+
+
+def _contains(sorted_keys : np.ndarray, keys : np.ndarray) -> np.ndarray :
+    '''Membership of keys in a sorted key array'''
+    if(len(sorted_keys) == 0) :
+        return np.zeros(len(keys), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[pos] == keys
+
+
+_WORKER = None
+
+
+def _init_worker(source, G : nx.Graph, F : np.ndarray) -> None :
+    global _WORKER
+    csr = CSRGraph.load(source) if isinstance(source, str) else source
+    _WORKER = (CSRWalker(csr, G), F)
+
+
+def _walk_shard(starts : np.ndarray, walk_length : int, teleport : float, context : bool, attributes : list, seed : int) -> np.ndarray :
+    walker, F = _WORKER
+    return walker.batch_walk(starts, walk_length=walk_length, teleport=teleport, context=context, attributes=attributes, seed=seed, F=F)
+
+
+@instrumentation.timed("walk_duration_seconds", stage="batch_graph_walk")
+def batch_graph_walk(source, seed_tracks : list, walk_length : int = 10, teleport : float = 0.1, context : bool = False,
+                     attributes : list = ['popularity'], G : nx.Graph = None, n_jobs : int = 1, chunk_size : int = 10_000,
+                     seed : int = None) -> np.ndarray :
+    '''Walk from thousands of seed tracks at once
+    source : str/CSRGraph -> path of a graph store (workers memory-map it) or an in-memory CSRGraph
+    seed_tracks : list -> starting track IDs
+    G : nx.Graph -> graph holding the node attributes, only needed for context walks
+    n_jobs : int -> number of worker processes, seeds are sharded in chunks of chunk_size
+    seed : int -> seed for reproducible walks
+
+    returns : array of track IDs of shape (len(seed_tracks), walk_length + 1), one walk per row'''
+    csr = CSRGraph.load(source) if isinstance(source, str) else source
+    walker = CSRWalker(csr, G)
+    F = walker._feature_matrix(attributes) if context else None
+    starts = csr.indices_of(seed_tracks)
+    shards = [starts[i : i + chunk_size] for i in range(0, len(starts), chunk_size)]
+    shard_seeds = np.random.SeedSequence(seed).spawn(len(shards))
+    params = (walk_length, teleport, context, attributes)
+
+    if(n_jobs == 1 or len(shards) == 1) :
+        paths = [walker.batch_walk(shard, *params, seed=s, F=F) for shard, s in zip(shards, shard_seeds)]
+    else :
+        from concurrent.futures import ProcessPoolExecutor
+        # Node attributes are already folded into F, workers only need the adjacency arrays
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(source, None, F)) as pool :
+            futures = [pool.submit(_walk_shard, shard, *params, s) for shard, s in zip(shards, shard_seeds)]
+            paths = [future.result() for future in futures]
+
+    instrumentation.count("walk_steps_total", len(starts) * walk_length, walk="batch_graph_walk")
+    if not paths :
+        return np.empty((0, walk_length + 1), dtype=csr.nodes.dtype)
+    return csr.nodes[np.concatenate(paths)]